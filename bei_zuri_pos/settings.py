@@ -15,6 +15,16 @@ DEBUG = os.environ.get("DEBUG", "True") == "True"
 IS_DESKTOP = os.environ.get("IS_DESKTOP", "False") == "True"
 IS_VPS = not IS_DESKTOP
 
+# Keep SKU/barcode lookups in process memory. Only safe where a single process
+# serves the till (the desktop app); multi-worker servers would see stale prices.
+PRODUCT_LOOKUP_INDEX = (
+    os.environ.get("PRODUCT_LOOKUP_INDEX", str(IS_DESKTOP)) == "True"
+)
+
+# Keep rendered receipts in the (per-process) cache for reprints; desktop only
+# for the same reason, as other workers would not see the invalidation.
+RECEIPT_CACHE = os.environ.get("RECEIPT_CACHE", str(IS_DESKTOP)) == "True"
+
 ALLOWED_HOSTS = [h.strip() for h in os.environ.get("ALLOWED_HOSTS", "").split(",") if h.strip()]
 
 
@@ -50,6 +60,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "sync.middleware.SyncApiMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -84,13 +95,23 @@ if IS_DESKTOP:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue up instead of failing with "database is locked"
+            "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+            # A file, not the in-memory default, so concurrency tests can open
+            # a second connection that waits on the lock like a second till
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
         }
     }
 
     SERVER_API_URL = os.environ.get("SERVER_API_URL", "")
     SERVER_API_TOKEN = os.environ.get("SERVER_API_TOKEN", "")
+    # Unique per terminal: it is part of every sale and return number, and the
+    # server refuses pushes under an id another terminal has registered
     STORE_ID = os.environ.get("STORE_ID", "1")
     SYNC_INTERVAL = int(os.environ.get("SYNC_INTERVAL", "300"))
+    # Seconds to wait after a sale before pushing, so a burst goes as one batch
+    SYNC_PUSH_DEBOUNCE = float(os.environ.get("SYNC_PUSH_DEBOUNCE", "3"))
     ENABLE_SYNC = os.environ.get("ENABLE_SYNC", "False") == "True"
 else:
     DATABASES = {
@@ -104,6 +125,11 @@ else:
         }
     }
 
+    STORE_ID = os.environ.get("STORE_ID", "0")
+
+# Most sales pushed or stored per request/transaction by the sync endpoints
+SYNC_PUSH_BATCH_SIZE = int(os.environ.get("SYNC_PUSH_BATCH_SIZE", "200"))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"
@@ -146,6 +172,9 @@ LOGOUT_REDIRECT_URL = "/users/login/"
 PRINT_SERVER_URL = "http://localhost:8080"
 RECEIPT_BASE_URL = os.environ.get("RECEIPT_BASE_URL", "http://localhost:8000")
 
+# Where the print spooler sends receipts: "usb" or "stub" (keeps them in memory)
+PRINTER_BACKEND = os.environ.get("PRINTER_BACKEND", "usb")
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -1,10 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum, Count, F
+from django.db.models import Sum, F
 from django.utils import timezone
 from sales.models import Sale, Return
 from products.models import Product
+from reports.models import SalesRollup
+from reports.rollup import sales_summary
 from payments.models import Debt
 from users.models import User
 from delivery.models import Delivery
@@ -61,11 +63,11 @@ def cashier_dashboard(request):
         messages.error(request, "Access denied")
         return redirect("dashboard")
 
-    today = timezone.now().date()
+    today = timezone.localdate()
 
-    today_sales = Sale.objects.filter(
-        cashier=request.user, completed_at__date=today
-    ).aggregate(total=Sum("final_amount"), count=Count("id"))
+    rollups = SalesRollup.objects.filter(cashier=request.user)
+
+    today_sales = sales_summary(rollups.filter(date=today))
 
     recent_sales = (
         Sale.objects.filter(cashier=request.user, completed_at__isnull=False)
@@ -74,13 +76,11 @@ def cashier_dashboard(request):
     )
 
     month_start = today.replace(day=1)
-    month_sales = Sale.objects.filter(
-        cashier=request.user, completed_at__date__gte=month_start
-    ).aggregate(total=Sum("final_amount"), count=Count("id"))
+    month_sales = sales_summary(rollups.filter(date__gte=month_start))
 
-    pending_returns = Return.objects.filter(
-        cashier=request.user, created_at__date=today
-    ).count()
+    pending_returns = (
+        rollups.filter(date=today).aggregate(count=Sum("return_count"))["count"] or 0
+    )
 
     avg_transaction = 0
     if today_sales.get("count") and today_sales.get("count") > 0:
@@ -103,24 +103,28 @@ def supervisor_dashboard(request):
         messages.error(request, "Access denied")
         return redirect("dashboard")
 
-    today = timezone.now().date()
+    today = timezone.localdate()
     week_ago = today - timezone.timedelta(days=7)
     month_start = today.replace(day=1)
 
     # Sales statistics
-    today_sales = Sale.objects.filter(completed_at__date=today).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
-    week_sales = Sale.objects.filter(completed_at__date__gte=week_ago).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
-    month_sales = Sale.objects.filter(completed_at__date__gte=month_start).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
+    today_sales = sales_summary(SalesRollup.objects.filter(date=today))
+    week_sales = sales_summary(SalesRollup.objects.filter(date__gte=week_ago))
+    month_sales = sales_summary(SalesRollup.objects.filter(date__gte=month_start))
 
     # Returns statistics
-    today_returns = Return.objects.filter(created_at__date=today).count()
-    week_returns = Return.objects.filter(created_at__date__gte=week_ago).count()
+    today_returns = (
+        SalesRollup.objects.filter(date=today).aggregate(count=Sum("return_count"))[
+            "count"
+        ]
+        or 0
+    )
+    week_returns = (
+        SalesRollup.objects.filter(date__gte=week_ago).aggregate(
+            count=Sum("return_count")
+        )["count"]
+        or 0
+    )
 
     # Delivery statistics
     pending_deliveries = Delivery.objects.filter(status='pending').count()
@@ -147,10 +151,11 @@ def supervisor_dashboard(request):
     # Top selling products today
     top_products_today = (
         Product.objects.filter(
-            saleitem__sale__completed_at__date=today,
+            sales_rollups__date=today,
+            sales_rollups__quantity__gt=0,
             is_active=True
         )
-        .annotate(sold_quantity=Sum('saleitem__quantity'))
+        .annotate(sold_quantity=Sum('sales_rollups__quantity'))
         .order_by('-sold_quantity')[:5]
     )
 
@@ -51,6 +51,55 @@ def check_initial_sync_status():
         return False
 
 
+def warm_product_index():
+    """Load the barcode/SKU lookup index before the first scan"""
+    try:
+        from django.conf import settings
+
+        if not settings.PRODUCT_LOOKUP_INDEX:
+            return
+
+        from products.lookup import product_index
+
+        count = product_index.load()
+        print(f"✓ Product lookup index loaded ({count} products)")
+    except Exception as e:
+        print(f"✗ Error loading product lookup index: {e}")
+
+
+def ensure_sales_rollup():
+    """Backfill the sales rollups the first time they are needed.
+
+    The product sales stats are seeded by migrate (reports.signals).
+    """
+    try:
+        from reports.models import SalesRollup
+        from sales.models import Sale
+
+        if not Sale.objects.filter(completed_at__isnull=False).exists():
+            return
+
+        from reports.rollup import rebuild
+
+        if not SalesRollup.objects.exists():
+            sale_rows, product_rows = rebuild()
+            print(f"✓ Sales rollups rebuilt ({sale_rows} rows, {product_rows} product rows)")
+    except Exception as e:
+        print(f"✗ Error rebuilding sales rollups: {e}")
+
+
+def start_print_spooler():
+    """Start the receipt print spooler and resume any unprinted jobs"""
+    try:
+        from hardware.print_queue import print_spooler
+
+        print_spooler.start()
+        print_spooler.notify()
+        print("✓ Print spooler started")
+    except Exception as e:
+        print(f"✗ Error starting print spooler: {e}")
+
+
 def start_background_sync():
     """Start the background sync service"""
     try:
@@ -87,6 +136,10 @@ def start_django(port):
             if not run_migrations():
                 print("⚠ Warning: Migrations failed, continuing anyway...")
 
+            warm_product_index()
+            ensure_sales_rollup()
+            start_print_spooler()
+
             # Start background sync (it will handle initial sync internally)
             start_background_sync()
 
@@ -1,3 +1,42 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class PrintJob(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("printing", "Printing"),
+        ("done", "Printed"),
+        ("failed", "Failed"),
+    ]
+
+    KIND_CHOICES = [
+        ("receipt", "Receipt"),
+        ("test", "Test Receipt"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default="receipt")
+    sale = models.ForeignKey(
+        "sales.Sale",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="print_jobs",
+    )
+    data = models.BinaryField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    printed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"Print job {self.id} ({self.kind}) - {self.status}"
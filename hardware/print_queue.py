@@ -0,0 +1,242 @@
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import PrintJob
+
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 60
+IDLE_WAIT = 60
+# Printed and failed jobs are kept this long for the print_job_status view
+JOB_RETENTION_DAYS = 7
+
+
+class PrinterError(Exception):
+    pass
+
+
+class UsbPrinterBackend:
+    """Sends jobs to the USB receipt printer through the shared printer session."""
+
+    def write(self, data):
+        from .printer_client import print_data
+
+        success, message = print_data(data)
+        if not success:
+            raise PrinterError(message)
+
+    def close(self):
+        pass
+
+
+class StubPrinterBackend:
+    """Keeps printed jobs in memory instead of sending them to a printer."""
+
+    def __init__(self):
+        self.printed = []
+        self.fail_next = 0
+
+    def write(self, data):
+        if self.fail_next:
+            self.fail_next -= 1
+            raise PrinterError("Stub printer failure")
+        self.printed.append(bytes(data))
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    "usb": UsbPrinterBackend,
+    "stub": StubPrinterBackend,
+}
+
+
+def get_backend():
+    name = getattr(settings, "PRINTER_BACKEND", "usb")
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise PrinterError(f"Unknown printer backend: {name}")
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+class PrintSpooler:
+    """Background thread that prints queued PrintJobs in order.
+
+    Jobs are stored in the database, so nothing is lost if the app closes
+    with jobs outstanding. Failed jobs are retried with exponential backoff
+    and marked failed after MAX_ATTEMPTS.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+
+            self.backend = get_backend()
+            PrintJob.objects.filter(status="printing").update(status="pending")
+            prune_jobs()
+
+            self.running = True
+            self.thread = threading.Thread(
+                target=self._run, daemon=True, name="print-spooler"
+            )
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        if self.backend:
+            self.backend.close()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.clear()
+            try:
+                delay = self.process_due_jobs()
+            except Exception as e:
+                print(f"Print spooler error: {e}")
+                delay = RETRY_BASE_DELAY
+            finally:
+                close_old_connections()
+            self.wakeup.wait(delay)
+
+    def process_due_jobs(self):
+        """Print every job that is due, then return seconds until the next one."""
+        while self.running:
+            job = (
+                PrintJob.objects.filter(
+                    status="pending", next_attempt_at__lte=timezone.now()
+                )
+                .order_by("id")
+                .first()
+            )
+            if job is None:
+                break
+            self.print_job(job)
+
+        next_attempt_at = (
+            PrintJob.objects.filter(status="pending")
+            .order_by("next_attempt_at")
+            .values_list("next_attempt_at", flat=True)
+            .first()
+        )
+        if next_attempt_at is None:
+            return IDLE_WAIT
+        return max((next_attempt_at - timezone.now()).total_seconds(), 0.1)
+
+    def print_job(self, job):
+        PrintJob.objects.filter(pk=job.pk).update(status="printing")
+        attempts = job.attempts + 1
+
+        try:
+            self.backend.write(bytes(job.data))
+        except Exception as e:
+            if attempts >= MAX_ATTEMPTS:
+                status = "failed"
+            else:
+                status = "pending"
+            PrintJob.objects.filter(pk=job.pk).update(
+                status=status,
+                attempts=attempts,
+                last_error=str(e),
+                next_attempt_at=timezone.now()
+                + timezone.timedelta(seconds=retry_delay(attempts)),
+            )
+            print(f"Print job {job.pk} failed (attempt {attempts}): {e}")
+            return False
+
+        PrintJob.objects.filter(pk=job.pk).update(
+            status="done",
+            attempts=attempts,
+            last_error="",
+            printed_at=timezone.now(),
+        )
+        return True
+
+
+print_spooler = PrintSpooler()
+
+
+def prune_jobs(days=JOB_RETENTION_DAYS):
+    """Delete printed and failed jobs older than `days`; returns how many."""
+    cutoff = timezone.now() - timezone.timedelta(days=days)
+    deleted, _ = PrintJob.objects.filter(
+        status__in=("done", "failed"), created_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def enqueue(data, kind="receipt", sale_id=None):
+    """Store a print job and wake the spooler once the transaction commits."""
+    job = PrintJob.objects.create(kind=kind, sale_id=sale_id, data=data)
+    transaction.on_commit(print_spooler.notify)
+    return job
+
+
+def send(data, kind="receipt", sale_id=None):
+    """Queue data with the spooler, or print it right away when it is not running.
+
+    Only the desktop app starts the spooler; elsewhere (e.g. the server) a
+    queued job would stay pending forever. Returns (success, message,
+    print_job_id), the id being None when printed inline.
+    """
+    if not print_spooler.running:
+        from .printer_client import print_data
+
+        success, message = print_data(data)
+        return success, "Receipt sent to printer" if success else message, None
+
+    job = enqueue(data, kind=kind, sale_id=sale_id)
+    return True, "Receipt sent to printer", job.id
+
+
+def queue_receipt(sale_id):
+    from .printer_client import get_receipt
+
+    receipt = get_receipt(sale_id)
+    if receipt is None:
+        raise PrinterError("Sale is not completed")
+    return send(receipt[1], sale_id=sale_id)
+
+
+def wait_for_job(job, timeout=10):
+    """Block until a job is printed or has failed; used for test prints."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job.refresh_from_db(fields=["status", "attempts", "last_error"])
+        if job.status in ("done", "failed"):
+            break
+        if job.attempts and job.status == "pending":
+            break
+        time.sleep(0.1)
+    return job
+
+
+def job_status(job):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.last_error,
+        "printed": job.status == "done",
+    }
@@ -1,5 +1,3 @@
-import usb.core
-import usb.util
 import json
 import os
 from django.conf import settings
@@ -7,6 +5,9 @@ from django.urls import reverse
 from django.utils import timezone
 from decimal import Decimal
 import pytz
+from functools import lru_cache
+from django.core.cache import cache
+from .printer_session import get_session
 
 
 def load_printer_config():
@@ -45,48 +46,15 @@ SET_LEFT_MARGIN = b"\x1d\x4c"
 
 
 def find_printer():
-    try:
-        dev = usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
-
-        if dev is None:
-            return None
-
-        try:
-            dev.set_configuration()
-        except usb.core.USBError as e:
-            pass
+    return get_printer_session().connect()
 
-        try:
-            usb.util.claim_interface(dev, 0)
-        except usb.core.USBError as e:
-            pass
 
-        return dev
-
-    except Exception as e:
-        return None
+def get_printer_session():
+    return get_session(VENDOR_ID, PRODUCT_ID, OUT_ENDPOINT)
 
 
 def print_data(data):
-    try:
-        dev = find_printer()
-        if dev is None:
-            return False, "Printer not found"
-
-        dev.write(OUT_ENDPOINT, data)
-
-        try:
-            usb.util.release_interface(dev, 0)
-        except:
-            pass
-
-        return True, "Print successful"
-
-    except usb.core.USBError as e:
-        return False, f"USB Error: {str(e)}"
-
-    except Exception as e:
-        return False, f"Error: {str(e)}"
+    return get_printer_session().write(data)
 
 
 def format_line(left, right, width=48):
@@ -125,168 +93,151 @@ def format_item_line(name, qty, price, total):
     )
 
 
+QR_SETUP = (
+    b"\x1d\x28\x6b\x04\x00\x31\x41\x32\x00"
+    b"\x1d\x28\x6b\x03\x00\x31\x43\x06"
+    b"\x1d\x28\x6b\x03\x00\x31\x45\x30"
+)
+QR_PRINT = b"\x1d\x28\x6b\x03\x00\x31\x51\x30"
+
+
 def generate_qr_code(data):
-    commands = bytearray()
-    commands.extend(b"\x1d\x28\x6b\x04\x00\x31\x41\x32\x00")
-    commands.extend(b"\x1d\x28\x6b\x03\x00\x31\x43\x06")
-    commands.extend(b"\x1d\x28\x6b\x03\x00\x31\x45\x30")
-    qr_len = len(data) + 3
+    encoded = data.encode()
+    qr_len = len(encoded) + 3
     pl = qr_len % 256
     ph = qr_len // 256
-    commands.extend(bytes([0x1D, 0x28, 0x6B, pl, ph, 0x31, 0x50, 0x30]) + data.encode())
-    commands.extend(b"\x1d\x28\x6b\x03\x00\x31\x51\x30")
-    return bytes(commands)
+    return (
+        QR_SETUP
+        + bytes([0x1D, 0x28, 0x6B, pl, ph, 0x31, 0x50, 0x30])
+        + encoded
+        + QR_PRINT
+    )
 
 
-def build_receipt(receipt_data):
-    receipt = bytearray()
-
-    receipt.extend(INIT)
-    receipt.extend(SET_LEFT_MARGIN + b"\x00\x00")
-
-    receipt.extend(ALIGN_CENTER)
-    receipt.extend(BOLD_ON)
-    receipt.extend(DOUBLE_HEIGHT)
-    receipt.extend(receipt_data["shop_name"].encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(NORMAL_SIZE)
-    receipt.extend(BOLD_OFF)
-
-    receipt.extend(receipt_data["address"].encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(receipt_data["phone"].encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
-
-    receipt.extend(ALIGN_LEFT)
-    receipt.extend(b"-" * 48)
-    receipt.extend(LINE_FEED)
-
-    receipt.extend(format_line("Sale No:", receipt_data["sale_number"]).encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(format_line("Date:", receipt_data["date"]).encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(format_line("Type:", receipt_data["sale_type"]).encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(format_line("Cashier:", receipt_data["cashier"]).encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(
-        format_line("Payment:", receipt_data["payment_method"]).encode("utf-8")
+# Static parts of the receipt, built once at import time
+RULE = b"-" * 48 + LINE_FEED
+DOUBLE_RULE = b"=" * 48 + LINE_FEED
+
+ITEMS_HEADER = (
+    RULE
+    + LINE_FEED
+    + BOLD_ON
+    + format_item_line("Item", "Qty", "Price", "Total").encode("utf-8")
+    + LINE_FEED
+    + BOLD_OFF
+    + RULE
+)
+TOTALS_START = RULE + LINE_FEED + ALIGN_RIGHT
+GRAND_TOTAL_START = ALIGN_LEFT + DOUBLE_RULE + BOLD_ON + DOUBLE_HEIGHT
+GRAND_TOTAL_END = LINE_FEED + NORMAL_SIZE + BOLD_OFF + DOUBLE_RULE + LINE_FEED
+QR_SECTION_START = LINE_FEED + ALIGN_CENTER + b"'" * 32 + LINE_FEED + LINE_FEED
+QR_CAPTION = LINE_FEED + b"Scan for details\n"
+FOOTER = (
+    LINE_FEED
+    + b"Thank you for your purchase!\n"
+    + b"Please come again\n"
+    + b"Goods once sold will not be re-accepted\n"
+    + LINE_FEED * 3
+    + CUT_PAPER
+)
+
+
+@lru_cache(maxsize=8)
+def receipt_header(shop_name, address, phone):
+    return (
+        INIT
+        + SET_LEFT_MARGIN
+        + b"\x00\x00"
+        + ALIGN_CENTER
+        + BOLD_ON
+        + DOUBLE_HEIGHT
+        + shop_name.encode("utf-8")
+        + LINE_FEED
+        + NORMAL_SIZE
+        + BOLD_OFF
+        + address.encode("utf-8")
+        + LINE_FEED
+        + phone.encode("utf-8")
+        + LINE_FEED
+        + LINE_FEED
+        + ALIGN_LEFT
+        + RULE
     )
-    receipt.extend(LINE_FEED)
-
-    receipt.extend(b"-" * 48)
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
-
-    receipt.extend(BOLD_ON)
-    header = format_item_line("Item", "Qty", "Price", "Total")
-    receipt.extend(header.encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(BOLD_OFF)
-    receipt.extend(b"-" * 48)
-    receipt.extend(LINE_FEED)
-
-    for item in receipt_data["items"]:
-        item_line = format_item_line(
-            item["name"], item["quantity"], item["unit_price"], item["total"]
-        )
-        receipt.extend(item_line.encode("utf-8"))
-        receipt.extend(LINE_FEED)
 
-    receipt.extend(b"-" * 48)
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
 
-    receipt.extend(ALIGN_RIGHT)
-    receipt.extend(
-        format_line("", f"Subtotal: {receipt_data['subtotal']}").encode("utf-8")
-    )
-    receipt.extend(LINE_FEED)
+def encode_lines(lines):
+    return "".join(line + "\n" for line in lines).encode("utf-8")
 
-    if float(receipt_data.get("special_amount", 0)) != 0:
-        receipt.extend(
-            format_line(
-                "", f"Special Discount: {receipt_data['special_amount']}"
-            ).encode("utf-8")
-        )
-        receipt.extend(LINE_FEED)
 
-    if float(receipt_data.get("discount_amount", 0)) != 0:
-        receipt.extend(
-            format_line("", f"Discount: {receipt_data['discount_amount']}").encode(
-                "utf-8"
+def build_receipt(receipt_data):
+    parts = [
+        receipt_header(
+            receipt_data["shop_name"], receipt_data["address"], receipt_data["phone"]
+        ),
+        encode_lines(
+            [
+                format_line("Sale No:", receipt_data["sale_number"]),
+                format_line("Date:", receipt_data["date"]),
+                format_line("Type:", receipt_data["sale_type"]),
+                format_line("Cashier:", receipt_data["cashier"]),
+                format_line("Payment:", receipt_data["payment_method"]),
+            ]
+        ),
+        ITEMS_HEADER,
+        encode_lines(
+            format_item_line(
+                item["name"], item["quantity"], item["unit_price"], item["total"]
             )
-        )
-        receipt.extend(LINE_FEED)
-
-    receipt.extend(ALIGN_LEFT)
-    receipt.extend(b"=" * 48)
-    receipt.extend(LINE_FEED)
+            for item in receipt_data["items"]
+        ),
+        TOTALS_START,
+    ]
 
-    receipt.extend(BOLD_ON)
-    receipt.extend(DOUBLE_HEIGHT)
-    receipt.extend(format_line("TOTAL:", receipt_data["total"]).encode("utf-8"))
-    receipt.extend(LINE_FEED)
-    receipt.extend(NORMAL_SIZE)
-    receipt.extend(BOLD_OFF)
+    totals = [format_line("", f"Subtotal: {receipt_data['subtotal']}")]
+    if float(receipt_data.get("special_amount", 0)) != 0:
+        totals.append(
+            format_line("", f"Special Discount: {receipt_data['special_amount']}")
+        )
+    if float(receipt_data.get("discount_amount", 0)) != 0:
+        totals.append(format_line("", f"Discount: {receipt_data['discount_amount']}"))
+    parts.append(encode_lines(totals))
 
-    receipt.extend(b"=" * 48)
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
+    parts.append(GRAND_TOTAL_START)
+    parts.append(format_line("TOTAL:", receipt_data["total"]).encode("utf-8"))
+    parts.append(GRAND_TOTAL_END)
 
     if receipt_data.get("payment_method") == "Cash":
         if receipt_data.get("money_received"):
-            receipt.extend(ALIGN_RIGHT)
-            receipt.extend(
-                format_line("", f"Paid: {receipt_data['money_received']}").encode(
-                    "utf-8"
-                )
+            parts.append(ALIGN_RIGHT)
+            parts.append(
+                encode_lines([format_line("", f"Paid: {receipt_data['money_received']}")])
             )
-            receipt.extend(LINE_FEED)
 
         if (
             receipt_data.get("change_amount")
             and float(receipt_data["change_amount"]) > 0
         ):
-            receipt.extend(ALIGN_RIGHT)
-            receipt.extend(
-                format_line("", f"Change: {receipt_data['change_amount']}").encode(
-                    "utf-8"
-                )
+            parts.append(ALIGN_RIGHT)
+            parts.append(
+                encode_lines([format_line("", f"Change: {receipt_data['change_amount']}")])
             )
-            receipt.extend(LINE_FEED)
 
-    receipt.extend(LINE_FEED)
-    receipt.extend(ALIGN_CENTER)
-    receipt.extend(b"'" * 32)
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
+    parts.append(QR_SECTION_START)
 
     try:
         qr_data = receipt_data.get("qr_code_data", "http://localhost:8080")
-        receipt.extend(generate_qr_code(qr_data))
-        receipt.extend(LINE_FEED)
-        receipt.extend(b"Scan for details\n")
+        parts.append(generate_qr_code(qr_data) + QR_CAPTION)
     except Exception as e:
         pass
 
-    receipt.extend(LINE_FEED)
-    receipt.extend(b"Thank you for your purchase!\n")
-    receipt.extend(b"Please come again\n")
-    receipt.extend(b"Goods once sold will not be re-accepted\n")
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
-    receipt.extend(LINE_FEED)
+    parts.append(FOOTER)
 
-    receipt.extend(CUT_PAPER)
-
-    return bytes(receipt)
+    return b"".join(parts)
 
 
 def format_receipt_data(sale):
     items = []
-    for item in sale.items.all():
+    for item in sale.items.select_related("product"):
         items.append(
             {
                 "name": item.product.name,
@@ -325,12 +276,59 @@ def format_receipt_data(sale):
     return receipt
 
 
+RECEIPT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def receipt_cache_key(sale_id):
+    return f"receipt:{sale_id}"
+
+
+def get_receipt(sale_id):
+    """(receipt_data, receipt_bytes) for a completed sale, or None.
+
+    With RECEIPT_CACHE on, rendered once and kept in the cache until the
+    sale is saved again.
+    """
+    use_cache = getattr(settings, "RECEIPT_CACHE", False)
+    key = receipt_cache_key(sale_id)
+    if use_cache:
+        receipt = cache.get(key)
+        if receipt is not None:
+            return receipt
+
+    from sales.models import Sale
+
+    sale = (
+        Sale.objects.select_related("cashier")
+        .filter(id=sale_id, completed_at__isnull=False)
+        .first()
+    )
+    if sale is None:
+        return None
+
+    receipt_data = format_receipt_data(sale)
+    receipt = (receipt_data, build_receipt(receipt_data))
+    if use_cache:
+        cache.set(key, receipt, RECEIPT_CACHE_TIMEOUT)
+    return receipt
+
+
+def invalidate_receipt(sale_id):
+    cache.delete(receipt_cache_key(sale_id))
+
+
+def invalidate_receipts(sale_ids):
+    """For bulk writes to sales, which send no post_save signal."""
+    cache.delete_many([receipt_cache_key(sale_id) for sale_id in sale_ids])
+
+
 def print_receipt(sale, timeout=5):
     try:
-        receipt_data = format_receipt_data(sale)
-        receipt_bytes = build_receipt(receipt_data)
+        receipt = get_receipt(sale.id)
+        if receipt is None:
+            return False, "Sale is not completed"
 
-        success, message = print_data(receipt_bytes)
+        success, message = print_data(receipt[1])
 
         if success:
             return True, "Receipt printed successfully"
@@ -342,58 +340,47 @@ def print_receipt(sale, timeout=5):
 
 
 def check_printer_status():
-    try:
-        dev = find_printer()
+    ready, message = get_printer_session().status()
+    return ready, message
 
-        if dev is None:
-            return False, "Printer not found. Please check USB connection."
 
-        try:
-            usb.util.release_interface(dev, 0)
-        except:
-            pass
-
-        return True, "Printer is ready"
+def test_receipt_data():
+    from datetime import datetime
 
-    except Exception as e:
-        return False, str(e)
+    return {
+        "shop_name": "BEIZURI",
+        "address": "Bondo Town, Siaya",
+        "phone": "Tel: +254 785 053 060",
+        "sale_number": "TEST-001",
+        "date": datetime.now().strftime("%d/%m/%Y %H:%M"),
+        "sale_type": "Test",
+        "cashier": "System",
+        "items": [
+            {
+                "name": "Test Item 1",
+                "quantity": 2,
+                "unit_price": "100.00",
+                "total": "200.00",
+            },
+            {
+                "name": "Test Item 2 With Very Long Name That Needs Truncation",
+                "quantity": 1,
+                "unit_price": "50.00",
+                "total": "50.00",
+            },
+        ],
+        "subtotal": "250.00",
+        "special_amount": "0.00",
+        "discount_amount": "0.00",
+        "total": "250.00",
+        "payment_method": "Cash",
+        "qr_code_data": "http://localhost:8080",
+    }
 
 
 def print_test_receipt():
-    from datetime import datetime
-
     try:
-        test_receipt = {
-            "shop_name": "BEIZURI",
-            "address": "Bondo Town, Siaya",
-            "phone": "Tel: +254 785 053 060",
-            "sale_number": "TEST-001",
-            "date": datetime.now().strftime("%d/%m/%Y %H:%M"),
-            "sale_type": "Test",
-            "cashier": "System",
-            "items": [
-                {
-                    "name": "Test Item 1",
-                    "quantity": 2,
-                    "unit_price": "100.00",
-                    "total": "200.00",
-                },
-                {
-                    "name": "Test Item 2 With Very Long Name That Needs Truncation",
-                    "quantity": 1,
-                    "unit_price": "50.00",
-                    "total": "50.00",
-                },
-            ],
-            "subtotal": "250.00",
-            "special_amount": "0.00",
-            "discount_amount": "0.00",
-            "total": "250.00",
-            "payment_method": "Cash",
-            "qr_code_data": "http://localhost:8080",
-        }
-
-        receipt_bytes = build_receipt(test_receipt)
+        receipt_bytes = build_receipt(test_receipt_data())
         success, message = print_data(receipt_bytes)
 
         if success:
@@ -0,0 +1,194 @@
+import threading
+import time
+import usb.core
+import usb.util
+
+
+MONITOR_INTERVAL = 5
+# Release the claim after this many idle seconds so other programs (such as
+# the standalone print_barcode.py) can open the printer between jobs
+IDLE_RELEASE = 30
+
+
+class PrinterSession:
+    """A single claim on a USB printer shared by everything that prints.
+
+    The device is opened and claimed on the first write and kept while jobs
+    keep coming. The monitor thread, started with the first claim or status
+    check, re-enumerates the bus every few seconds so status() can answer
+    from cached state, and releases the claim once the printer has been idle
+    for IDLE_RELEASE seconds or was unplugged.
+    """
+
+    def __init__(self, vendor_id, product_id, out_endpoint):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.out_endpoint = out_endpoint
+
+        self._lock = threading.RLock()
+        self._device = None
+        self._ready = False
+        self._message = "Printer not checked yet"
+        self._checked = False
+        self._last_used = 0.0
+        self._monitor = None
+
+    def _open(self):
+        dev = usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
+        if dev is None:
+            return None
+
+        try:
+            if dev.is_kernel_driver_active(0):
+                dev.detach_kernel_driver(0)
+        except (AttributeError, NotImplementedError, usb.core.USBError):
+            pass
+
+        try:
+            dev.set_configuration()
+        except usb.core.USBError:
+            pass
+
+        try:
+            usb.util.claim_interface(dev, 0)
+        except usb.core.USBError:
+            pass
+
+        return dev
+
+    def _close(self):
+        if self._device is None:
+            return
+
+        try:
+            usb.util.release_interface(self._device, 0)
+            usb.util.dispose_resources(self._device)
+        except Exception:
+            pass
+        self._device = None
+
+    def _set_status(self, ready, message):
+        self._ready = ready
+        self._message = message
+        self._checked = True
+
+    def connect(self):
+        """Return the claimed device, opening it if needed (None if absent)."""
+        with self._lock:
+            if self._device is None:
+                try:
+                    self._device = self._open()
+                except Exception as e:
+                    self._set_status(False, str(e))
+                    return None
+
+                if self._device is None:
+                    self._set_status(
+                        False, "Printer not found. Please check USB connection."
+                    )
+                else:
+                    self._set_status(True, "Printer is ready")
+                    # Something has to release the claim once the printer idles
+                    self.start_monitor()
+
+            return self._device
+
+    def write(self, data):
+        """Send raw bytes to the printer; returns (success, message)."""
+        with self._lock:
+            for attempt in range(2):
+                dev = self.connect()
+                if dev is None:
+                    return False, "Printer not found"
+
+                try:
+                    dev.write(self.out_endpoint, data)
+                    self._last_used = time.monotonic()
+                    return True, "Print successful"
+                except usb.core.USBError as e:
+                    # A stale handle (printer replugged) fails once; reopen and retry
+                    self._close()
+                    self._set_status(False, f"USB Error: {str(e)}")
+                    if attempt:
+                        return False, f"USB Error: {str(e)}"
+                except Exception as e:
+                    return False, f"Error: {str(e)}"
+
+    def check(self):
+        """Re-check whether the printer is attached and update the cached state.
+
+        Does not claim the device; an idle claim is released here.
+        """
+        # Enumerate outside the lock so a running print job is never held up
+        try:
+            present = (
+                usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
+                is not None
+            )
+        except Exception as e:
+            with self._lock:
+                self._close()
+                self._set_status(False, str(e))
+            return
+
+        with self._lock:
+            if not present:
+                self._close()
+                self._set_status(
+                    False, "Printer not found. Please check USB connection."
+                )
+            else:
+                idle = time.monotonic() - self._last_used
+                if self._device is not None and idle >= IDLE_RELEASE:
+                    self._close()
+                self._set_status(True, "Printer is ready")
+
+    def status(self):
+        """Cached (ready, message); the first call checks synchronously."""
+        if not self._checked:
+            self.check()
+        self.start_monitor()
+        return self._ready, self._message
+
+    def start_monitor(self, interval=MONITOR_INTERVAL):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+
+        with self._lock:
+            if self._monitor is not None and self._monitor.is_alive():
+                return
+            self._monitor = threading.Thread(
+                target=self._monitor_loop,
+                args=(interval,),
+                daemon=True,
+                name="printer-monitor",
+            )
+            self._monitor.start()
+
+    def _monitor_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Printer monitor error: {e}")
+
+    def close(self):
+        with self._lock:
+            self._close()
+            self._set_status(False, "Printer disconnected")
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(vendor_id, product_id, out_endpoint):
+    """Shared session for a printer, so it is only ever claimed once per process."""
+    key = (vendor_id, product_id, out_endpoint)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = PrinterSession(vendor_id, product_id, out_endpoint)
+            _sessions[key] = session
+        return session
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from sales.models import Sale
+from .printer_client import invalidate_receipt
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def invalidate_sale_receipt(sender, instance, **kwargs):
+    invalidate_receipt(instance.pk)
+
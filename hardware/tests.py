@@ -1,3 +1,259 @@
-from django.test import TestCase
+import time
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from products.models import Product
+from sales.models import Sale, SaleItem
+from sync.ingest import ingest_sales
+from users.models import User
+from .models import PrintJob
+from .print_queue import (
+    MAX_ATTEMPTS,
+    PrintSpooler,
+    StubPrinterBackend,
+    JOB_RETENTION_DAYS,
+    enqueue,
+    get_backend,
+    print_spooler,
+    prune_jobs,
+    send,
+)
+from .printer_client import build_receipt, get_receipt, test_receipt_data
+from .printer_session import IDLE_RELEASE, PrinterSession
 
-# Create your tests here.
+
+@override_settings(PRINTER_BACKEND="stub")
+class PrintSpoolerTests(TestCase):
+    def setUp(self):
+        # Drive the spooler by hand rather than from its thread
+        self.spooler = PrintSpooler()
+        self.spooler.backend = get_backend()
+        self.spooler.running = True
+
+    def test_stub_backend_is_selected(self):
+        self.assertIsInstance(self.spooler.backend, StubPrinterBackend)
+
+    def test_enqueue_only_stores_the_job(self):
+        job = enqueue(b"receipt")
+
+        self.assertEqual(job.status, "pending")
+        self.assertFalse(print_spooler.running)
+
+    def test_jobs_print_in_order(self):
+        first = enqueue(b"first")
+        second = enqueue(b"second", kind="test")
+
+        self.spooler.process_due_jobs()
+
+        self.assertEqual(self.spooler.backend.printed, [b"first", b"second"])
+        for job in (first, second):
+            job.refresh_from_db()
+            self.assertEqual(job.status, "done")
+            self.assertIsNotNone(job.printed_at)
+
+    def test_failed_job_is_retried_after_backoff(self):
+        job = enqueue(b"receipt")
+        self.spooler.backend.fail_next = 1
+
+        delay = self.spooler.process_due_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("pending", 1))
+        self.assertEqual(job.last_error, "Stub printer failure")
+        self.assertGreater(delay, 0)
+        self.assertEqual(self.spooler.backend.printed, [])
+
+        # Not due yet, so a second pass leaves it alone
+        self.spooler.process_due_jobs()
+        self.assertEqual(self.spooler.backend.printed, [])
+
+        PrintJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+        self.spooler.process_due_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ("done", 2, ""))
+        self.assertEqual(self.spooler.backend.printed, [b"receipt"])
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue(b"receipt")
+        self.spooler.backend.fail_next = MAX_ATTEMPTS
+
+        for _ in range(MAX_ATTEMPTS):
+            PrintJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+            self.spooler.process_due_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", MAX_ATTEMPTS))
+        self.assertEqual(self.spooler.backend.printed, [])
+
+    def test_job_is_printed_then_pruned(self):
+        job = enqueue(b"receipt")
+        stuck = enqueue(b"stuck")
+        PrintJob.objects.filter(pk=stuck.pk).update(
+            next_attempt_at=timezone.now() + timezone.timedelta(days=1)
+        )
+
+        self.spooler.process_due_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+
+        # Kept for a while so its status can still be polled
+        self.assertEqual(prune_jobs(), 0)
+
+        old = timezone.now() - timezone.timedelta(days=JOB_RETENTION_DAYS + 1)
+        PrintJob.objects.update(created_at=old)
+        self.assertEqual(prune_jobs(), 1)
+        self.assertEqual(
+            list(PrintJob.objects.values_list("id", flat=True)), [stuck.id]
+        )
+
+    def test_send_prints_inline_without_the_spooler(self):
+        with mock.patch(
+            "hardware.printer_client.print_data", return_value=(True, "ok")
+        ) as print_data:
+            success, message, job_id = send(b"receipt")
+
+        print_data.assert_called_once_with(b"receipt")
+        self.assertEqual((success, job_id), (True, None))
+        self.assertFalse(PrintJob.objects.exists())
+
+    def test_send_queues_while_the_spooler_runs(self):
+        with mock.patch.object(print_spooler, "running", True):
+            success, message, job_id = send(b"receipt")
+
+        self.assertTrue(success)
+        self.assertEqual(PrintJob.objects.get().id, job_id)
+
+
+class PrinterSessionTests(SimpleTestCase):
+    def setUp(self):
+        self.device = mock.Mock()
+        patches = [
+            mock.patch("usb.core.find", return_value=self.device),
+            mock.patch("usb.util.claim_interface"),
+            mock.patch("usb.util.release_interface"),
+            mock.patch("usb.util.dispose_resources"),
+            # Tests call check() themselves instead of a monitor thread
+            mock.patch.object(PrinterSession, "start_monitor"),
+        ]
+        self.find, self.claim, self.release, _, self.start_monitor = [
+            p.start() for p in patches
+        ]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+        self.session = PrinterSession(0x0483, 0x5743, 0x01)
+
+    def test_status_check_does_not_claim(self):
+        self.session.check()
+
+        self.assertEqual(self.session._ready, True)
+        self.claim.assert_not_called()
+
+    def test_claim_is_kept_while_busy_and_released_when_idle(self):
+        self.assertEqual(self.session.write(b"one"), (True, "Print successful"))
+        self.session.write(b"two")
+        self.session.check()
+        self.assertEqual(self.claim.call_count, 1)
+        self.release.assert_not_called()
+
+        self.session._last_used -= IDLE_RELEASE
+        self.session.check()
+        self.release.assert_called_once_with(self.device, 0)
+        self.assertEqual(self.session._ready, True)
+
+        # The next job claims the printer again
+        self.session.write(b"three")
+        self.assertEqual(self.claim.call_count, 2)
+
+    def test_claim_starts_the_monitor(self):
+        self.session.write(b"one")
+        self.session.write(b"two")
+
+        # Without a status() call, so the idle claim is still released
+        self.start_monitor.assert_called_once_with()
+
+    def test_unplugged_printer_is_released(self):
+        self.session.write(b"one")
+        self.find.return_value = None
+        self.session.check()
+
+        self.release.assert_called_once()
+        self.assertEqual(self.session._ready, False)
+
+
+@override_settings(RECEIPT_CACHE=True)
+class ReceiptRenderTests(TestCase):
+    RENDERS = 2000
+    # A 30-line receipt renders at over 10k/s; this leaves room for a slow machine
+    MIN_RECEIPTS_PER_SECOND = 1000
+
+    def setUp(self):
+        cache.clear()
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=100,
+        )
+        self.sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        SaleItem.objects.create(
+            sale=self.sale,
+            product=self.product,
+            quantity=2,
+            unit_price=Decimal("20.00"),
+        )
+        self.sale.complete_sale()
+
+    def test_render_throughput(self):
+        receipt_data = test_receipt_data()
+        receipt_data["items"] = receipt_data["items"] * 15
+
+        start = time.perf_counter()
+        for _ in range(self.RENDERS):
+            build_receipt(receipt_data)
+        rate = self.RENDERS / (time.perf_counter() - start)
+
+        print(f"\nReceipt render: {rate:.0f} receipts/s")
+        self.assertGreater(rate, self.MIN_RECEIPTS_PER_SECOND)
+
+    def test_reprint_is_served_from_cache(self):
+        receipt_data, receipt = get_receipt(self.sale.id)
+        self.assertIn(b"Soda", receipt)
+        self.assertEqual(receipt_data["total"], "40.00")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_receipt(self.sale.id)[1], receipt)
+
+    def test_repushed_sale_invalidates_the_receipt(self):
+        get_receipt(self.sale.id)
+        sale_data = {
+            "sale_number": self.sale.sale_number,
+            "sale_type": "RETAIL",
+            "cashier_id": self.cashier.id,
+            "total_amount": "40.00",
+            "discount_amount": "5.00",
+            "final_amount": "35.00",
+            "payment_method": "cash",
+            "completed_at": self.sale.completed_at,
+            "items": [],
+        }
+        ingest_sales([sale_data], batch_size=10)
+
+        self.assertEqual(get_receipt(self.sale.id)[0]["total"], "35.00")
+
+    @override_settings(RECEIPT_CACHE=False)
+    def test_cache_is_off_unless_enabled(self):
+        get_receipt(self.sale.id)
+
+        with self.assertNumQueries(2):
+            get_receipt(self.sale.id)
+
+    def test_open_sale_has_no_receipt(self):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        self.assertIsNone(get_receipt(sale.id))
@@ -1,3 +1,125 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from products.models import Product, Category, Brand
+from reports.rollup import rebuild
+from sales.models import Sale, SaleItem
+from users.models import User
+from .views import inventory_home
 
-# Create your tests here.
+
+class InventoryHomeTests(TestCase):
+    QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            "boss", email="boss@example.com", password="x", role="admin"
+        )
+        drinks = Category.objects.create(name="Drinks")
+        Category.objects.create(name="Retired", is_active=False)
+        acme = Brand.objects.create(name="Acme")
+
+        self.soda = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            wholesale_price=Decimal("15.00"),
+            special_price=Decimal("12.00"),
+            quantity=50,
+            category=drinks,
+            brand=acme,
+        )
+        # No wholesale price, so wholesale sells at the selling price
+        self.juice = Product.objects.create(
+            name="Juice",
+            cost_price=Decimal("5.00"),
+            selling_price=Decimal("9.00"),
+            special_price=Decimal("6.00"),
+            quantity=3,
+        )
+        Product.objects.create(
+            name="Old Stock",
+            cost_price=Decimal("1.00"),
+            selling_price=Decimal("3.00"),
+            special_price=Decimal("2.00"),
+            quantity=100,
+            is_active=False,
+        )
+
+        self.sell(self.soda, "RETAIL", 2)
+        self.sell(self.juice, "WHOLESALE", 3)
+        yesterday = self.sell(self.soda, "SPECIAL", 4)
+        Sale.objects.filter(id=yesterday.id).update(
+            completed_at=timezone.now() - timedelta(days=1)
+        )
+        rebuild()
+
+    def sell(self, product, sale_type, quantity):
+        sale = Sale.objects.create(cashier=self.admin, sale_type=sale_type)
+        SaleItem.objects.create(
+            sale=sale,
+            product=product,
+            quantity=quantity,
+            unit_price=product.get_price_by_sale_type(sale_type),
+        )
+        sale.complete_sale()
+        return sale
+
+    def queries(self):
+        """Queries the view itself runs, leaving out session and auth."""
+        request = RequestFactory().get("/inventory/")
+        request.user = self.admin
+        with CaptureQueriesContext(connection) as queries:
+            response = inventory_home(request)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_figures(self):
+        self.client.force_login(self.admin)
+        context = self.client.get("/inventory/").context
+
+        expected = {
+            "total_products": 2,
+            "low_stock_count": 1,
+            "out_of_stock_count": 1,
+            # 44 sodas left at a cost of 10
+            "total_inventory_value": Decimal("440.00"),
+            # Profit as sold: 2 x (20 - 10), 3 x (9 - 5), 4 x (12 - 10)
+            "retail_profit": Decimal("20.00"),
+            "wholesale_profit": Decimal("12.00"),
+            "special_profit": Decimal("8.00"),
+            "total_profit": Decimal("40.00"),
+            "daily_retail_profit": Decimal("20.00"),
+            "daily_wholesale_profit": Decimal("12.00"),
+            "daily_special_profit": Decimal("0.00"),
+            "daily_total_profit": Decimal("32.00"),
+            "daily_sales_count": 2,
+            "daily_sales_revenue": Decimal("67.00"),
+            "categories_count": 1,
+            "brands_count": 1,
+        }
+        self.assertEqual({key: context[key] for key in expected}, expected)
+        self.assertEqual(
+            [product.name for product in context["top_selling_products"]],
+            ["Soda", "Juice"],
+        )
+
+    def test_query_budget(self):
+        before = self.queries()
+        self.assertLessEqual(before, self.QUERY_BUDGET)
+
+        for _ in range(10):
+            self.sell(self.soda, "RETAIL", 1)
+        self.assertEqual(self.queries(), before)
+
+    def test_reads_no_sales_history(self):
+        request = RequestFactory().get("/inventory/")
+        request.user = self.admin
+        with CaptureQueriesContext(connection) as queries:
+            inventory_home(request)
+
+        for query in queries:
+            self.assertNotIn('"sales_sale', query["sql"])
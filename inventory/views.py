@@ -1,12 +1,13 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.db.models import Sum, F, Q, DecimalField
+from django.db.models import Sum, Count, F, Q, Value, DecimalField
 from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator
 from django.utils import timezone
 from products.models import Product, Category, Brand, StockMovement
-from sales.models import Sale, SaleItem
+from reports.models import SalesRollup, ProductSalesRollup, ProductSalesStats
+from products.aggregates import table_figures, ZERO
 from decimal import Decimal
 
 
@@ -15,98 +16,68 @@ def inventory_home(request):
     if not request.user.can_manage_inventory():
         raise PermissionDenied("You do not have permission to view inventory.")
 
-    today = timezone.now().date()
-    today = timezone.now().date()
+    # Local date, as the rollups and the __date lookups use
+    today = timezone.localdate()
 
-    total_products = Product.objects.filter(is_active=True).count()
-
-    low_stock_count = Product.objects.filter(
-        is_active=True, quantity__lte=F("low_stock_threshold")
-    ).count()
-
-    out_of_stock_count = Product.objects.filter(is_active=True, quantity=0).count()
-
-    total_inventory_value = Product.objects.filter(is_active=True).aggregate(
-        total=Coalesce(
+    stock = Product.objects.filter(is_active=True).aggregate(
+        total_products=Count("id"),
+        low_stock_count=Count("id", filter=Q(quantity__lte=F("low_stock_threshold"))),
+        out_of_stock_count=Count("id", filter=Q(quantity=0)),
+        total_inventory_value=Coalesce(
             Sum(F("quantity") * F("cost_price"), output_field=DecimalField()),
             Decimal("0.00"),
-        )
-    )["total"]
-
-    retail_sales = SaleItem.objects.filter(
-        sale__sale_type="RETAIL", sale__completed_at__isnull=False
-    ).select_related("product", "sale")
-
-    wholesale_sales = SaleItem.objects.filter(
-        sale__sale_type="WHOLESALE", sale__completed_at__isnull=False
-    ).select_related("product", "sale")
-
-    special_sales = SaleItem.objects.filter(
-        sale__sale_type="SPECIAL", sale__completed_at__isnull=False
-    ).select_related("product", "sale")
-
-    retail_profit = Decimal("0.00")
-    for item in retail_sales:
-        profit_per_unit = item.product.selling_price - item.product.cost_price
-        retail_profit += profit_per_unit * item.quantity
-
-    wholesale_profit = Decimal("0.00")
-    for item in wholesale_sales:
-        wholesale_price = (
-            item.product.wholesale_price
-            if item.product.wholesale_price
-            else item.product.selling_price
-        )
-        profit_per_unit = wholesale_price - item.product.cost_price
-        wholesale_profit += profit_per_unit * item.quantity
-
-    special_profit = Decimal("0.00")
-    for item in special_sales:
-        profit_per_unit = item.product.special_price - item.product.cost_price
-        special_profit += profit_per_unit * item.quantity
+        ),
+    )
 
+    # Catalogue counts, today's sales and profit from the rollups, and
+    # lifetime profit (net of returns) from the product stats, in one round
+    # trip; today's profit comes back as one row per sale type sold
+    figures = table_figures(
+        Category.objects.filter(is_active=True)
+        .values(kind=Value("categories"))
+        .annotate(count=Count("id"), amount=ZERO),
+        Brand.objects.filter(is_active=True)
+        .values(kind=Value("brands"))
+        .annotate(count=Count("id"), amount=ZERO),
+        SalesRollup.objects.filter(date=today)
+        .values(kind=Value("sales"))
+        .annotate(
+            count=Coalesce(Sum("sale_count"), 0),
+            amount=Coalesce(Sum("revenue"), ZERO),
+        ),
+        ProductSalesRollup.objects.filter(date=today)
+        .values(kind=F("sale_type"))
+        .annotate(count=Sum("quantity"), amount=Sum("profit")),
+        *(
+            ProductSalesStats.objects.values(kind=Value(f"all:{tier}"))
+            .annotate(
+                count=Coalesce(Sum(f"{tier}_quantity"), 0),
+                amount=Coalesce(Sum(F(f"{tier}_revenue") - F(f"{tier}_cost")), ZERO),
+            )
+            for tier in ProductSalesStats.TIERS.values()
+        ),
+    )
+    total_products = stock["total_products"]
+    low_stock_count = stock["low_stock_count"]
+    out_of_stock_count = stock["out_of_stock_count"]
+    total_inventory_value = stock["total_inventory_value"]
+
+    retail_profit = figures["all:retail"][1]
+    wholesale_profit = figures["all:wholesale"][1]
+    special_profit = figures["all:special"][1]
     total_profit = retail_profit + wholesale_profit + special_profit
 
-    daily_retail_sales = SaleItem.objects.filter(
-        sale__sale_type="RETAIL", sale__completed_at__date=today
-    ).select_related("product", "sale")
-
-    daily_wholesale_sales = SaleItem.objects.filter(
-        sale__sale_type="WHOLESALE", sale__completed_at__date=today
-    ).select_related("product", "sale")
-
-    daily_special_sales = SaleItem.objects.filter(
-        sale__sale_type="SPECIAL", sale__completed_at__date=today
-    ).select_related("product", "sale")
-
-    daily_retail_profit = Decimal("0.00")
-    for item in daily_retail_sales:
-        profit_per_unit = item.product.selling_price - item.product.cost_price
-        daily_retail_profit += profit_per_unit * item.quantity
-
-    daily_wholesale_profit = Decimal("0.00")
-    for item in daily_wholesale_sales:
-        wholesale_price = (
-            item.product.wholesale_price
-            if item.product.wholesale_price
-            else item.product.selling_price
-        )
-        profit_per_unit = wholesale_price - item.product.cost_price
-        daily_wholesale_profit += profit_per_unit * item.quantity
-
-    daily_special_profit = Decimal("0.00")
-    for item in daily_special_sales:
-        profit_per_unit = item.product.special_price - item.product.cost_price
-        daily_special_profit += profit_per_unit * item.quantity
+    def today_profit(sale_type):
+        return figures.get(sale_type, (0, Decimal("0.00")))[1]
 
+    daily_retail_profit = today_profit("RETAIL")
+    daily_wholesale_profit = today_profit("WHOLESALE")
+    daily_special_profit = today_profit("SPECIAL")
     daily_total_profit = (
         daily_retail_profit + daily_wholesale_profit + daily_special_profit
     )
 
-    daily_sales_count = Sale.objects.filter(completed_at__date=today).count()
-    daily_sales_revenue = Sale.objects.filter(completed_at__date=today).aggregate(
-        total=Coalesce(Sum("final_amount"), Decimal("0.00"))
-    )["total"]
+    daily_sales_count, daily_sales_revenue = figures["sales"]
 
     recent_stock_movements = StockMovement.objects.select_related("product").order_by(
         "-created_at"
@@ -116,9 +87,6 @@ def inventory_home(request):
         is_active=True, sold_count__gt=0
     ).order_by("-sold_count")[:10]
 
-    categories = Category.objects.filter(is_active=True).count()
-    brands = Brand.objects.filter(is_active=True).count()
-
     context = {
         "total_products": total_products,
         "low_stock_count": low_stock_count,
@@ -136,8 +104,8 @@ def inventory_home(request):
         "daily_sales_revenue": daily_sales_revenue,
         "recent_stock_movements": recent_stock_movements,
         "top_selling_products": top_selling_products,
-        "categories_count": categories,
-        "brands_count": brands,
+        "categories_count": figures["categories"][0],
+        "brands_count": figures["brands"][0],
     }
 
     return render(request, "inventory/inventory_home.html", context)
@@ -1,7 +1,6 @@
-import usb.core
-import usb.util
 import json
 import os
+from hardware.printer_session import get_session
 
 
 def load_printer_config():
@@ -30,53 +29,8 @@ LINE_FEED = b"\n"
 CUT_PAPER = GS + b"V\x41\x03"
 
 
-def find_printer():
-    try:
-        dev = usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
-        if dev is None:
-            return None
-
-        try:
-            if dev.is_kernel_driver_active(0):
-                dev.detach_kernel_driver(0)
-        except (AttributeError, usb.core.USBError):
-            pass
-
-        try:
-            dev.set_configuration()
-        except usb.core.USBError:
-            pass
-
-        try:
-            usb.util.claim_interface(dev, 0)
-        except usb.core.USBError:
-            pass
-
-        return dev
-    except Exception:
-        return None
-
-
 def print_data(data):
-    dev = None
-    try:
-        dev = find_printer()
-        if dev is None:
-            return False, "Printer not found"
-
-        dev.write(OUT_ENDPOINT, data)
-        return True, "Print successful"
-
-    except usb.core.USBError as e:
-        return False, f"USB Error: {str(e)}"
-    except Exception as e:
-        return False, f"Error: {str(e)}"
-    finally:
-        if dev is not None:
-            try:
-                usb.util.release_interface(dev, 0)
-            except:
-                pass
+    return get_session(VENDOR_ID, PRODUCT_ID, OUT_ENDPOINT).write(data)
 
 
 def generate_barcode(barcode_data: str, barcode_type="EAN13"):
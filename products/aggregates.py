@@ -0,0 +1,36 @@
+from decimal import Decimal
+from django.db.models import F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Value(Decimal("0.00"), output_field=MONEY)
+
+
+def table_figures(*querysets):
+    """Run aggregates of several tables as one UNION ALL query.
+
+    Each queryset is shaped values(kind=...).annotate(count=..., amount=...).
+    A constant Value kind adds no GROUP BY, so that part yields one row even
+    on an empty table; a column kind yields a row per value present.
+    Returns {kind: (count, amount)}.
+    """
+    first, *rest = [queryset.order_by() for queryset in querysets]
+    return {
+        row["kind"]: (row["count"], row["amount"])
+        for row in first.union(*rest, all=True)
+    }
+
+
+def cost_expression():
+    """Cost of SaleItem rows at the products' current cost price."""
+    return Coalesce(
+        Sum(F("product__cost_price") * F("quantity"), output_field=MONEY), ZERO
+    )
+
+
+def profit_margin(revenue, cost):
+    if cost > 0:
+        margin = ((revenue - cost) / cost) * 100
+        return min(margin, Decimal("100.00")).quantize(Decimal("0.01"))
+    return Decimal("0.00")
@@ -0,0 +1,184 @@
+import threading
+from collections import namedtuple
+from django.conf import settings
+
+
+ProductRecord = namedtuple(
+    "ProductRecord",
+    [
+        "id",
+        "name",
+        "selling_price",
+        "wholesale_price",
+        "special_price",
+        "is_active",
+    ],
+)
+
+PRODUCT_RECORD_FIELDS = list(ProductRecord._fields)
+
+# Unknown codes remembered before the set is simply emptied again
+MAX_MISSING_CODES = 10_000
+
+
+def fetch_product(code):
+    """Active ProductRecord for a SKU or active barcode, straight from the database."""
+    from products.models import Product, Barcode
+
+    row = (
+        Product.objects.filter(sku=code, is_active=True)
+        .values_list(*PRODUCT_RECORD_FIELDS)
+        .first()
+    )
+    if row is None:
+        row = (
+            Barcode.objects.filter(barcode=code, is_active=True, product__is_active=True)
+            .values_list(*[f"product__{f}" for f in PRODUCT_RECORD_FIELDS])
+            .first()
+        )
+    return ProductRecord(*row) if row else None
+
+
+class ProductLookupIndex:
+    """Process-wide map of SKUs and active barcodes to compact product records.
+
+    The index is loaded once (two queries) and then kept current by dropping a
+    product's entries whenever it or one of its barcodes changes. A code that is
+    not in the index falls back to the database and the product is re-indexed,
+    so scans of known codes never touch the database. Codes of inactive
+    products answer None from the index, and codes the database did not know
+    are remembered until the next product or barcode change.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_sku = {}
+        self._by_barcode = {}
+        self._codes_by_product = {}
+        self._missing = set()
+        self._loaded = False
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self):
+        from products.models import Product, Barcode
+
+        by_sku = {}
+        by_barcode = {}
+        codes_by_product = {}
+        records = {}
+
+        for row in Product.objects.values_list("sku", *PRODUCT_RECORD_FIELDS):
+            record = ProductRecord(*row[1:])
+            records[record.id] = record
+            by_sku[row[0]] = record
+            codes_by_product.setdefault(record.id, set()).add(("sku", row[0]))
+
+        for code, product_id in Barcode.objects.filter(is_active=True).values_list(
+            "barcode", "product_id"
+        ):
+            record = records.get(product_id)
+            if record is None:
+                continue
+            by_barcode[code] = record
+            codes_by_product.setdefault(product_id, set()).add(("barcode", code))
+
+        with self._lock:
+            self._by_sku = by_sku
+            self._by_barcode = by_barcode
+            self._codes_by_product = codes_by_product
+            self._missing = set()
+            self._loaded = True
+
+        return len(records)
+
+    def clear(self):
+        with self._lock:
+            self._by_sku = {}
+            self._by_barcode = {}
+            self._codes_by_product = {}
+            self._missing = set()
+            self._loaded = False
+
+    def lookup(self, code):
+        if not self._loaded:
+            self.load()
+
+        by_sku = self._by_sku.get(code)
+        if by_sku is not None and by_sku.is_active:
+            return by_sku
+
+        by_barcode = self._by_barcode.get(code)
+        if by_barcode is not None and by_barcode.is_active:
+            return by_barcode
+
+        # Known but inactive, or already looked for and not found
+        if by_sku or by_barcode or code in self._missing:
+            return None
+
+        record = fetch_product(code)
+        if record is not None:
+            self.index_product(record.id)
+        else:
+            with self._lock:
+                if len(self._missing) >= MAX_MISSING_CODES:
+                    self._missing.clear()
+                self._missing.add(code)
+        return record
+
+    def index_product(self, product_id):
+        from products.models import Product, Barcode
+
+        row = (
+            Product.objects.filter(id=product_id)
+            .values_list("sku", *PRODUCT_RECORD_FIELDS)
+            .first()
+        )
+        barcodes = list(
+            Barcode.objects.filter(product_id=product_id, is_active=True).values_list(
+                "barcode", flat=True
+            )
+        )
+
+        with self._lock:
+            self._discard(product_id)
+            if row is None:
+                return
+            record = ProductRecord(*row[1:])
+            codes = {("sku", row[0])}
+            self._by_sku[row[0]] = record
+            for code in barcodes:
+                self._by_barcode[code] = record
+                codes.add(("barcode", code))
+            self._codes_by_product[product_id] = codes
+
+    def discard_product(self, product_id):
+        with self._lock:
+            self._discard(product_id)
+
+    def discard_code(self, code):
+        with self._lock:
+            record = self._by_barcode.pop(code, None)
+            if record is not None:
+                self._discard(record.id)
+
+    def _discard(self, product_id):
+        # The change may have given some remembered unknown code a product
+        self._missing.clear()
+        for kind, code in self._codes_by_product.pop(product_id, ()):
+            table = self._by_sku if kind == "sku" else self._by_barcode
+            record = table.get(code)
+            if record is not None and record.id == product_id:
+                del table[code]
+
+
+product_index = ProductLookupIndex()
+
+
+def find_scanned_product(code):
+    """Resolve a scanned SKU or barcode to an active ProductRecord (or None)."""
+    if getattr(settings, "PRODUCT_LOOKUP_INDEX", False):
+        return product_index.lookup(code)
+    return fetch_product(code)
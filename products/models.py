@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from django.utils.text import slugify
@@ -143,6 +144,18 @@ class Barcode(models.Model):
         return f"{self.barcode} - {self.product.name}"
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_primary_barcode(self):
+        """Prefetch active barcodes so product.barcode needs no query per row."""
+        return self.prefetch_related(
+            models.Prefetch(
+                "barcodes",
+                queryset=Barcode.objects.filter(is_active=True),
+                to_attr="active_barcodes",
+            )
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200, db_index=True)
     description = models.TextField(blank=True)
@@ -202,6 +215,8 @@ class Product(models.Model):
     server_id = models.IntegerField(unique=True, null=True, blank=True, db_index=True)
     synced_at = models.DateTimeField(null=True, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def clean(self):
         from django.core.exceptions import ValidationError
 
@@ -268,181 +283,58 @@ class Product(models.Model):
     def is_low_stock(self):
         return self.quantity <= self.low_stock_threshold
 
+    def _sales_totals(self):
+        # One row kept current by reports.rollup; cached on the instance, so
+        # the three properties below cost a single query between them
+        try:
+            stats = self.sales_stats
+        except ObjectDoesNotExist:
+            return {"revenue": Decimal("0.00"), "cost": Decimal("0.00")}
+        return {"revenue": stats.revenue, "cost": stats.cost}
+
     @property
     def profit_margin(self):
-        from sales.models import SaleItem
-
-        sale_items = SaleItem.objects.filter(product=self).select_related("sale")
-
-        if not sale_items.exists():
-            return Decimal("0.00")
-
-        total_revenue = Decimal(0)
-        total_cost = Decimal(0)
-
-        for item in sale_items:
-            if item.sale.sale_type == "RETAIL":
-                selling_price = self.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    self.wholesale_price if self.wholesale_price else self.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = self.special_price
-            else:
-                selling_price = self.selling_price
-
-            total_revenue += selling_price * item.quantity
-            total_cost += self.cost_price * item.quantity
-
-        if total_cost > 0:
-            margin = ((total_revenue - total_cost) / total_cost) * 100
-            return min(margin, Decimal("100.00")).quantize(Decimal("0.01"))
+        from .aggregates import profit_margin
 
-        return Decimal("0.00")
+        totals = self._sales_totals()
+        return profit_margin(totals["revenue"], totals["cost"])
 
     @property
     def revenue_generated(self):
-        from sales.models import SaleItem
-
-        total_revenue = Decimal(0)
-
-        sale_items = SaleItem.objects.filter(product=self).select_related("sale")
-
-        for item in sale_items:
-            if item.sale.sale_type == "RETAIL":
-                selling_price = self.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    self.wholesale_price if self.wholesale_price else self.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = self.special_price
-            else:
-                selling_price = self.selling_price
-
-            total_revenue += selling_price * item.quantity
-
-        return total_revenue.quantize(Decimal("0.01"))
+        return self._sales_totals()["revenue"].quantize(Decimal("0.01"))
 
     @property
     def total_profit(self):
-        from sales.models import SaleItem
-
-        total_profit = Decimal(0)
-
-        sale_items = SaleItem.objects.filter(product=self).select_related("sale")
-
-        for item in sale_items:
-            if item.sale.sale_type == "RETAIL":
-                selling_price = self.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    self.wholesale_price if self.wholesale_price else self.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = self.special_price
-            else:
-                selling_price = self.selling_price
-
-            profit_per_item = selling_price - self.cost_price
-            total_profit += profit_per_item * item.quantity
-
-        return total_profit.quantize(Decimal("0.01"))
+        totals = self._sales_totals()
+        return (totals["revenue"] - totals["cost"]).quantize(Decimal("0.01"))
 
+    # The same per-product stats rows as the properties above, summed
     @classmethod
     def get_all_products_total_profit(cls):
-        from sales.models import SaleItem
-
-        total_profit = Decimal(0)
+        from reports.models import ProductSalesStats
 
-        sale_items = SaleItem.objects.select_related("product", "sale").all()
-
-        for item in sale_items:
-            product = item.product
-
-            if item.sale.sale_type == "RETAIL":
-                selling_price = product.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    product.wholesale_price
-                    if product.wholesale_price
-                    else product.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = product.special_price
-            else:
-                selling_price = product.selling_price
-
-            profit_per_item = selling_price - product.cost_price
-            total_profit += profit_per_item * item.quantity
-
-        return total_profit.quantize(Decimal("0.01"))
+        totals = ProductSalesStats.totals()
+        return (totals["revenue"] - totals["cost"]).quantize(Decimal("0.01"))
 
     @classmethod
     def get_all_products_total_revenue(cls):
-        from sales.models import SaleItem
-
-        total_revenue = Decimal(0)
-
-        sale_items = SaleItem.objects.select_related("product", "sale").all()
+        from reports.models import ProductSalesStats
 
-        for item in sale_items:
-            product = item.product
-
-            if item.sale.sale_type == "RETAIL":
-                selling_price = product.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    product.wholesale_price
-                    if product.wholesale_price
-                    else product.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = product.special_price
-            else:
-                selling_price = product.selling_price
-
-            total_revenue += selling_price * item.quantity
-
-        return total_revenue.quantize(Decimal("0.01"))
+        return ProductSalesStats.totals()["revenue"].quantize(Decimal("0.01"))
 
     @classmethod
     def get_all_products_profit_margin(cls):
-        from sales.models import SaleItem
-
-        total_revenue = Decimal(0)
-        total_cost = Decimal(0)
-
-        sale_items = SaleItem.objects.select_related("product", "sale").all()
+        from reports.models import ProductSalesStats
+        from .aggregates import profit_margin
 
-        for item in sale_items:
-            product = item.product
-
-            if item.sale.sale_type == "RETAIL":
-                selling_price = product.selling_price
-            elif item.sale.sale_type == "WHOLESALE":
-                selling_price = (
-                    product.wholesale_price
-                    if product.wholesale_price
-                    else product.selling_price
-                )
-            elif item.sale.sale_type == "SPECIAL":
-                selling_price = product.special_price
-            else:
-                selling_price = product.selling_price
-
-            total_revenue += selling_price * item.quantity
-            total_cost += product.cost_price * item.quantity
-
-        if total_cost > 0:
-            margin = ((total_revenue - total_cost) / total_cost) * 100
-            return min(margin, Decimal("100.00")).quantize(Decimal("0.01"))
-
-        return Decimal("0.00")
+        totals = ProductSalesStats.totals()
+        return profit_margin(totals["revenue"], totals["cost"])
 
     @property
     def primary_barcode(self):
+        # Set by Product.objects.with_primary_barcode()
+        if hasattr(self, "active_barcodes"):
+            return self.active_barcodes[0] if self.active_barcodes else None
         return self.barcodes.filter(is_active=True).first()
 
     @property
@@ -473,6 +365,63 @@ class Product(models.Model):
             notes=f"Sale completed - {quantity} units sold",
         )
 
+    @classmethod
+    def move_stock(cls, lines, movement_type):
+        """Apply (product_id, quantity, notes) stock changes in bulk.
+
+        quantity is signed: negative takes stock out, positive puts it back.
+        Locks the products, applies all changes in one UPDATE and writes the
+        stock movements with one INSERT; an OUT movement also counts as sold.
+        Call inside transaction.atomic.
+        """
+        from sync.changelog import record_changes
+
+        change = {}
+        for product_id, quantity, _ in lines:
+            change[product_id] = change.get(product_id, 0) + quantity
+        if not change:
+            return
+
+        stock = dict(
+            cls.objects.select_for_update()
+            .filter(id__in=change)
+            .order_by("id")
+            .values_list("id", "quantity")
+        )
+
+        quantity_change = models.Case(
+            *[
+                models.When(id=product_id, then=models.Value(quantity))
+                for product_id, quantity in change.items()
+            ],
+            default=models.Value(0),
+            output_field=models.IntegerField(),
+        )
+        updates = {
+            "quantity": models.F("quantity") + quantity_change,
+            "updated_at": timezone.now(),
+        }
+        if movement_type == "OUT":
+            updates["sold_count"] = models.F("sold_count") - quantity_change
+        cls.objects.filter(id__in=change).update(**updates)
+        record_changes("product", change)
+
+        movements = []
+        for product_id, quantity, notes in lines:
+            previous_quantity = stock[product_id]
+            stock[product_id] = previous_quantity + quantity
+            movements.append(
+                StockMovement(
+                    product_id=product_id,
+                    movement_type=movement_type,
+                    quantity=abs(quantity),
+                    previous_quantity=previous_quantity,
+                    new_quantity=stock[product_id],
+                    notes=notes,
+                )
+            )
+        StockMovement.objects.bulk_create(movements)
+
     def restock(self, quantity):
         previous_quantity = self.quantity
         self.quantity += quantity
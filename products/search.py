@@ -0,0 +1,320 @@
+import re
+import threading
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Product, Barcode, Brand, Category
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_TERMS = 8
+REFRESH_CHUNK = 500
+
+FTS_TABLE = "products_product_search"
+FTS_COLUMNS = "{name sku barcodes brand category}"
+
+# bm25 weights for the FTS columns: name, sku, barcodes, brand, category, state
+FTS_WEIGHTS = (10.0, 8.0, 8.0, 2.0, 1.0, 0.0)
+FTS_RANK = "bm25(" + ", ".join(str(weight) for weight in FTS_WEIGHTS) + ")"
+
+# Brands and categories are small enough to scan
+TRIGRAM_INDEXES = [
+    (Product, "name"),
+    (Product, "sku"),
+    (Barcode, "barcode"),
+]
+
+
+def search_terms(query):
+    """Lower-cased words of a query, as the index tokenises them."""
+    return re.findall(r"[^\W_]+", query.lower())[:MAX_TERMS]
+
+
+def limit_clause(limit):
+    return "LIMIT %s" if limit else ""
+
+
+class ProductSearchIndex:
+    """Ranked product search on name, SKU, barcode, brand and category.
+
+    SQLite (the desktop) keeps an FTS5 table with prefix indexes, refreshed
+    from the product signals and after every bulk sync write; its terms match
+    word prefixes, not arbitrary substrings. PostgreSQL (the server) matches
+    substrings with ILIKE over pg_trgm GIN indexes, which the database keeps
+    current itself. The index is built after migrate (see build()); until it
+    exists, search falls back to a plain icontains scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = self._detect()
+            return self._backend
+
+    def build(self):
+        """Create the index if it is missing; run after migrate, not per request."""
+        try:
+            if connection.vendor == "sqlite":
+                self._build_fts()
+            elif connection.vendor == "postgresql":
+                self._build_trigram()
+        except DatabaseError as e:
+            print(f"Product search index unavailable, using a plain scan: {e}")
+        with self._lock:
+            self._backend = None
+
+    def search(self, query, limit=DEFAULT_LIMIT, active_only=True):
+        """Ids of the best matches for query, best first; limit=None for all."""
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        backend = self.backend
+        if backend == "fts5":
+            return self._search_fts(query, terms, limit, active_only)
+        if backend in ("trigram", "ilike"):
+            return self._search_postgres(backend, terms, limit, active_only)
+        return self._search_orm(terms, limit, active_only)
+
+    def filter(self, queryset, query, active_only=True):
+        """Narrow a Product queryset to the matches of query, unranked.
+
+        The matches are a subquery, so a broad query on a large catalogue
+        never becomes a long list of bound ids.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+
+        backend = self.backend
+        if backend == "fts5":
+            table = connection.ops.quote_name(FTS_TABLE)
+            matches = RawSQL(
+                f"SELECT rowid FROM {table} WHERE {table} MATCH %s",
+                [self._fts_match(terms, active_only)],
+            )
+            codes = self._code_matches(query, active_only)
+            if codes is not None:
+                return queryset.filter(
+                    Q(id__in=matches) | Q(id__in=codes.values("id"))
+                )
+        elif backend in ("trigram", "ilike"):
+            products = connection.ops.quote_name(Product._meta.db_table)
+            where, params = self._postgres_where(terms, active_only)
+            matches = RawSQL(f"SELECT p.id FROM {products} p WHERE {where}", params)
+        else:
+            matches = self._orm_matches(terms, active_only).values("id")
+        return queryset.filter(id__in=matches)
+
+    def refresh(self, product_ids=None):
+        """Re-index the given products, or every product when None."""
+        if self.backend != "fts5":
+            return
+
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            if product_ids is None:
+                cursor.execute(f"DELETE FROM {quote(FTS_TABLE)}")
+                cursor.execute(self._fts_insert_sql(""))
+                return
+
+            product_ids = list(product_ids)
+            for start in range(0, len(product_ids), REFRESH_CHUNK):
+                chunk = product_ids[start : start + REFRESH_CHUNK]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"DELETE FROM {quote(FTS_TABLE)} WHERE rowid IN ({placeholders})",
+                    chunk,
+                )
+                cursor.execute(
+                    self._fts_insert_sql(f"WHERE p.id IN ({placeholders})"), chunk
+                )
+
+    def _detect(self):
+        try:
+            if connection.vendor == "sqlite":
+                if FTS_TABLE in connection.introspection.table_names():
+                    return "fts5"
+            elif connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                    )
+                    # Without the extension ILIKE still works, just unindexed
+                    return "trigram" if cursor.fetchone() else "ilike"
+        except DatabaseError as e:
+            print(f"Product search index unavailable, using a plain scan: {e}")
+        return "scan"
+
+    def _build_fts(self):
+        quote = connection.ops.quote_name
+        if FTS_TABLE in connection.introspection.table_names():
+            return
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {quote(FTS_TABLE)} USING fts5("
+                    "name, sku, barcodes, brand, category, state, "
+                    "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')"
+                )
+                cursor.execute(self._fts_insert_sql(""))
+        print("Built the product search index")
+
+    def _build_trigram(self):
+        quote = connection.ops.quote_name
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                    for model, field in TRIGRAM_INDEXES:
+                        table = model._meta.db_table
+                        cursor.execute(
+                            f"CREATE INDEX IF NOT EXISTS "
+                            f"{quote(f'{table}_{field}_trgm')} ON {quote(table)} "
+                            f"USING gin ({quote(field)} gin_trgm_ops)"
+                        )
+        except DatabaseError as e:
+            print(f"pg_trgm unavailable, product search is unindexed: {e}")
+
+    def _fts_insert_sql(self, where):
+        quote = connection.ops.quote_name
+        return (
+            f"INSERT INTO {quote(FTS_TABLE)} "
+            "(rowid, name, sku, barcodes, brand, category, state) "
+            "SELECT p.id, p.name, p.sku, "
+            f"(SELECT group_concat(b.barcode, ' ') FROM {quote(Barcode._meta.db_table)} b "
+            "WHERE b.product_id = p.id AND b.is_active), "
+            "br.name, c.name, CASE WHEN p.is_active THEN '' ELSE 'inactive' END "
+            f"FROM {quote(Product._meta.db_table)} p "
+            f"LEFT JOIN {quote(Brand._meta.db_table)} br ON br.id = p.brand_id "
+            f"LEFT JOIN {quote(Category._meta.db_table)} c ON c.id = p.category_id "
+            f"{where}"
+        )
+
+    def _fts_match(self, terms, active_only):
+        # Every term as a word prefix, in any searchable column
+        match = f"{FTS_COLUMNS}: (" + " ".join(f'"{term}"*' for term in terms) + ")"
+        if active_only:
+            match += " NOT state:inactive"
+        return match
+
+    def _code_matches(self, query, active_only):
+        """Products whose SKU or an active barcode contains query, if it is one code.
+
+        FTS5 only matches the start of a word, so part of a code from the
+        middle ("1234" of "ABC-001234") is looked up here instead.
+        """
+        code = query.strip()
+        if not code or any(char.isspace() for char in code):
+            return None
+
+        products = Product.objects.filter(
+            Q(sku__icontains=code)
+            | Q(barcodes__barcode__icontains=code, barcodes__is_active=True)
+        )
+        if active_only:
+            products = products.filter(is_active=True)
+        return products
+
+    def _search_fts(self, query, terms, limit, active_only):
+        table = connection.ops.quote_name(FTS_TABLE)
+        match = self._fts_match(terms, active_only)
+
+        with connection.cursor() as cursor:
+            if not limit:
+                cursor.execute(
+                    f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match]
+                )
+            else:
+                cursor.execute(
+                    f"SELECT rowid FROM {table} WHERE {table} MATCH %s "
+                    "AND rank MATCH %s ORDER BY rank LIMIT %s",
+                    [match, FTS_RANK, limit],
+                )
+            ids = [row[0] for row in cursor.fetchall()]
+
+        codes = self._code_matches(query, active_only)
+        if codes is None or (limit and len(ids) >= limit):
+            return ids
+
+        # Ranked matches first, then codes matched inside a word
+        codes = codes.exclude(id__in=ids).order_by("name")
+        codes = codes.values_list("id", flat=True).distinct()
+        return ids + list(codes[: limit - len(ids)] if limit else codes)
+
+    def _postgres_where(self, terms, active_only):
+        quote = connection.ops.quote_name
+        barcodes = quote(Barcode._meta.db_table)
+        brands = quote(Brand._meta.db_table)
+        categories = quote(Category._meta.db_table)
+
+        # Every term has to match one of the fields; each field test can use
+        # its own trigram index
+        conditions = ["p.is_active"] if active_only else []
+        params = []
+        for term in terms:
+            pattern = f"%{term}%"
+            conditions.append(
+                "(p.name ILIKE %s OR p.sku ILIKE %s"
+                f" OR p.id IN (SELECT product_id FROM {barcodes}"
+                " WHERE barcode ILIKE %s AND is_active)"
+                f" OR p.brand_id IN (SELECT id FROM {brands} WHERE name ILIKE %s)"
+                f" OR p.category_id IN (SELECT id FROM {categories} WHERE name ILIKE %s))"
+            )
+            params.extend([pattern] * 5)
+        return " AND ".join(conditions), params
+
+    def _search_postgres(self, backend, terms, limit, active_only):
+        products = connection.ops.quote_name(Product._meta.db_table)
+        where, params = self._postgres_where(terms, active_only)
+
+        if backend == "trigram":
+            order = "similarity(p.name, %s) DESC, p.name"
+            params.append(" ".join(terms))
+        else:
+            order = "p.name"
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT p.id FROM {products} p "
+                f"WHERE {where} ORDER BY {order} {limit_clause(limit)}",
+                params + ([limit] if limit else []),
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _orm_matches(self, terms, active_only):
+        products = Product.objects.all()
+        if active_only:
+            products = products.filter(is_active=True)
+        for term in terms:
+            products = products.filter(
+                Q(name__icontains=term)
+                | Q(sku__icontains=term)
+                | Q(barcodes__barcode__icontains=term, barcodes__is_active=True)
+                | Q(brand__name__icontains=term)
+                | Q(category__name__icontains=term)
+            )
+        return products
+
+    def _search_orm(self, terms, limit, active_only):
+        products = self._orm_matches(terms, active_only)
+        return list(
+            products.order_by("name").values_list("id", flat=True).distinct()[:limit]
+        )
+
+
+product_search = ProductSearchIndex()
+
+
+def search_products(query, limit=DEFAULT_LIMIT, active_only=True):
+    """Best matching products for query, best first."""
+    ids = product_search.search(query, limit, active_only)
+    products = Product.objects.select_related("brand", "category").in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_migrate, post_save, post_delete
+from django.dispatch import receiver
+from .models import Product, Barcode, Brand, Category
+from .lookup import product_index
+from .search import product_search
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_lookup(sender, instance, **kwargs):
+    product_index.discard_product(instance.pk)
+    product_search.refresh([instance.pk])
+
+
+@receiver(post_save, sender=Barcode)
+@receiver(post_delete, sender=Barcode)
+def invalidate_barcode_lookup(sender, instance, **kwargs):
+    product_index.discard_code(instance.barcode)
+    product_index.discard_product(instance.product_id)
+    product_search.refresh([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def refresh_product_search(sender, instance, created, **kwargs):
+    if not created:
+        product_search.refresh(instance.products.values_list("id", flat=True))
+
+
+def build_product_search(sender, **kwargs):
+    """Create the search index at migrate time, so no request runs DDL."""
+    product_search.build()
+
+
+def connect(app_config):
+    post_migrate.connect(
+        build_product_search, sender=app_config, dispatch_uid="build_product_search"
+    )
@@ -1,3 +1,377 @@
+import os
+import time
+import tracemalloc
+from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from sales.models import Sale, SaleItem
+from users.models import User
+from reports.models import ProductSalesStats
+from reports.rollup import rebuild_stats
+from reports.signals import seed_product_stats
+from .lookup import ProductLookupIndex
+from .models import Product, Barcode, Category
+from .search import product_search
 
-# Create your tests here.
+
+def bulk_products(count):
+    """Insert count products with one barcode each, bypassing save()."""
+    Product.objects.bulk_create(
+        [
+            Product(
+                name=f"Product {i}",
+                slug=f"product-{i}",
+                sku=f"P{i:07d}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                wholesale_price=Decimal("15.00"),
+                special_price=Decimal("12.00"),
+                quantity=100,
+            )
+            for i in range(count)
+        ],
+        batch_size=1000,
+    )
+    ids = Product.objects.order_by("id").values_list("id", flat=True)
+    Barcode.objects.bulk_create(
+        [
+            Barcode(product_id=product_id, barcode=f"5{i:011d}0")
+            for i, product_id in enumerate(ids)
+        ],
+        batch_size=1000,
+    )
+
+
+class ProductLookupIndexTests(TestCase):
+    SKUS = 50_000
+    SCANS = 10_000
+    # A dict lookup is microseconds; this leaves room for a slow CI machine
+    P99_BUDGET = 0.001
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_products(cls.SKUS)
+
+    def setUp(self):
+        self.index = ProductLookupIndex()
+        self.index.load()
+
+    def test_known_codes_resolve_without_queries(self):
+        with self.assertNumQueries(0):
+            by_sku = self.index.lookup("P0000042")
+            by_barcode = self.index.lookup("5000000000420")
+
+        self.assertEqual(by_sku.name, "Product 42")
+        self.assertEqual(by_barcode.id, by_sku.id)
+        self.assertEqual(by_sku.wholesale_price, Decimal("15.00"))
+
+    def test_p99_scan_latency(self):
+        step = self.SKUS // self.SCANS
+        codes = [
+            f"P{i:07d}" if i % 2 else f"5{i:011d}0"
+            for i in range(0, self.SKUS, step)
+        ]
+
+        timings = []
+        with self.assertNumQueries(0):
+            for code in codes:
+                start = time.perf_counter()
+                record = self.index.lookup(code)
+                timings.append(time.perf_counter() - start)
+                self.assertIsNotNone(record)
+
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99)]
+        self.assertLess(p99, self.P99_BUDGET)
+
+    def test_changed_product_is_reindexed(self):
+        product = Product.objects.get(sku="P0000007")
+        self.index.discard_product(product.id)
+        Product.objects.filter(id=product.id).update(name="Renamed")
+
+        self.assertEqual(self.index.lookup("P0000007").name, "Renamed")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.lookup("P0000007").name, "Renamed")
+
+    def test_unknown_code_is_none(self):
+        self.assertIsNone(self.index.lookup("NOPE"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.index.lookup("NOPE"))
+
+    def test_new_product_clears_remembered_unknown_codes(self):
+        self.assertIsNone(self.index.lookup("NEW-1"))
+        product = Product.objects.create(
+            name="New",
+            sku="NEW-1",
+            cost_price=Decimal("1.00"),
+            selling_price=Decimal("2.00"),
+            special_price=Decimal("1.50"),
+        )
+        self.index.discard_product(product.id)
+
+        self.assertEqual(self.index.lookup("NEW-1").id, product.id)
+
+    def test_inactive_product_is_answered_from_the_index(self):
+        Product.objects.filter(sku="P0000009").update(is_active=False)
+        self.index.load()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.index.lookup("P0000009"))
+            self.assertIsNone(self.index.lookup("5000000000090"))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        drinks = Category.objects.create(name="Mango Drinks")
+        for name in ("Mango Juice", "Apple Juice", "Orange Soda"):
+            Product.objects.create(
+                name=name,
+                cost_price=Decimal("1.00"),
+                selling_price=Decimal("3.00"),
+                special_price=Decimal("2.00"),
+                category=drinks,
+            )
+
+    def test_name_matches_rank_first(self):
+        names = [
+            Product.objects.get(id=pk).name for pk in product_search.search("mango")
+        ]
+        self.assertEqual(names[0], "Mango Juice")
+        self.assertEqual(len(names), 3)
+
+    def test_filter_keeps_matches_in_the_database(self):
+        products = product_search.filter(Product.objects.all(), "juice")
+        self.assertIn("SELECT", str(products.query).split("IN", 1)[1])
+        self.assertEqual(
+            sorted(products.values_list("name", flat=True)),
+            ["Apple Juice", "Mango Juice"],
+        )
+        self.assertFalse(product_search.filter(Product.objects.all(), "!!").exists())
+
+    def test_code_matches_inside_a_word(self):
+        product = Product.objects.create(
+            name="Tonic Water",
+            sku="TW-001234",
+            cost_price=Decimal("1.00"),
+            selling_price=Decimal("3.00"),
+            special_price=Decimal("2.00"),
+        )
+        Barcode.objects.create(product=product, barcode="6001234567890")
+
+        # Neither code starts a word, so only the substring fallback finds them
+        for code in ("1234", "4567"):
+            self.assertEqual(product_search.search(code), [product.id])
+            self.assertEqual(
+                list(product_search.filter(Product.objects.all(), code)), [product]
+            )
+
+    def test_search_runs_no_ddl_and_remembers_the_index(self):
+        product_search._backend = None
+        self.addCleanup(setattr, product_search, "_backend", None)
+
+        with CaptureQueriesContext(connection) as queries:
+            product_search.search("mango")
+        self.assertFalse(
+            [q for q in queries if q["sql"].lstrip().upper().startswith("CREATE")]
+        )
+        # The index was built after migrate, before any request
+        self.assertEqual(product_search.backend, "fts5")
+
+        with self.assertNumQueries(0):
+            product_search.backend
+
+
+class ProductSalesTotalsTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            wholesale_price=Decimal("15.00"),
+            special_price=Decimal("12.00"),
+            quantity=1000,
+        )
+        self.unsold = Product.objects.create(
+            name="Juice",
+            cost_price=Decimal("5.00"),
+            selling_price=Decimal("9.00"),
+            special_price=Decimal("6.00"),
+        )
+
+    def sell(self, sale_type, quantity):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type=sale_type)
+        SaleItem.objects.create(
+            sale=sale,
+            product=self.product,
+            quantity=quantity,
+            unit_price=self.product.get_price_by_sale_type(sale_type),
+        )
+        sale.complete_sale()
+
+    def sell_every_tier(self):
+        self.sell("RETAIL", 3)
+        self.sell("WHOLESALE", 4)
+        self.sell("SPECIAL", 5)
+
+    def test_totals_per_tier(self):
+        self.sell_every_tier()
+        product = Product.objects.get(id=self.product.id)
+
+        # 3 x 20 + 4 x 15 + 5 x 12 sold at a cost of 12 x 10
+        self.assertEqual(product.revenue_generated, Decimal("180.00"))
+        self.assertEqual(product.total_profit, Decimal("60.00"))
+        self.assertEqual(product.profit_margin, Decimal("50.00"))
+        self.assertEqual(Product.get_all_products_total_revenue(), Decimal("180.00"))
+        self.assertEqual(Product.get_all_products_total_profit(), Decimal("60.00"))
+        self.assertEqual(Product.get_all_products_profit_margin(), Decimal("50.00"))
+
+        unsold = Product.objects.get(id=self.unsold.id)
+        self.assertEqual(unsold.revenue_generated, Decimal("0.00"))
+        self.assertEqual(unsold.profit_margin, Decimal("0.00"))
+
+    def test_stats_are_seeded_after_migrate(self):
+        self.sell_every_tier()
+        # As left by a version that did not keep the stats
+        ProductSalesStats.objects.all().delete()
+
+        seed_product_stats(sender=None)
+
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual(product.total_profit, Decimal("60.00"))
+        self.assertEqual(Product.get_all_products_total_profit(), Decimal("60.00"))
+
+        # Stats kept since are left alone
+        ProductSalesStats.objects.update(retail_revenue=0)
+        seed_product_stats(sender=None)
+        self.assertEqual(
+            ProductSalesStats.objects.get(product=self.product).retail_revenue, 0
+        )
+
+    def test_query_cost_does_not_grow_with_sales(self):
+        for _ in range(4):
+            self.sell_every_tier()
+
+        product = Product.objects.get(id=self.product.id)
+        with self.assertNumQueries(1):
+            product.revenue_generated
+            product.total_profit
+            product.profit_margin
+
+        for total in (
+            Product.get_all_products_total_revenue,
+            Product.get_all_products_total_profit,
+            Product.get_all_products_profit_margin,
+        ):
+            with self.assertNumQueries(1):
+                total()
+
+    def test_totals_keep_the_prices_sold_at(self):
+        self.sell_every_tier()
+        Product.objects.filter(id=self.product.id).update(
+            cost_price=Decimal("50.00"), selling_price=Decimal("99.00")
+        )
+        product = Product.objects.get(id=self.product.id)
+
+        self.assertEqual(product.revenue_generated, Decimal("180.00"))
+        self.assertEqual(
+            Product.get_all_products_total_revenue(), product.revenue_generated
+        )
+        self.assertEqual(Product.get_all_products_total_profit(), product.total_profit)
+        self.assertEqual(
+            Product.get_all_products_profit_margin(), product.profit_margin
+        )
+
+
+def measure(function):
+    """Wall time and peak traced Python memory of one call."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def loop_total_profit():
+    # The per-item loop the stats table replaced
+    total_profit = Decimal(0)
+    for item in SaleItem.objects.select_related("product", "sale"):
+        product = item.product
+        if item.sale.sale_type == "WHOLESALE":
+            selling_price = product.wholesale_price or product.selling_price
+        elif item.sale.sale_type == "SPECIAL":
+            selling_price = product.special_price
+        else:
+            selling_price = product.selling_price
+        total_profit += (selling_price - product.cost_price) * item.quantity
+    return total_profit
+
+
+@skipUnless(os.environ.get("BENCHMARK"), "set BENCHMARK=1 to run benchmarks")
+class ProductSalesTotalsBenchmark(TestCase):
+    """BENCHMARK_SALE_ITEMS (default 1,000,000) items over 1,000 products."""
+
+    def test_stats_beat_the_item_loop(self):
+        items = int(os.environ.get("BENCHMARK_SALE_ITEMS", 1_000_000))
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        products = Product.objects.bulk_create(
+            Product(
+                name=f"Product {n}",
+                sku=f"BENCH{n}",
+                slug=f"bench-{n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                wholesale_price=Decimal("15.00"),
+                special_price=Decimal("12.00"),
+            )
+            for n in range(1000)
+        )
+        now = timezone.now()
+        tiers = [("RETAIL", "20.00"), ("WHOLESALE", "15.00"), ("SPECIAL", "12.00")]
+        sales = Sale.objects.bulk_create(
+            Sale(
+                sale_number=f"BENCH-{n}",
+                sale_type=tiers[n % 3][0],
+                cashier=cashier,
+                completed_at=now,
+            )
+            for n in range(items // 10)
+        )
+        for start in range(0, items, 50_000):
+            SaleItem.objects.bulk_create(
+                SaleItem(
+                    sale=sales[n // 10],
+                    product=products[n % len(products)],
+                    quantity=2,
+                    unit_price=Decimal(tiers[(n // 10) % 3][1]),
+                    total_amount=Decimal(tiers[(n // 10) % 3][1]) * 2,
+                )
+                for n in range(start, min(start + 50_000, items))
+            )
+        rebuild_stats()
+
+        stats_profit, stats_time, stats_peak = measure(
+            Product.get_all_products_total_profit
+        )
+        loop_profit, loop_time, loop_peak = measure(loop_total_profit)
+
+        self.assertEqual(stats_profit, loop_profit)
+        self.assertLess(
+            stats_time * 100,
+            loop_time,
+            f"stats {stats_time:.4f}s vs loop {loop_time:.2f}s",
+        )
+        self.assertLess(
+            stats_peak * 100,
+            loop_peak,
+            f"stats {stats_peak} B vs loop {loop_peak} B peak",
+        )
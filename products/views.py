@@ -4,8 +4,10 @@ from django.core.exceptions import PermissionDenied
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db.models import Q
+from django.http import JsonResponse
 from .models import Product, Category, Brand, StockMovement
 from .forms import ProductForm, CategoryForm, BrandForm, Barcode
+from .search import DEFAULT_LIMIT, MAX_LIMIT, product_search, search_products
 import json
 from django.shortcuts import render, redirect
 from django.contrib import messages
@@ -13,12 +15,45 @@ from django.views.decorators.http import require_POST
 from hardware.thermal_printer import print_barcodes
 
 
+@login_required
+def search(request):
+    """Ranked live search for the till, by name, SKU, barcode, brand or category"""
+    query = request.GET.get("q", "").strip()
+    try:
+        limit = min(max(int(request.GET.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+
+    products = [
+        {
+            "id": product.id,
+            "name": product.name,
+            "sku": product.sku,
+            "brand": product.brand.name if product.brand else None,
+            "category": product.category.name if product.category else None,
+            "selling_price": str(product.selling_price),
+            "wholesale_price": (
+                str(product.wholesale_price) if product.wholesale_price else None
+            ),
+            "special_price": (
+                str(product.special_price) if product.special_price else None
+            ),
+            "quantity": product.quantity,
+        }
+        for product in search_products(query, limit)
+    ]
+    return JsonResponse({"success": True, "products": products})
+
+
 @login_required
 def product_detail(request, slug):
     if not request.user.can_view_products():
         raise PermissionDenied("You do not have permission to view product details.")
 
-    product = get_object_or_404(Product, slug=slug)
+    product = get_object_or_404(
+        Product.objects.select_related("sales_stats").with_primary_barcode(),
+        slug=slug,
+    )
     context = {
         "product": product,
     }
@@ -27,16 +62,13 @@ def product_detail(request, slug):
 
 @login_required
 def product_list(request):
-    products = Product.objects.all()
+    products = Product.objects.select_related(
+        "category", "brand"
+    ).with_primary_barcode()
 
     search_query = request.GET.get("search", "").strip()
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query)
-            | Q(sku__icontains=search_query)
-            | Q(category__name__icontains=search_query)
-            | Q(brand__name__icontains=search_query)
-        )
+        products = product_search.filter(products, search_query, active_only=False)
 
     sort_by = request.GET.get("sort", "name")
 
@@ -0,0 +1,34 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from reports.rollup import rebuild, rebuild_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the hourly sales rollups and per-product sales stats "
+        "from completed sales and returns"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="Only rebuild from this date on (YYYY-MM-DD, default: everything)",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = date.fromisoformat(options["since"])
+            except ValueError:
+                raise CommandError("--since must be a date in YYYY-MM-DD format")
+
+        sale_rows, product_rows = rebuild(since)
+        # Lifetime totals, so always rebuilt in full
+        stats_rows = rebuild_stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {sale_rows} sales rollup rows, {product_rows} product rows "
+                f"and {stats_rows} product stats rows"
+            )
+        )
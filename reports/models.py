@@ -1,3 +1,136 @@
+from decimal import Decimal
 from django.db import models
+from django.conf import settings
 
-# Create your models here.
+
+class SalesRollup(models.Model):
+    """Sale-level totals per local hour, sale type and cashier."""
+
+    date = models.DateField(db_index=True)
+    hour = models.PositiveSmallIntegerField()
+    sale_type = models.CharField(max_length=10)
+    cashier = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+
+    sale_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    return_count = models.IntegerField(default=0)
+    returned_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "hour", "sale_type", "cashier"],
+                name="unique_sales_rollup_slot",
+            )
+        ]
+        ordering = ["-date", "-hour"]
+
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}h {self.sale_type} - {self.revenue}"
+
+
+class ProductSalesRollup(models.Model):
+    """Per-product sales per local hour, sale type and cashier."""
+
+    date = models.DateField(db_index=True)
+    hour = models.PositiveSmallIntegerField()
+    sale_type = models.CharField(max_length=10)
+    cashier = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    product = models.ForeignKey(
+        "products.Product", on_delete=models.CASCADE, related_name="sales_rollups"
+    )
+
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    returned_quantity = models.IntegerField(default=0)
+    returned_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "hour", "sale_type", "cashier", "product"],
+                name="unique_product_sales_rollup_slot",
+            )
+        ]
+        ordering = ["-date", "-hour"]
+
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}h {self.product_id} x{self.quantity}"
+
+
+class ProductSalesStats(models.Model):
+    """Lifetime sales of one product, split by price tier.
+
+    Revenue and cost are net of returns; the unit counts are kept apart so
+    both what was sold and what came back can be shown.
+    """
+
+    TIERS = {"RETAIL": "retail", "WHOLESALE": "wholesale", "SPECIAL": "special"}
+
+    product = models.OneToOneField(
+        "products.Product", on_delete=models.CASCADE, related_name="sales_stats"
+    )
+
+    retail_quantity = models.IntegerField(default=0)
+    retail_returned_quantity = models.IntegerField(default=0)
+    retail_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    retail_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    wholesale_quantity = models.IntegerField(default=0)
+    wholesale_returned_quantity = models.IntegerField(default=0)
+    wholesale_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    wholesale_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    special_quantity = models.IntegerField(default=0)
+    special_returned_quantity = models.IntegerField(default=0)
+    special_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    special_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.product_id} - {self.revenue}"
+
+    @classmethod
+    def field(cls, sale_type, name):
+        """Column of `name` for a sale type, e.g. ("WHOLESALE", "revenue")."""
+        return f"{cls.TIERS.get(sale_type, 'retail')}_{name}"
+
+    @classmethod
+    def totals(cls):
+        """Revenue and cost summed over every product, in one query."""
+        columns = [
+            f"{tier}_{name}" for tier in cls.TIERS.values() for name in ("revenue", "cost")
+        ]
+        sums = cls.objects.aggregate(**{column: models.Sum(column) for column in columns})
+        return {
+            name: sum(
+                (sums[f"{tier}_{name}"] or Decimal("0.00") for tier in cls.TIERS.values()),
+                Decimal("0.00"),
+            )
+            for name in ("revenue", "cost")
+        }
+
+    def _total(self, name):
+        return sum(getattr(self, f"{tier}_{name}") for tier in self.TIERS.values())
+
+    @property
+    def quantity(self):
+        return self._total("quantity")
+
+    @property
+    def returned_quantity(self):
+        return self._total("returned_quantity")
+
+    @property
+    def revenue(self):
+        return self._total("revenue")
+
+    @property
+    def cost(self):
+        return self._total("cost")
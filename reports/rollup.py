@@ -0,0 +1,376 @@
+from collections import defaultdict
+from functools import partial
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import SalesRollup, ProductSalesRollup, ProductSalesStats
+
+
+def _slot(moment):
+    local = timezone.localtime(moment)
+    return local.date(), local.hour
+
+
+def _bump(model, keys, increments):
+    increments = {field: value for field, value in increments.items() if value}
+    if not increments:
+        return
+
+    expressions = {field: F(field) + value for field, value in increments.items()}
+    if model.objects.filter(**keys).update(**expressions):
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **increments)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**expressions)
+
+
+def _bump_products(item_totals):
+    """Add per-product increments keyed by (date, hour, sale_type, cashier, product)."""
+    slots = defaultdict(dict)
+    for (date, hour, sale_type, cashier_id, product_id), values in item_totals.items():
+        slots[(date, hour, sale_type, cashier_id)][product_id] = values
+
+    for (date, hour, sale_type, cashier_id), products in slots.items():
+        _bump_rows(
+            ProductSalesRollup,
+            dict(date=date, hour=hour, sale_type=sale_type, cashier_id=cashier_id),
+            products,
+        )
+
+
+def _bump_stats(item_totals):
+    """Add increments to the per-product stats, keyed by product."""
+    _bump_rows(ProductSalesStats, {}, item_totals)
+
+
+def _bump_rows(model, keys, products):
+    """Add {product_id: increments} to the rows of model that share keys.
+
+    Rows are locked, updated and created in bulk, so the number of queries
+    does not grow with the number of products.
+    """
+    existing = {
+        row.product_id: row
+        for row in model.objects.select_for_update().filter(
+            **keys, product_id__in=products
+        )
+    }
+
+    fields = set()
+    for product_id, row in existing.items():
+        for field, value in products[product_id].items():
+            setattr(row, field, getattr(row, field) + value)
+            fields.add(field)
+    if fields:
+        model.objects.bulk_update(existing.values(), list(fields))
+
+    missing = {
+        product_id: values
+        for product_id, values in products.items()
+        if product_id not in existing
+    }
+    if not missing:
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(
+                [
+                    model(**keys, product_id=product_id, **values)
+                    for product_id, values in missing.items()
+                ]
+            )
+    except IntegrityError:
+        for product_id, values in missing.items():
+            _bump(model, dict(keys, product_id=product_id), values)
+
+
+def record_sales(sales):
+    """Add completed sales (and their items) to the rollups."""
+    from sales.models import SaleItem
+
+    sales = {sale.pk: sale for sale in sales if sale.completed_at}
+    if not sales:
+        return
+
+    sale_totals = defaultdict(lambda: defaultdict(Decimal))
+    for sale in sales.values():
+        keys = _slot(sale.completed_at) + (sale.sale_type, sale.cashier_id)
+        sale_totals[keys]["sale_count"] += 1
+        sale_totals[keys]["revenue"] += sale.final_amount or 0
+        sale_totals[keys]["discount"] += sale.discount_amount or 0
+
+    item_totals = defaultdict(lambda: defaultdict(Decimal))
+    stats = defaultdict(lambda: defaultdict(Decimal))
+    items = SaleItem.objects.filter(sale_id__in=sales).values_list(
+        "sale_id", "product_id", "quantity", "total_amount", "product__cost_price"
+    )
+    for sale_id, product_id, quantity, total_amount, cost_price in items:
+        sale = sales[sale_id]
+        keys = _slot(sale.completed_at) + (sale.sale_type, sale.cashier_id, product_id)
+        cost = cost_price * quantity
+        item_totals[keys]["quantity"] += quantity
+        item_totals[keys]["revenue"] += total_amount
+        item_totals[keys]["cost"] += cost
+        item_totals[keys]["profit"] += total_amount - cost
+
+        tier = partial(ProductSalesStats.field, sale.sale_type)
+        stats[product_id][tier("quantity")] += quantity
+        stats[product_id][tier("revenue")] += total_amount
+        stats[product_id][tier("cost")] += cost
+
+    with transaction.atomic():
+        for (date, hour, sale_type, cashier_id), values in sale_totals.items():
+            _bump(
+                SalesRollup,
+                dict(date=date, hour=hour, sale_type=sale_type, cashier_id=cashier_id),
+                values,
+            )
+
+        _bump_products(item_totals)
+        _bump_stats(stats)
+
+
+def record_sale(sale):
+    record_sales([sale])
+
+
+def record_return(return_obj):
+    """Add a processed return to the rollups, on the day it was taken."""
+    from sales.models import ReturnItem
+
+    date, hour = _slot(return_obj.created_at)
+    sale_type = return_obj.sale.sale_type
+    cashier_id = return_obj.cashier_id
+
+    item_totals = defaultdict(lambda: defaultdict(Decimal))
+    stats = defaultdict(lambda: defaultdict(Decimal))
+    tier = partial(ProductSalesStats.field, sale_type)
+    items = ReturnItem.objects.filter(return_fk=return_obj).values_list(
+        "sale_item__product_id",
+        "quantity",
+        "total_price",
+        "sale_item__product__cost_price",
+    )
+    for product_id, quantity, total_price, cost_price in items:
+        item_totals[product_id]["returned_quantity"] += quantity
+        item_totals[product_id]["returned_amount"] += total_price
+
+        stats[product_id][tier("returned_quantity")] += quantity
+        stats[product_id][tier("revenue")] -= total_price
+        stats[product_id][tier("cost")] -= cost_price * quantity
+
+    with transaction.atomic():
+        _bump(
+            SalesRollup,
+            dict(date=date, hour=hour, sale_type=sale_type, cashier_id=cashier_id),
+            {
+                "return_count": 1,
+                "returned_amount": return_obj.total_return_amount,
+            },
+        )
+
+        _bump_products(
+            {
+                (date, hour, sale_type, cashier_id, product_id): values
+                for product_id, values in item_totals.items()
+            }
+        )
+        _bump_stats(stats)
+
+
+def sales_summary(rollups):
+    """Totals over a SalesRollup queryset, shaped like the old Sale aggregates."""
+    summary = rollups.aggregate(
+        total=Sum("revenue"), count=Sum("sale_count"), discount=Sum("discount")
+    )
+    summary["count"] = summary["count"] or 0
+    summary["avg"] = summary["total"] / summary["count"] if summary["count"] else None
+    return summary
+
+
+def rebuild(since=None):
+    """Recompute the rollups from sales and returns (from `since`, a date, on)."""
+    from django.db.models import Count
+    from django.db.models.functions import TruncDate, ExtractHour
+    from sales.models import Sale, SaleItem, Return, ReturnItem
+    from products.aggregates import cost_expression
+
+    sales = Sale.objects.filter(completed_at__isnull=False)
+    items = SaleItem.objects.filter(sale__completed_at__isnull=False)
+    returns = Return.objects.all()
+    return_items = ReturnItem.objects.all()
+    if since:
+        sales = sales.filter(completed_at__date__gte=since)
+        items = items.filter(sale__completed_at__date__gte=since)
+        returns = returns.filter(created_at__date__gte=since)
+        return_items = return_items.filter(return_fk__created_at__date__gte=since)
+
+    def slot(field):
+        return {"day": TruncDate(field), "slot_hour": ExtractHour(field)}
+
+    sale_rows = {}
+
+    def sale_row(day, hour, sale_type, cashier_id):
+        key = (day, hour, sale_type, cashier_id)
+        if key not in sale_rows:
+            sale_rows[key] = SalesRollup(
+                date=day, hour=hour, sale_type=sale_type, cashier_id=cashier_id
+            )
+        return sale_rows[key]
+
+    for row in (
+        sales.annotate(**slot("completed_at"))
+        .values("day", "slot_hour", "sale_type", "cashier_id")
+        .annotate(
+            sale_count=Count("id"),
+            revenue=Sum("final_amount"),
+            discount=Sum("discount_amount"),
+        )
+        .order_by()
+    ):
+        rollup = sale_row(row["day"], row["slot_hour"], row["sale_type"], row["cashier_id"])
+        rollup.sale_count = row["sale_count"]
+        rollup.revenue = row["revenue"] or 0
+        rollup.discount = row["discount"] or 0
+
+    for row in (
+        returns.annotate(**slot("created_at"))
+        .values("day", "slot_hour", "sale__sale_type", "cashier_id")
+        .annotate(return_count=Count("id"), returned_amount=Sum("total_return_amount"))
+        .order_by()
+    ):
+        rollup = sale_row(
+            row["day"], row["slot_hour"], row["sale__sale_type"], row["cashier_id"]
+        )
+        rollup.return_count = row["return_count"]
+        rollup.returned_amount = row["returned_amount"] or 0
+
+    product_rows = {}
+
+    def product_row(day, hour, sale_type, cashier_id, product_id):
+        key = (day, hour, sale_type, cashier_id, product_id)
+        if key not in product_rows:
+            product_rows[key] = ProductSalesRollup(
+                date=day,
+                hour=hour,
+                sale_type=sale_type,
+                cashier_id=cashier_id,
+                product_id=product_id,
+            )
+        return product_rows[key]
+
+    for row in (
+        items.annotate(**slot("sale__completed_at"))
+        .values("day", "slot_hour", "sale__sale_type", "sale__cashier_id", "product_id")
+        .annotate(
+            quantity_sum=Sum("quantity"),
+            revenue=Sum("total_amount"),
+            cost=cost_expression(),
+        )
+        .order_by()
+    ):
+        rollup = product_row(
+            row["day"],
+            row["slot_hour"],
+            row["sale__sale_type"],
+            row["sale__cashier_id"],
+            row["product_id"],
+        )
+        rollup.quantity = row["quantity_sum"] or 0
+        rollup.revenue = row["revenue"] or 0
+        rollup.cost = row["cost"] or 0
+        rollup.profit = rollup.revenue - rollup.cost
+
+    for row in (
+        return_items.annotate(**slot("return_fk__created_at"))
+        .values(
+            "day",
+            "slot_hour",
+            "return_fk__sale__sale_type",
+            "return_fk__cashier_id",
+            "sale_item__product_id",
+        )
+        .annotate(quantity_sum=Sum("quantity"), amount=Sum("total_price"))
+        .order_by()
+    ):
+        rollup = product_row(
+            row["day"],
+            row["slot_hour"],
+            row["return_fk__sale__sale_type"],
+            row["return_fk__cashier_id"],
+            row["sale_item__product_id"],
+        )
+        rollup.returned_quantity = row["quantity_sum"] or 0
+        rollup.returned_amount = row["amount"] or 0
+
+    with transaction.atomic():
+        stale_sales = SalesRollup.objects.all()
+        stale_products = ProductSalesRollup.objects.all()
+        if since:
+            stale_sales = stale_sales.filter(date__gte=since)
+            stale_products = stale_products.filter(date__gte=since)
+        stale_sales.delete()
+        stale_products.delete()
+
+        SalesRollup.objects.bulk_create(sale_rows.values(), batch_size=500)
+        ProductSalesRollup.objects.bulk_create(product_rows.values(), batch_size=500)
+
+    return len(sale_rows), len(product_rows)
+
+
+def rebuild_stats():
+    """Recompute every product's lifetime sales stats from sales and returns."""
+    from sales.models import SaleItem, ReturnItem
+    from products.aggregates import MONEY, cost_expression
+
+    totals = defaultdict(lambda: defaultdict(Decimal))
+
+    for row in (
+        SaleItem.objects.filter(sale__completed_at__isnull=False)
+        .values("product_id", "sale__sale_type")
+        .annotate(
+            quantity_sum=Sum("quantity"),
+            revenue=Sum("total_amount"),
+            cost=cost_expression(),
+        )
+        .order_by()
+    ):
+        values = totals[row["product_id"]]
+        tier = partial(ProductSalesStats.field, row["sale__sale_type"])
+        values[tier("quantity")] += row["quantity_sum"] or 0
+        values[tier("revenue")] += row["revenue"] or 0
+        values[tier("cost")] += row["cost"]
+
+    for row in (
+        ReturnItem.objects.values("sale_item__product_id", "return_fk__sale__sale_type")
+        .annotate(
+            quantity_sum=Sum("quantity"),
+            amount=Sum("total_price"),
+            cost=Sum(
+                F("sale_item__product__cost_price") * F("quantity"), output_field=MONEY
+            ),
+        )
+        .order_by()
+    ):
+        values = totals[row["sale_item__product_id"]]
+        tier = partial(ProductSalesStats.field, row["return_fk__sale__sale_type"])
+        values[tier("returned_quantity")] += row["quantity_sum"] or 0
+        values[tier("revenue")] -= row["amount"] or 0
+        values[tier("cost")] -= row["cost"] or 0
+
+    with transaction.atomic():
+        ProductSalesStats.objects.all().delete()
+        ProductSalesStats.objects.bulk_create(
+            [
+                ProductSalesStats(product_id=product_id, **values)
+                for product_id, values in totals.items()
+            ],
+            batch_size=500,
+        )
+
+    return len(totals)
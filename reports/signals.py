@@ -0,0 +1,22 @@
+from django.db.models.signals import post_migrate
+from .models import ProductSalesStats
+
+
+def seed_product_stats(sender, using="default", **kwargs):
+    """Fill in the product sales stats of a database with sales made before them."""
+    from sales.models import Sale
+    from .rollup import rebuild_stats
+
+    if ProductSalesStats.objects.using(using).exists():
+        return
+    if not Sale.objects.using(using).filter(completed_at__isnull=False).exists():
+        return
+
+    count = rebuild_stats()
+    print(f"Seeded product sales stats ({count} products)")
+
+
+def connect(app_config):
+    post_migrate.connect(
+        seed_product_stats, sender=app_config, dispatch_uid="seed_product_stats"
+    )
@@ -5,12 +5,12 @@ from .models import Sale, ReturnItem
 
 class ReturnStartForm(forms.Form):
     sale_number = forms.CharField(
-        max_length=20,
+        max_length=32,
         label="Sale Number",
         widget=forms.TextInput(
             attrs={
                 "class": "form-control",
-                "placeholder": "Enter sale number (e.g., SALE-20241125-0001)",
+                "placeholder": "Enter sale number (e.g., SALE-20241125-1-0001)",
                 "autofocus": True,
             }
         ),
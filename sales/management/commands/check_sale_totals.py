@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from sales.models import Sale
+
+
+class Command(BaseCommand):
+    help = "Recompute cached cart totals from sale items and report mismatches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Check completed sales too (default: open carts only)",
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Overwrite cached totals that do not match the items",
+        )
+
+    def handle(self, *args, **options):
+        sales = Sale.objects.all()
+        if not options["all"]:
+            sales = sales.filter(completed_at__isnull=True)
+
+        checked = 0
+        mismatched = 0
+
+        for sale in sales.iterator():
+            checked += 1
+            totals = sale.calculate_cart_totals()
+
+            if (
+                sale.cart_subtotal == totals["subtotal"]
+                and sale.cart_special_total == totals["special_total"]
+                and sale.cart_items_count == totals["items_count"]
+            ):
+                continue
+
+            mismatched += 1
+            self.stdout.write(
+                f"{sale.sale_number}: cached subtotal={sale.cart_subtotal} "
+                f"special={sale.cart_special_total} items={sale.cart_items_count}, "
+                f"actual subtotal={totals['subtotal']} "
+                f"special={totals['special_total']} items={totals['items_count']}"
+            )
+
+            if options["fix"]:
+                sale.refresh_cart_totals()
+
+        style = self.style.WARNING if mismatched else self.style.SUCCESS
+        action = "fixed" if options["fix"] else "found"
+        self.stdout.write(
+            style(f"Checked {checked} sales, {action} {mismatched} mismatches")
+        )
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum, Count, Value, DecimalField
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
@@ -12,7 +14,7 @@ class Sale(models.Model):
     ]
 
     sale_number = models.CharField(
-        max_length=20, unique=True, editable=False, db_index=True
+        max_length=32, unique=True, editable=False, db_index=True
     )
     sale_type = models.CharField(max_length=10, choices=SALE_TYPES, default="RETAIL")
     cashier = models.ForeignKey(
@@ -30,6 +32,14 @@ class Sale(models.Model):
         max_digits=12, decimal_places=2, null=True, blank=True
     )
     notes = models.TextField(blank=True)
+    # Store whose terminal took the sale; blank for sales made on the server
+    store_id = models.CharField(max_length=20, blank=True, db_index=True)
+
+    cart_subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cart_special_total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0
+    )
+    cart_items_count = models.IntegerField(default=0)
 
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
@@ -51,46 +61,118 @@ class Sale(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.sale_number:
-            today = timezone.now().strftime("%Y%m%d")
-            last_sale = (
-                Sale.objects.filter(sale_number__startswith=f"SALE-{today}")
-                .order_by("-sale_number")
-                .first()
-            )
+            from .sequences import next_number
 
-            if last_sale:
-                last_number = int(last_sale.sale_number.split("-")[-1])
-                new_number = last_number + 1
-            else:
-                new_number = 1
+            self.sale_number = next_number("SALE")
 
-            self.sale_number = f"SALE-{today}-{new_number:04d}"
+        if not self.completed_at or self.synced_at:
+            super().save(*args, **kwargs)
+            return
 
-        super().save(*args, **kwargs)
+        from sync.outbox import enqueue_sale
+
+        # Keep the queued payload in step with the sale until it is pushed
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            enqueue_sale(self)
+
+    @property
+    def cart_total(self):
+        return self.cart_subtotal + self.cart_special_total
+
+    def apply_cart_delta(self, subtotal, special_total, items_count):
+        Sale.objects.filter(pk=self.pk).update(
+            cart_subtotal=F("cart_subtotal") + subtotal,
+            cart_special_total=F("cart_special_total") + special_total,
+            cart_items_count=F("cart_items_count") + items_count,
+        )
+        self.cart_subtotal += subtotal
+        self.cart_special_total += special_total
+        self.cart_items_count += items_count
+
+    def calculate_cart_totals(self):
+        zero = Value(Decimal("0"), output_field=DecimalField())
+        # What each line was saved at, as in SaleItem.cart_line
+        special_line = (
+            F("total_amount") + F("discount_amount") - F("quantity") * F("unit_price")
+        )
+
+        totals = self.items.aggregate(
+            subtotal=Coalesce(
+                Sum(F("quantity") * F("unit_price"), output_field=DecimalField()),
+                zero,
+            ),
+            special_total=Coalesce(
+                Sum(special_line, output_field=DecimalField()), zero
+            ),
+            items_count=Count("id"),
+        )
+        if self.sale_type != "SPECIAL":
+            totals["special_total"] = Decimal("0")
+        return totals
+
+    def refresh_cart_totals(self):
+        totals = self.calculate_cart_totals()
+        self.cart_subtotal = totals["subtotal"]
+        self.cart_special_total = totals["special_total"]
+        self.cart_items_count = totals["items_count"]
+        Sale.objects.filter(pk=self.pk).update(
+            cart_subtotal=self.cart_subtotal,
+            cart_special_total=self.cart_special_total,
+            cart_items_count=self.cart_items_count,
+        )
 
     def complete_sale(self):
         if self.completed_at:
             return
 
-        self.completed_at = timezone.now()
+        from products.models import Product
+        from reports.rollup import record_sale
+        from sync.background_sync import request_push
 
-        total = Decimal("0")
-        special_total = Decimal("0")
+        with transaction.atomic():
+            # Lock the sale so two requests cannot complete (and sell) it twice
+            locked = Sale.objects.select_for_update().filter(pk=self.pk)
+            if locked.values_list("completed_at", flat=True).first():
+                self.refresh_from_db()
+                return
 
-        for item in self.items.all():
-            if self.sale_type == "SPECIAL":
-                item_total = item.quantity * item.product.special_price
-            else:
-                item_total = item.quantity * item.unit_price
-            total += item_total
+            self.completed_at = timezone.now()
+
+            lines = list(
+                self.items.values_list(
+                    "product_id", "quantity", "unit_price", "product__special_price"
+                )
+            )
+
+            total = Decimal("0")
+            special_total = Decimal("0")
+
+            for product_id, quantity, unit_price, special_price in lines:
+                if self.sale_type == "SPECIAL":
+                    # As SaleItem.save: no special price sells at the unit price
+                    item_total = quantity * (special_price or unit_price)
+                    special_total += quantity * unit_price - item_total
+                else:
+                    item_total = quantity * unit_price
+                total += item_total
+
+            Product.move_stock(
+                [
+                    (product_id, -quantity, f"Sale completed - {quantity} units sold")
+                    for product_id, quantity, _, _ in lines
+                ],
+                "OUT",
+            )
 
-            item.product.sell(item.quantity)
+            self.total_amount = total
+            self.special_amount = special_total
+            self.final_amount = total - self.discount_amount
 
-        self.total_amount = total
-        self.special_amount = special_total
-        self.final_amount = total - self.discount_amount
+            self.save()
 
-        self.save()
+            record_sale(self)
+            transaction.on_commit(request_push)
 
 
 class SaleItem(models.Model):
@@ -109,19 +191,73 @@ class SaleItem(models.Model):
     def __str__(self):
         return f"{self.product.name} x{self.quantity}"
 
+    CART_LINE_FIELDS = ("quantity", "unit_price", "total_amount", "discount_amount")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.CART_LINE_FIELDS):
+            instance._loaded_cart_line = instance._cart_line_values()
+        return instance
+
+    def _cart_line_values(self):
+        return tuple(getattr(self, name) for name in self.CART_LINE_FIELDS)
+
+    @staticmethod
+    def cart_line(sale_type, quantity, unit_price, total_amount, discount_amount):
+        """(subtotal, special_total) a line adds to its sale's cart totals.
+
+        The special part comes from the stored line total, so a later change
+        to the product's special price does not skew the running totals.
+        """
+        subtotal = quantity * unit_price
+        special_total = Decimal("0")
+        if sale_type == "SPECIAL":
+            special_total = total_amount + discount_amount - subtotal
+        return subtotal, special_total
+
     def save(self, *args, **kwargs):
         if self.sale.sale_type == "SPECIAL":
-            self.total_amount = (
-                self.quantity * self.product.special_price - self.discount_amount
-            )
+            special_price = self.product.special_price or self.unit_price
+            self.total_amount = self.quantity * special_price - self.discount_amount
         else:
             self.total_amount = self.quantity * self.unit_price - self.discount_amount
-        super().save(*args, **kwargs)
+
+        adding = self._state.adding
+        loaded = getattr(self, "_loaded_cart_line", None)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            if adding or loaded is not None:
+                sale_type = self.sale.sale_type
+                subtotal, special_total = self.cart_line(
+                    sale_type, *self._cart_line_values()
+                )
+                if loaded is not None:
+                    old_subtotal, old_special_total = self.cart_line(sale_type, *loaded)
+                    subtotal -= old_subtotal
+                    special_total -= old_special_total
+                self.sale.apply_cart_delta(subtotal, special_total, 1 if adding else 0)
+            else:
+                self.sale.refresh_cart_totals()
+
+        self._loaded_cart_line = self._cart_line_values()
+
+    def delete(self, *args, **kwargs):
+        loaded = getattr(self, "_loaded_cart_line", self._cart_line_values())
+        subtotal, special_total = self.cart_line(self.sale.sale_type, *loaded)
+
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.sale.apply_cart_delta(-subtotal, -special_total, -1)
+
+        return result
 
 
 class Return(models.Model):
     return_number = models.CharField(
-        max_length=20, unique=True, editable=False, db_index=True
+        max_length=32, unique=True, editable=False, db_index=True
     )
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE)
     cashier = models.ForeignKey(
@@ -133,6 +269,7 @@ class Return(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     synced_at = models.DateTimeField(null=True, blank=True, db_index=True)
     notes = models.TextField(blank=True)
+    store_id = models.CharField(max_length=20, blank=True, db_index=True)
 
     class Meta:
         indexes = [
@@ -148,20 +285,9 @@ class Return(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.return_number:
-            today = timezone.now().strftime("%Y%m%d")
-            last_return = (
-                Return.objects.filter(return_number__startswith=f"RETURN-{today}")
-                .order_by("-return_number")
-                .first()
-            )
-
-            if last_return:
-                last_number = int(last_return.return_number.split("-")[-1])
-                new_number = last_number + 1
-            else:
-                new_number = 1
+            from .sequences import next_number
 
-            self.return_number = f"RETURN-{today}-{new_number:04d}"
+            self.return_number = next_number("RETURN")
 
         super().save(*args, **kwargs)
 
@@ -192,3 +318,22 @@ class ReturnItem(models.Model):
     def save(self, *args, **kwargs):
         self.total_price = self.quantity * self.unit_price
         super().save(*args, **kwargs)
+
+
+class SequenceCounter(models.Model):
+    """Last number handed out per counter name, store and day."""
+
+    name = models.CharField(max_length=20)
+    store_id = models.CharField(max_length=20)
+    day = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "store_id", "day"], name="unique_sequence_counter"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} {self.store_id} {self.day}: {self.last_value}"
@@ -0,0 +1,71 @@
+from django.db.models import Prefetch, Sum
+from products.models import Barcode
+from .models import SaleItem, ReturnItem
+
+
+def returned_quantities(sale):
+    """Units already returned per line of a sale, {sale_item_id: quantity}.
+
+    One grouped query, however many lines the sale has.
+    """
+    return dict(
+        ReturnItem.objects.filter(sale_item__sale=sale)
+        .values("sale_item")
+        .annotate(total=Sum("quantity"))
+        .values_list("sale_item", "total")
+    )
+
+
+def returnable_lines(sale):
+    """Every line of a sale with how much was returned and what still can be.
+
+    Returns {sale_item_id: {"item", "already_returned", "available"}} in the
+    sale's line order.
+    """
+    return _lines(sale.items.select_related("product"), returned_quantities(sale))
+
+
+def lock_returnable_lines(sale, sale_item_ids):
+    """returnable_lines() for some lines of a sale, locked until commit.
+
+    Call inside transaction.atomic: a concurrent return of the same lines
+    waits here, then sees what this one returned.
+    """
+    # Evaluated first, so the lines are locked before returns are counted
+    items = list(
+        SaleItem.objects.select_for_update(of=("self",))
+        .select_related("product")
+        .filter(sale=sale, id__in=sale_item_ids)
+        .order_by("id")
+    )
+    return _lines(items, returned_quantities(sale))
+
+
+def _lines(items, returned):
+    lines = {}
+    for item in items:
+        already_returned = returned.get(item.id, 0)
+        lines[item.id] = {
+            "item": item,
+            "already_returned": already_returned,
+            "available": item.quantity - already_returned,
+        }
+    return lines
+
+
+def match_sale_items(sale, code):
+    """Lines of a sale whose product SKU or an active barcode equals code."""
+    code = code.upper()
+    items = sale.items.select_related("product").prefetch_related(
+        Prefetch(
+            "product__barcodes",
+            queryset=Barcode.objects.filter(is_active=True),
+            to_attr="active_barcodes",
+        )
+    )
+    return [
+        item
+        for item in items
+        if item.product.sku.upper() == code
+        or any(barcode.barcode.upper() == code for barcode in item.product.active_barcodes)
+    ]
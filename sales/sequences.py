@@ -0,0 +1,56 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import SequenceCounter
+
+
+# Store ids are part of every document number, so they are kept short enough
+# for the longest prefix to fit and free of the "-" separator
+STORE_ID_PATTERN = re.compile(r"[A-Za-z0-9]{1,10}")
+
+
+def check_store_id(store_id):
+    """Raise ValueError unless store_id can go into a document number."""
+    if not STORE_ID_PATTERN.fullmatch(str(store_id)):
+        raise ValueError(
+            f"Invalid store id {store_id!r}: use 1-10 letters or digits"
+        )
+
+
+def reserve(name, store_id=None, day=None):
+    """Advance a per-store, per-day counter by one and return the new value.
+
+    The counter row is created or bumped by a single upsert with RETURNING, so
+    concurrent callers never get the same value.
+    """
+    store_id = str(settings.STORE_ID if store_id is None else store_id)
+    day = day or timezone.localdate()
+
+    quote = connection.ops.quote_name
+    table = quote(SequenceCounter._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} ({quote('name')}, {quote('store_id')}, {quote('day')}, "
+        f"{quote('last_value')}) VALUES (%s, %s, %s, 1) "
+        f"ON CONFLICT ({quote('name')}, {quote('store_id')}, {quote('day')}) "
+        f"DO UPDATE SET {quote('last_value')} = {table}.{quote('last_value')} + 1 "
+        f"RETURNING {quote('last_value')}"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [name, store_id, day])
+        return cursor.fetchone()[0]
+
+
+def format_number(prefix, value, store_id=None, day=None):
+    store_id = str(settings.STORE_ID if store_id is None else store_id)
+    day = day or timezone.localdate()
+    return f"{prefix}-{day.strftime('%Y%m%d')}-{store_id}-{value:04d}"
+
+
+def next_number(prefix):
+    """Next document number, e.g. SALE-20250101-1-0001 for store 1."""
+    day = timezone.localdate()
+    value = reserve(prefix, day=day)
+    return format_number(prefix, value, day=day)
+
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_migrate
+from .models import Sale
+
+
+def seed_cart_totals(sender, using="default", **kwargs):
+    """Fill in the cached cart totals of open sales made before they existed."""
+    sales = (
+        Sale.objects.using(using)
+        .filter(completed_at__isnull=True, cart_items_count=0, items__isnull=False)
+        .distinct()
+    )
+    for sale in sales:
+        sale.refresh_cart_totals()
+
+
+def connect(app_config):
+    post_migrate.connect(
+        seed_cart_totals, sender=app_config, dispatch_uid="seed_cart_totals"
+    )
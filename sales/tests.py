@@ -1,3 +1,409 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from products.models import Barcode, Product, StockMovement
+from users.models import User
+from sync.ingest import ingest_sales
+from .models import Return, ReturnItem, Sale, SaleItem
+from .signals import seed_cart_totals
 
-# Create your tests here.
+
+def run_together(*targets):
+    """Run each target in its own thread (and DB connection) at the same time."""
+    barrier = threading.Barrier(len(targets))
+    errors = []
+
+    def run(target):
+        try:
+            barrier.wait()
+            target()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs a file test database for a second connection")
+
+
+class ConcurrentCheckoutTests(ConcurrentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=50,
+        )
+
+    def open_sale(self, quantity):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        SaleItem.objects.create(
+            sale=sale,
+            product=self.product,
+            quantity=quantity,
+            unit_price=Decimal("20.00"),
+        )
+        return sale
+
+    def test_two_tills_selling_the_same_product(self):
+        first, second = self.open_sale(3), self.open_sale(4)
+
+        errors = run_together(
+            lambda: Sale.objects.get(pk=first.pk).complete_sale(),
+            lambda: Sale.objects.get(pk=second.pk).complete_sale(),
+        )
+        self.assertEqual(errors, [])
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.quantity, 43)
+        self.assertEqual(product.sold_count, 7)
+
+        # Each movement starts where the other one left off
+        movements = StockMovement.objects.filter(
+            product=self.product, movement_type="OUT"
+        ).order_by("id")
+        self.assertEqual(
+            [(m.previous_quantity, m.new_quantity) for m in movements],
+            [(50, 50 - movements[0].quantity), (50 - movements[0].quantity, 43)],
+        )
+
+    def test_same_sale_completed_twice_sells_once(self):
+        sale = self.open_sale(5)
+
+        # Both tills load the sale before either completes it, so only the
+        # lock taken inside complete_sale can stop the second one
+        tills = [Sale.objects.get(pk=sale.pk) for _ in range(2)]
+        errors = run_together(*[till.complete_sale for till in tills])
+        self.assertEqual(errors, [])
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.quantity, 45)
+        self.assertEqual(product.sold_count, 5)
+        self.assertEqual(
+            StockMovement.objects.filter(
+                product=self.product, movement_type="OUT"
+            ).count(),
+            1,
+        )
+        self.assertTrue(all(till.completed_at for till in tills))
+
+
+class ReturnFixture:
+    def setUp(self):
+        super().setUp()
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.products = [
+            Product.objects.create(
+                name=f"Item {i}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+                quantity=50,
+            )
+            for i in range(5)
+        ]
+
+    def completed_sale(self, lines=1, quantity=4):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        for product in self.products[:lines]:
+            SaleItem.objects.create(
+                sale=sale,
+                product=product,
+                quantity=quantity,
+                unit_price=Decimal("20.00"),
+            )
+        sale.complete_sale()
+        return sale
+
+    def till(self, sale, quantity=3):
+        """A logged-in client with a return of quantity per line ready to confirm."""
+        client = Client()
+        client.force_login(self.cashier)
+        session = client.session
+        session["return_data"] = {
+            "sale_id": sale.id,
+            "return_items": [
+                {
+                    "sale_item_id": item.id,
+                    "quantity": quantity,
+                    "return_reason": "FAULTY",
+                    "unit_price": "20.00",
+                    "total_price": str(quantity * 20),
+                }
+                for item in sale.items.order_by("id")
+            ],
+            "total_return_amount": str(quantity * 20 * sale.items.count()),
+        }
+        session.save()
+        return client
+
+    def confirm(self, client):
+        return client.post("/sales/return/confirm/", {"notes": ""})
+
+
+class ReturnConfirmTests(ReturnFixture, TestCase):
+    def test_return_puts_stock_back(self):
+        sale = self.completed_sale()
+        self.assertRedirects(
+            self.confirm(self.till(sale)), "/sales/history/", fetch_redirect_response=False
+        )
+
+        product = Product.objects.get(pk=self.products[0].pk)
+        self.assertEqual((product.quantity, product.sold_count), (49, 4))
+        movement = StockMovement.objects.get(product=product, movement_type="RETURN")
+        self.assertEqual(
+            (movement.quantity, movement.previous_quantity, movement.new_quantity),
+            (3, 46, 49),
+        )
+
+    def test_query_count_does_not_grow_with_lines(self):
+        counts = []
+        for lines in (1, 5):
+            client = self.till(self.completed_sale(lines=lines))
+            with CaptureQueriesContext(connection) as queries:
+                self.confirm(client)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(ReturnItem.objects.count(), 6)
+
+
+class ReturnQueryTests(ReturnFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.barcodes = [
+            Barcode.objects.create(product=product).barcode
+            for product in self.products
+        ]
+        self.client.force_login(self.cashier)
+
+    def queries(self, lines, request):
+        sale = self.completed_sale(lines=lines)
+        # A line already partly returned, as the page has to show
+        self.confirm(self.till(sale, quantity=1))
+        with CaptureQueriesContext(connection) as queries:
+            response = request(sale)
+        self.assertLess(response.status_code, 400)
+        return len(queries)
+
+    def assertSameQueries(self, request):
+        self.assertEqual(
+            self.queries(len(self.products), request), self.queries(1, request)
+        )
+
+    def test_return_page_queries_do_not_grow_with_lines(self):
+        self.assertSameQueries(
+            lambda sale: self.client.get(f"/sales/return/{sale.id}/")
+        )
+
+    def test_return_selection_queries_do_not_grow_with_lines(self):
+        def select_all(sale):
+            data = {}
+            for item in sale.items.all():
+                data[f"confirm_{item.id}"] = "on"
+                data[f"quantity_{item.id}"] = "1"
+            return self.client.post(f"/sales/return/{sale.id}/", data)
+
+        self.assertSameQueries(select_all)
+
+    def test_product_search_queries_do_not_grow_with_lines(self):
+        def search(sale):
+            response = self.client.get(
+                "/sales/return/search-product/",
+                {"sale_id": sale.id, "query": self.barcodes[0]},
+            )
+            self.assertEqual(len(response.json()["products"]), 1)
+            return response
+
+        self.assertSameQueries(search)
+
+
+class ConcurrentReturnTests(ReturnFixture, ConcurrentTestCase):
+    def test_two_tills_returning_the_same_line(self):
+        sale = self.completed_sale()
+        # 3 of the 4 units each, so only one return can fit
+        tills = [self.till(sale), self.till(sale)]
+
+        errors = run_together(*[lambda till=till: self.confirm(till) for till in tills])
+        self.assertEqual(errors, [])
+
+        self.assertEqual(Return.objects.filter(sale=sale).count(), 1)
+        self.assertEqual(ReturnItem.objects.get().quantity, 3)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 49)
+        self.assertEqual(
+            StockMovement.objects.filter(movement_type="RETURN").count(), 1
+        )
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=100,
+        )
+
+    def assertCartMatchesItems(self, sale):
+        sale.refresh_from_db()
+        totals = sale.calculate_cart_totals()
+        self.assertEqual(
+            (sale.cart_subtotal, sale.cart_special_total, sale.cart_items_count),
+            (totals["subtotal"], totals["special_total"], totals["items_count"]),
+        )
+
+    def test_special_price_change_while_in_cart(self):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="SPECIAL")
+        item = SaleItem.objects.create(
+            sale=sale, product=self.product, quantity=2, unit_price=Decimal("20.00")
+        )
+        Product.objects.filter(pk=self.product.pk).update(special_price=Decimal("15.00"))
+
+        item = SaleItem.objects.select_related("product").get(pk=item.pk)
+        item.quantity = 3
+        item.save()
+
+        # 2 units left the cart at 12, 3 came back at 15
+        sale.refresh_from_db()
+        self.assertEqual(sale.cart_total, Decimal("45.00"))
+        self.assertCartMatchesItems(sale)
+
+        item.delete()
+        sale.refresh_from_db()
+        self.assertEqual((sale.cart_total, sale.cart_items_count), (0, 0))
+
+    def test_special_sale_of_product_without_special_price(self):
+        product = Product.objects.create(
+            name="Juice",
+            cost_price=Decimal("5.00"),
+            selling_price=Decimal("9.00"),
+            special_price=Decimal("0.00"),
+        )
+
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="SPECIAL")
+        SaleItem.objects.create(
+            sale=sale, product=product, quantity=2, unit_price=Decimal("9.00")
+        )
+        sale.complete_sale()
+
+        sale.refresh_from_db()
+        self.assertEqual(sale.total_amount, Decimal("18.00"))
+        self.assertEqual(sale.special_amount, Decimal("0.00"))
+
+    def test_special_amount_is_the_special_discount(self):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="SPECIAL")
+        SaleItem.objects.create(
+            sale=sale, product=self.product, quantity=3, unit_price=Decimal("20.00")
+        )
+        sale.complete_sale()
+
+        # 3 x 20 rung up, 3 x 12 charged
+        sale.refresh_from_db()
+        self.assertEqual(sale.total_amount, Decimal("36.00"))
+        self.assertEqual(sale.special_amount, Decimal("24.00"))
+
+    def test_open_sales_are_seeded_after_migrate(self):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        SaleItem.objects.create(
+            sale=sale, product=self.product, quantity=2, unit_price=Decimal("20.00")
+        )
+        # As left by a version that did not cache the totals
+        Sale.objects.filter(pk=sale.pk).update(cart_subtotal=0, cart_items_count=0)
+
+        seed_cart_totals(sender=None)
+
+        sale.refresh_from_db()
+        self.assertEqual((sale.cart_subtotal, sale.cart_items_count), (40, 1))
+
+    def test_pushed_sales_have_cart_totals(self):
+        ingest_sales(
+            [
+                {
+                    "sale_number": "SALE-20260101-7-0001",
+                    "sale_type": "SPECIAL",
+                    "cashier_id": self.cashier.id,
+                    "total_amount": "24.00",
+                    "final_amount": "24.00",
+                    "payment_method": "cash",
+                    "completed_at": "2026-01-01T10:00:00+03:00",
+                    "items": [
+                        {
+                            "product_id": self.product.id,
+                            "quantity": 2,
+                            "unit_price": "20.00",
+                            "total_amount": "24.00",
+                        }
+                    ],
+                }
+            ],
+            batch_size=10,
+            store_id="7",
+        )
+
+        out = StringIO()
+        call_command("check_sale_totals", "--all", stdout=out)
+        self.assertIn("Checked 1 sales, found 0 mismatches", out.getvalue())
+
+
+class CompleteSaleQueryTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.products = Product.objects.bulk_create(
+            Product(
+                name=f"Product {n}",
+                sku=f"SKU{n}",
+                slug=f"product-{n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+                quantity=100,
+            )
+            for n in range(201)
+        )
+
+    def completion_queries(self, products):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        for product in products:
+            SaleItem.objects.create(
+                sale=sale, product=product, quantity=1, unit_price=Decimal("20.00")
+            )
+        sale = Sale.objects.get(pk=sale.pk)
+        with CaptureQueriesContext(connection) as queries:
+            sale.complete_sale()
+        return len(queries)
+
+    def test_queries_do_not_grow_with_lines(self):
+        # Products never sold before, so both sales create their stats rows
+        one_line = self.completion_queries(self.products[:1])
+        many_lines = self.completion_queries(self.products[1:])
+
+        # SQLite splits bulk inserts at its 999 parameter limit: a few
+        # statements more for 200 lines, not one per line
+        self.assertLessEqual(many_lines, one_line + 6)
@@ -7,6 +7,7 @@ app_name = "sales"
 urlpatterns = [
     path("new/", views.new_sale, name="new_sale"),
     path("printer-status/", views.printer_status, name="printer_status"),
+    path("print-job/<int:job_id>/", views.print_job_status, name="print_job_status"),
     path("process/<int:sale_id>/", views.process_sale, name="process_sale"),
     path("reprint/<int:sale_id>/", views.reprint_receipt, name="reprint_receipt"),
     path("test_printer/", views.test_printer_view, name="test_printer"),
@@ -3,31 +3,67 @@ from django.contrib import messages
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from decimal import Decimal
 import logging
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncDate, ExtractHour
+from django.db.models import Sum
 from django.utils import timezone
 from datetime import timedelta
 import json
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Q
 from .models import Sale, SaleItem, Return, ReturnItem
-from products.models import Product, Barcode, StockMovement
+from products.models import Product
+from products.lookup import find_scanned_product
+from reports.models import SalesRollup, ProductSalesRollup
+from reports.rollup import record_return, sales_summary
+from sync.background_sync import request_push
+from sync.outbox import enqueue_return
 from .forms import ReturnStartForm, get_return_formset
+from .returns import returnable_lines, lock_returnable_lines, match_sale_items
 from hardware.printer_client import (
-    print_receipt,
     check_printer_status,
+    build_receipt,
+    get_receipt,
     print_test_receipt,
-    format_receipt_data,
+    test_receipt_data,
 )
+from hardware.print_queue import (
+    enqueue,
+    send,
+    print_spooler,
+    queue_receipt,
+    wait_for_job,
+    job_status,
+)
+from hardware.models import PrintJob
 
 logger = logging.getLogger(__name__)
 
 
+def queue_sale_receipt(sale):
+    """Queue a sale's receipt with the print spooler instead of printing inline.
+
+    Prints inline when the spooler is not running. Returns (success, message,
+    print_job_id); a queued job can be polled through the print_job_status view.
+    """
+    try:
+        return queue_receipt(sale.id)
+    except Exception as e:
+        return False, f"Print error: {str(e)}", None
+
+
+def cart_totals_json(sale):
+    return {
+        "items_count": sale.cart_items_count,
+        "subtotal": str(sale.cart_subtotal),
+        "special_total": str(sale.cart_special_total),
+        "total": str(sale.cart_total),
+    }
+
+
 @login_required
 def new_sale(request):
     if not request.user.can_process_sales():
@@ -48,6 +84,17 @@ def new_sale(request):
     return render(request, "sales/new_sale.html")
 
 
+@login_required
+@require_http_methods(["GET"])
+def print_job_status(request, job_id):
+    if not request.user.can_process_sales():
+        return JsonResponse({"success": False, "error": "Permission denied"})
+
+    job = get_object_or_404(PrintJob.objects.defer("data"), id=job_id)
+
+    return JsonResponse({"success": True, "job": job_status(job)})
+
+
 @login_required
 @require_http_methods(["GET"])
 def printer_status(request):
@@ -96,15 +143,6 @@ def process_sale(request, sale_id):
             return assign_delivery(request, sale)
 
     items = sale.items.select_related("product").all()
-    subtotal = sum(item.quantity * item.unit_price for item in items)
-
-    special_total = Decimal("0")
-    if sale.sale_type == "SPECIAL":
-        special_total = sum(
-            ((item.product.special_price or item.unit_price) - item.unit_price)
-            * item.quantity
-            for item in items
-        )
 
     available_products = Product.objects.filter(
         is_active=True, quantity__gt=0
@@ -113,9 +151,9 @@ def process_sale(request, sale_id):
     context = {
         "sale": sale,
         "items": items,
-        "subtotal": subtotal,
-        "special_total": special_total,
-        "total": subtotal + special_total,
+        "subtotal": sale.cart_subtotal,
+        "special_total": sale.cart_special_total,
+        "total": sale.cart_total,
         "available_products": available_products,
         "is_held": sale.is_held,
     }
@@ -179,27 +217,7 @@ def remove_item_from_sale(request, sale):
         item = sale.items.get(id=item_id)
         item.delete()
 
-        items = sale.items.all()
-        subtotal = sum(item.quantity * item.unit_price for item in items)
-        special_total = Decimal("0")
-        if sale.sale_type == "SPECIAL":
-            special_total = sum(
-                ((item.product.special_price or item.unit_price) - item.unit_price)
-                * item.quantity
-                for item in items
-            )
-
-        return JsonResponse(
-            {
-                "success": True,
-                "totals": {
-                    "items_count": items.count(),
-                    "subtotal": str(subtotal),
-                    "special_total": str(special_total),
-                    "total": str(subtotal + special_total),
-                },
-            }
-        )
+        return JsonResponse({"success": True, "totals": cart_totals_json(sale)})
     except SaleItem.DoesNotExist:
         return JsonResponse({"success": False, "error": "Item not found in sale"})
 
@@ -223,25 +241,11 @@ def update_item_quantity(request, sale):
         item.quantity = quantity
         item.save()
 
-        items = sale.items.all()
-        subtotal = sum(i.quantity * i.unit_price for i in items)
-        special_total = Decimal("0")
-        if sale.sale_type == "SPECIAL":
-            special_total = sum(
-                ((i.product.special_price or i.unit_price) - i.unit_price) * i.quantity
-                for i in items
-            )
-
         return JsonResponse(
             {
                 "success": True,
                 "item_total": str(item.total_amount),
-                "totals": {
-                    "items_count": items.count(),
-                    "subtotal": str(subtotal),
-                    "special_total": str(special_total),
-                    "total": str(subtotal + special_total),
-                },
+                "totals": cart_totals_json(sale),
             }
         )
     except SaleItem.DoesNotExist:
@@ -303,7 +307,7 @@ def complete_sale(request, sale):
             notes=f"Cash payment for Sale #{sale.sale_number}",
         )
 
-        success, message = print_receipt(sale)
+        success, message, print_job_id = queue_sale_receipt(sale)
 
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return JsonResponse(
@@ -312,12 +316,13 @@ def complete_sale(request, sale):
                     "sale_number": sale.sale_number,
                     "print_success": success,
                     "print_message": message,
+                    "print_job_id": print_job_id,
                 }
             )
 
         if success:
             messages.success(
-                request, f"Sale {sale.sale_number} completed and receipt printed!"
+                request, f"Sale {sale.sale_number} completed and receipt sent to printer!"
             )
         else:
             messages.warning(
@@ -331,16 +336,7 @@ def complete_sale(request, sale):
         paybill_confirmed = request.POST.get("paybill_confirmed")
 
         if paybill_confirmed:
-            items = sale.items.all()
-            subtotal = sum(item.quantity * item.unit_price for item in items)
-            special_total = Decimal("0")
-            if sale.sale_type == "SPECIAL":
-                special_total = sum(
-                    ((item.product.special_price or item.unit_price) - item.unit_price)
-                    * item.quantity
-                    for item in items
-                )
-            total_amount = subtotal + special_total
+            total_amount = sale.cart_total
 
             from payments.models import Payment
             import uuid
@@ -359,7 +355,7 @@ def complete_sale(request, sale):
             sale.complete_sale()
             sale.save()
 
-            success, message = print_receipt(sale)
+            success, message, print_job_id = queue_sale_receipt(sale)
 
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                 return JsonResponse(
@@ -368,13 +364,14 @@ def complete_sale(request, sale):
                         "sale_number": sale.sale_number,
                         "print_success": success,
                         "print_message": message,
+                        "print_job_id": print_job_id,
                     }
                 )
             else:
                 if success:
                     messages.success(
                         request,
-                        f"Sale {sale.sale_number} completed and receipt printed!",
+                        f"Sale {sale.sale_number} completed and receipt sent to printer!",
                     )
                 else:
                     messages.warning(
@@ -396,7 +393,7 @@ def complete_sale(request, sale):
                 sale.complete_sale()
                 sale.save()
 
-                success, message = print_receipt(sale)
+                success, message, print_job_id = queue_sale_receipt(sale)
 
                 if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                     return JsonResponse(
@@ -405,13 +402,14 @@ def complete_sale(request, sale):
                             "sale_number": sale.sale_number,
                             "print_success": success,
                             "print_message": message,
+                            "print_job_id": print_job_id,
                         }
                     )
                 else:
                     if success:
                         messages.success(
                             request,
-                            f"Sale {sale.sale_number} completed and receipt printed!",
+                            f"Sale {sale.sale_number} completed and receipt sent to printer!",
                         )
                     else:
                         messages.warning(
@@ -420,7 +418,7 @@ def complete_sale(request, sale):
                         )
                     return redirect("sales:new_sale")
             elif payment and payment.status == "completed" and sale.completed_at:
-                success, message = print_receipt(sale)
+                success, message, print_job_id = queue_sale_receipt(sale)
 
                 if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                     return JsonResponse(
@@ -429,13 +427,14 @@ def complete_sale(request, sale):
                             "sale_number": sale.sale_number,
                             "print_success": success,
                             "print_message": message,
+                            "print_job_id": print_job_id,
                         }
                     )
                 else:
                     if success:
                         messages.success(
                             request,
-                            f"Sale {sale.sale_number} already completed. Receipt printed!",
+                            f"Sale {sale.sale_number} already completed. Receipt sent to printer!",
                         )
                     else:
                         messages.warning(
@@ -448,16 +447,7 @@ def complete_sale(request, sale):
             messages.error(request, "Mobile number is required for M-PESA payment")
             return redirect("sales:process_sale", sale_id=sale.id)
 
-        items = sale.items.all()
-        subtotal = sum(item.quantity * item.unit_price for item in items)
-        special_total = Decimal("0")
-        if sale.sale_type == "SPECIAL":
-            special_total = sum(
-                ((item.product.special_price or item.unit_price) - item.unit_price)
-                * item.quantity
-                for item in items
-            )
-        total_amount = subtotal + special_total
+        total_amount = sale.cart_total
 
         if total_amount <= 0:
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
@@ -565,7 +555,7 @@ def complete_sale(request, sale):
             notes=f"Debt for Sale #{sale.sale_number}. Cashier {request.user.get_full_name()} is responsible for collection.",
         )
 
-        success, message = print_receipt(sale)
+        success, message, print_job_id = queue_sale_receipt(sale)
 
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return JsonResponse(
@@ -574,13 +564,14 @@ def complete_sale(request, sale):
                     "sale_number": sale.sale_number,
                     "print_success": success,
                     "print_message": message,
+                    "print_job_id": print_job_id,
                     "responsibility_message": f"You are responsible for collecting this debt from {customer_first_name}.",
                 }
             )
 
         if success:
             messages.success(
-                request, f"Sale {sale.sale_number} completed and receipt printed!"
+                request, f"Sale {sale.sale_number} completed and receipt sent to printer!"
             )
         else:
             messages.warning(
@@ -615,7 +606,7 @@ def complete_sale(request, sale):
             notes=f"Payment for Sale #{sale.sale_number}",
         )
 
-        success, message = print_receipt(sale)
+        success, message, print_job_id = queue_sale_receipt(sale)
 
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return JsonResponse(
@@ -624,12 +615,13 @@ def complete_sale(request, sale):
                     "sale_number": sale.sale_number,
                     "print_success": success,
                     "print_message": message,
+                    "print_job_id": print_job_id,
                 }
             )
 
         if success:
             messages.success(
-                request, f"Sale {sale.sale_number} completed and receipt printed!"
+                request, f"Sale {sale.sale_number} completed and receipt sent to printer!"
             )
         else:
             messages.warning(
@@ -651,18 +643,7 @@ def scan_barcode(request, sale):
         return JsonResponse({"success": False, "error": "No barcode provided"})
 
     try:
-        product = None
-        product = Product.objects.filter(sku=barcode, is_active=True).first()
-        if not product:
-            barcode_obj = (
-                Barcode.objects.filter(barcode=barcode, is_active=True)
-                .select_related("product")
-                .first()
-            )
-            if barcode_obj:
-                product = barcode_obj.product
-                if not product.is_active:
-                    raise Product.DoesNotExist
+        product = find_scanned_product(barcode)
 
         if not product:
             raise Product.DoesNotExist
@@ -682,7 +663,7 @@ def scan_barcode(request, sale):
         else:
             unit_price = product.selling_price
 
-        existing_item = sale.items.filter(product=product).first()
+        existing_item = sale.items.filter(product_id=product.id).first()
         if existing_item:
             existing_item.quantity += 1
             existing_item.save()
@@ -691,23 +672,13 @@ def scan_barcode(request, sale):
         else:
             new_item = SaleItem.objects.create(
                 sale=sale,
-                product=product,
+                product_id=product.id,
                 quantity=1,
                 unit_price=unit_price,
             )
             quantity = 1
             item_id = new_item.id
 
-        items = sale.items.all()
-        subtotal = sum(item.quantity * item.unit_price for item in items)
-        special_total = Decimal("0")
-        if sale.sale_type == "SPECIAL":
-            special_total = sum(
-                ((item.product.special_price or item.unit_price) - item.unit_price)
-                * item.quantity
-                for item in items
-            )
-
         total_price = quantity * unit_price
         if sale.sale_type == "SPECIAL" and product.special_price:
             total_price = quantity * product.special_price
@@ -723,12 +694,7 @@ def scan_barcode(request, sale):
                     "quantity": quantity,
                     "total": str(total_price),
                 },
-                "totals": {
-                    "items_count": items.count(),
-                    "subtotal": str(subtotal),
-                    "special_total": str(special_total),
-                    "total": str(subtotal + special_total),
-                },
+                "totals": cart_totals_json(sale),
             }
         )
 
@@ -746,17 +712,26 @@ def reprint_receipt(request, sale_id):
             {"success": False, "error": "You do not have permission to print receipts."}
         )
 
-    sale = get_object_or_404(Sale, id=sale_id, completed_at__isnull=False)
+    receipt = get_receipt(sale_id)
+    if receipt is None:
+        raise Http404("Sale not found")
 
-    success, message = print_receipt(sale)
+    try:
+        success, message, print_job_id = send(receipt[1], sale_id=sale_id)
+    except Exception as e:
+        return JsonResponse({"success": False, "error": f"Print failed: {str(e)}"})
 
-    if success:
-        return JsonResponse(
-            {"success": True, "message": "Receipt reprinted successfully"}
-        )
-    else:
+    if not success:
         return JsonResponse({"success": False, "error": f"Print failed: {message}"})
 
+    return JsonResponse(
+        {
+            "success": True,
+            "message": message,
+            "print_job_id": print_job_id,
+        }
+    )
+
 
 @login_required
 @require_http_methods(["GET"])
@@ -766,11 +741,26 @@ def test_printer_view(request):
             {"success": False, "error": "You do not have permission to test printer."}
         )
 
-    success, message = print_test_receipt()
+    if not print_spooler.running:
+        success, message = print_test_receipt()
+        if success:
+            return JsonResponse({"success": True, "message": message})
+        return JsonResponse({"success": False, "error": f"Test print failed: {message}"})
+
+    try:
+        job = enqueue(build_receipt(test_receipt_data()), kind="test")
+    except Exception as e:
+        return JsonResponse({"success": False, "error": f"Test print failed: {e}"})
 
-    if success:
-        return JsonResponse({"success": True, "message": message})
+    job = wait_for_job(job)
+    if job.status == "done":
+        return JsonResponse(
+            {"success": True, "message": "Test receipt printed successfully"}
+        )
     else:
+        # Don't let a failed test page come out of the printer later on
+        PrintJob.objects.filter(pk=job.pk, status="pending").update(status="failed")
+        message = job.last_error or "Printer did not respond"
         return JsonResponse(
             {"success": False, "error": f"Test print failed: {message}"}
         )
@@ -848,17 +838,7 @@ def assign_delivery(request, sale):
                 }
             )
 
-        # Calculate total amount
-        items = sale.items.all()
-        subtotal = sum(item.quantity * item.unit_price for item in items)
-        special_total = Decimal("0")
-        if sale.sale_type == "SPECIAL":
-            special_total = sum(
-                ((item.product.special_price or item.unit_price) - item.unit_price)
-                * item.quantity
-                for item in items
-            )
-        total_amount = subtotal + special_total
+        total_amount = sale.cart_total
 
         # Create delivery
         delivery = Delivery.objects.create(
@@ -891,7 +871,7 @@ def assign_delivery(request, sale):
         )
 
         # Print receipt
-        success, message = print_receipt(sale)
+        success, message, print_job_id = queue_sale_receipt(sale)
 
         return JsonResponse(
             {
@@ -900,6 +880,7 @@ def assign_delivery(request, sale):
                 "delivery_number": delivery.delivery_number,
                 "print_success": success,
                 "print_message": message,
+                "print_job_id": print_job_id,
                 "message": f"Delivery assigned to {delivery_guy.get_full_name()}",
             }
         )
@@ -998,56 +979,46 @@ def sale_detail(request, sale_id):
 
 
 def public_receipt(request, sale_id):
-    sale = get_object_or_404(Sale, id=sale_id, completed_at__isnull=False)
-    receipt_data = format_receipt_data(sale)
+    receipt = get_receipt(sale_id)
+    if receipt is None:
+        raise Http404("Receipt not found")
+
     context = {
-        "receipt_data": receipt_data,
-        "sale_id": sale.id,
+        "receipt_data": receipt[0],
+        "sale_id": sale_id,
     }
     return render(request, "sales/receipt.html", context)
 
 
 def sale_analytics(request):
-    today = timezone.now().date()
+    today = timezone.localdate()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
 
-    completed_sales = Sale.objects.filter(completed_at__isnull=False)
-
-    today_sales = completed_sales.filter(completed_at__date=today).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
-
-    week_sales = completed_sales.filter(completed_at__date__gte=week_ago).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
+    rollups = SalesRollup.objects.filter(sale_count__gt=0)
 
-    month_sales = completed_sales.filter(completed_at__date__gte=month_ago).aggregate(
-        total=Sum("final_amount"), count=Count("id")
-    )
-
-    total_sales = completed_sales.aggregate(
-        total=Sum("final_amount"), count=Count("id"), avg=Avg("final_amount")
-    )
+    today_sales = sales_summary(rollups.filter(date=today))
+    week_sales = sales_summary(rollups.filter(date__gte=week_ago))
+    month_sales = sales_summary(rollups.filter(date__gte=month_ago))
+    total_sales = sales_summary(rollups)
 
     sales_by_type = (
-        completed_sales.values("sale_type")
-        .annotate(total=Sum("final_amount"), count=Count("id"))
+        rollups.values("sale_type")
+        .annotate(total=Sum("revenue"), count=Sum("sale_count"))
         .order_by("-total")
     )
 
     daily_sales = (
-        completed_sales.filter(completed_at__date__gte=week_ago)
-        .annotate(day=TruncDate("completed_at"))
-        .values("day")
-        .annotate(total=Sum("final_amount"), count=Count("id"))
+        rollups.filter(date__gte=week_ago)
+        .values(day=models.F("date"))
+        .annotate(total=Sum("revenue"), count=Sum("sale_count"))
         .order_by("day")
     )
 
     top_products = (
-        SaleItem.objects.filter(sale__completed_at__isnull=False)
+        ProductSalesRollup.objects.filter(quantity__gt=0)
         .values("product__name", "product__sold_count")
-        .annotate(quantity=Sum("quantity"), revenue=Sum("total_amount"))
+        .annotate(quantity=Sum("quantity"), revenue=Sum("revenue"))
         .order_by("-quantity")[:10]
     )
 
@@ -1091,22 +1062,28 @@ def sale_report(request):
     cashier = request.GET.get("cashier")
 
     completed_sales = Sale.objects.filter(completed_at__isnull=False)
+    rollups = SalesRollup.objects.all()
 
     if start_date:
         completed_sales = completed_sales.filter(completed_at__date__gte=start_date)
+        rollups = rollups.filter(date__gte=start_date)
     if end_date:
         completed_sales = completed_sales.filter(completed_at__date__lte=end_date)
+        rollups = rollups.filter(date__lte=end_date)
     if sale_type:
         completed_sales = completed_sales.filter(sale_type=sale_type)
+        rollups = rollups.filter(sale_type=sale_type)
     if cashier:
         completed_sales = completed_sales.filter(cashier_id=cashier)
-
-    summary = completed_sales.aggregate(
-        total_sales=Sum("final_amount"),
-        total_count=Count("id"),
-        avg_sale=Avg("final_amount"),
-        total_discount=Sum("discount_amount"),
-    )
+        rollups = rollups.filter(cashier_id=cashier)
+
+    totals = sales_summary(rollups)
+    summary = {
+        "total_sales": totals["total"],
+        "total_count": totals["count"],
+        "avg_sale": totals["avg"],
+        "total_discount": totals["discount"],
+    }
 
     sales_list = completed_sales.select_related("cashier").prefetch_related("items")
 
@@ -1141,31 +1118,27 @@ def sale_report(request):
 
 
 def sale_trend(request):
-    today = timezone.now().date()
+    today = timezone.localdate()
     days_back = int(request.GET.get("days", 30))
     start_date = today - timedelta(days=days_back)
 
-    completed_sales = Sale.objects.filter(
-        completed_at__isnull=False, completed_at__date__gte=start_date
-    )
+    rollups = SalesRollup.objects.filter(sale_count__gt=0, date__gte=start_date)
 
     daily_trend = (
-        completed_sales.annotate(day=TruncDate("completed_at"))
-        .values("day")
-        .annotate(total=Sum("final_amount"), count=Count("id"))
+        rollups.values(day=models.F("date"))
+        .annotate(total=Sum("revenue"), count=Sum("sale_count"))
         .order_by("day")
     )
 
     hourly_trend = (
-        completed_sales.annotate(hour=ExtractHour("completed_at"))
-        .values("hour")
-        .annotate(total=Sum("final_amount"), count=Count("id"))
+        rollups.values("hour")
+        .annotate(total=Sum("revenue"), count=Sum("sale_count"))
         .order_by("hour")
     )
 
     type_trend = (
-        completed_sales.values("sale_type")
-        .annotate(total=Sum("final_amount"), count=Count("id"))
+        rollups.values("sale_type")
+        .annotate(total=Sum("revenue"), count=Sum("sale_count"))
         .order_by("-total")
     )
 
@@ -1232,20 +1205,7 @@ def return_process(request, sale_id):
         raise PermissionDenied("You do not have permission to process returns.")
 
     sale = get_object_or_404(Sale, id=sale_id, completed_at__isnull=False)
-    sale_items = sale.items.select_related("product").all()
-
-    sale_items_with_returns = []
-    for item in sale_items:
-        already_returned = (
-            ReturnItem.objects.filter(sale_item=item).aggregate(total=Sum("quantity"))[
-                "total"
-            ]
-            or 0
-        )
-        available = item.quantity - already_returned
-        sale_items_with_returns.append(
-            {"item": item, "already_returned": already_returned, "available": available}
-        )
+    lines = returnable_lines(sale)
 
     if request.method == "POST":
         return_data = []
@@ -1260,40 +1220,34 @@ def return_process(request, sale_id):
                 quantity = int(request.POST.get(quantity_key, 1))
                 reason = request.POST.get(reason_key, "FAULTY")
 
-                try:
-                    sale_item = SaleItem.objects.get(id=sale_item_id, sale=sale)
-                    already_returned = (
-                        ReturnItem.objects.filter(sale_item=sale_item).aggregate(
-                            total=Sum("quantity")
-                        )["total"]
-                        or 0
-                    )
-                    available = sale_item.quantity - already_returned
-
-                    if quantity > available:
-                        messages.error(
-                            request,
-                            f"Cannot return more than {available} units of {sale_item.product.name} (already returned: {already_returned})",
-                        )
-                        break
-
-                    if quantity > 0:
-                        has_items = True
-                        unit_price = sale_item.unit_price
-
-                        return_data.append(
-                            {
-                                "sale_item_id": sale_item.id,
-                                "quantity": quantity,
-                                "return_reason": reason,
-                                "unit_price": str(unit_price),
-                                "total_price": str(quantity * unit_price),
-                            }
-                        )
-                        total_return_amount += quantity * unit_price
-                except SaleItem.DoesNotExist:
+                line = lines.get(int(sale_item_id)) if sale_item_id.isdigit() else None
+                if not line:
                     messages.error(request, "Invalid item selected")
                     break
+
+                sale_item = line["item"]
+                available = line["available"]
+                if quantity > available:
+                    messages.error(
+                        request,
+                        f"Cannot return more than {available} units of {sale_item.product.name} (already returned: {line['already_returned']})",
+                    )
+                    break
+
+                if quantity > 0:
+                    has_items = True
+                    unit_price = sale_item.unit_price
+
+                    return_data.append(
+                        {
+                            "sale_item_id": sale_item.id,
+                            "quantity": quantity,
+                            "return_reason": reason,
+                            "unit_price": str(unit_price),
+                            "total_price": str(quantity * unit_price),
+                        }
+                    )
+                    total_return_amount += quantity * unit_price
         else:
             if not has_items:
                 messages.error(request, "Please select at least one item to return.")
@@ -1322,7 +1276,7 @@ def return_process(request, sale_id):
                 "available": sid["available"],
                 "unit_price": str(sid["item"].unit_price),
             }
-            for sid in sale_items_with_returns
+            for sid in lines.values()
         ]
     )
 
@@ -1349,38 +1303,60 @@ def return_confirm(request):
     sale = get_object_or_404(Sale, id=return_data["sale_id"])
 
     if request.method == "POST":
-        return_obj = Return.objects.create(
-            sale=sale,
-            cashier=request.user,
-            total_return_amount=Decimal(return_data["total_return_amount"]),
-            notes=request.POST.get("notes", ""),
-        )
+        items_data = return_data["return_items"]
 
-        for item_data in return_data["return_items"]:
-            sale_item = SaleItem.objects.get(id=item_data["sale_item_id"])
-            ReturnItem.objects.create(
-                return_fk=return_obj,
-                sale_item=sale_item,
-                quantity=item_data["quantity"],
-                return_reason=item_data["return_reason"],
-                unit_price=Decimal(item_data["unit_price"]),
-                total_price=Decimal(item_data["total_price"]),
+        # Stock, movements, rollups and the outbox entry are saved together
+        with transaction.atomic():
+            lines = lock_returnable_lines(
+                sale, [item_data["sale_item_id"] for item_data in items_data]
             )
+            for item_data in items_data:
+                line = lines.get(item_data["sale_item_id"])
+                if not line or item_data["quantity"] > line["available"]:
+                    messages.error(
+                        request,
+                        "Some items were returned by someone else in the meantime. Please check the quantities again.",
+                    )
+                    return redirect("sales:return_process", sale_id=sale.id)
 
-            product = sale_item.product
-            previous_quantity = product.quantity
-            product.quantity += item_data["quantity"]
-            product.save()
+            return_obj = Return.objects.create(
+                sale=sale,
+                cashier=request.user,
+                total_return_amount=Decimal(return_data["total_return_amount"]),
+                notes=request.POST.get("notes", ""),
+            )
 
-            StockMovement.objects.create(
-                product=product,
-                movement_type="RETURN",
-                quantity=item_data["quantity"],
-                previous_quantity=previous_quantity,
-                new_quantity=product.quantity,
-                notes=f"Return #{return_obj.return_number} - {item_data['return_reason']}",
+            ReturnItem.objects.bulk_create(
+                [
+                    ReturnItem(
+                        return_fk=return_obj,
+                        sale_item_id=item_data["sale_item_id"],
+                        quantity=item_data["quantity"],
+                        return_reason=item_data["return_reason"],
+                        unit_price=Decimal(item_data["unit_price"]),
+                        total_price=item_data["quantity"]
+                        * Decimal(item_data["unit_price"]),
+                    )
+                    for item_data in items_data
+                ]
             )
 
+            Product.move_stock(
+                [
+                    (
+                        lines[item_data["sale_item_id"]]["item"].product_id,
+                        item_data["quantity"],
+                        f"Return #{return_obj.return_number} - {item_data['return_reason']}",
+                    )
+                    for item_data in items_data
+                ],
+                "RETURN",
+            )
+
+            record_return(return_obj)
+            enqueue_return(return_obj)
+            transaction.on_commit(request_push)
+
         del request.session["return_data"]
 
         messages.success(
@@ -1388,11 +1364,12 @@ def return_confirm(request):
         )
         return redirect("sales:history")
 
+    sale_items = SaleItem.objects.select_related("product").in_bulk(
+        [item_data["sale_item_id"] for item_data in return_data["return_items"]]
+    )
     return_items = []
     for item_data in return_data["return_items"]:
-        sale_item = SaleItem.objects.select_related("product").get(
-            id=item_data["sale_item_id"]
-        )
+        sale_item = sale_items[item_data["sale_item_id"]]
         return_items.append(
             {
                 "product": sale_item.product,
@@ -1549,23 +1526,16 @@ def search_sale_product(request):
 
     try:
         sale = Sale.objects.get(id=sale_id, completed_at__isnull=False)
-        sale_items = sale.items.select_related("product").all()
-
-        matching_items = []
-        for item in sale_items:
-            product = item.product
-            if product.sku.upper() == query.upper() or any(
-                barcode.barcode.upper() == query.upper()
-                for barcode in product.barcodes.filter(is_active=True)
-            ):
-                matching_items.append(
-                    {
-                        "sale_item_id": item.id,
-                        "name": product.name,
-                        "sold_quantity": item.quantity,
-                        "unit_price": str(item.unit_price),
-                    }
-                )
+
+        matching_items = [
+            {
+                "sale_item_id": item.id,
+                "name": item.product.name,
+                "sold_quantity": item.quantity,
+                "unit_price": str(item.unit_price),
+            }
+            for item in match_sale_items(sale, query)
+        ]
 
         return JsonResponse({"success": True, "products": matching_items})
 
@@ -474,11 +474,12 @@ function submitSaleCompletion() {
         const statusEl = document.getElementById("printerStatus");
         const messageEl = document.getElementById("printerMessage");
 
-        statusEl.textContent = "Receipt Printed Successfully!";
-        statusEl.style.color = "#27ae60";
+        statusEl.textContent = "Printing Receipt...";
+        statusEl.style.color = "#f39c12";
         messageEl.textContent = `Sale ${data.sale_number} completed successfully`;
 
         document.querySelector(".printer-icon-large").style.animation = "none";
+        watchPrintJob(data.print_job_id, data.print_success);
 
         setTimeout(() => {
           isModalActive = false;
@@ -828,6 +829,46 @@ function pollPaymentStatus(transactionReference) {
   poll();
 }
 
+function watchPrintJob(jobId, printed) {
+  const statusEl = document.getElementById("printerStatus");
+
+  // No job to watch when the receipt was printed (or failed) right away
+  if (!jobId) {
+    if (printed) {
+      statusEl.textContent = "Receipt Printed Successfully!";
+      statusEl.style.color = "#27ae60";
+    } else {
+      statusEl.textContent = "Sale Completed - Printing Failed";
+    }
+    return;
+  }
+
+  const poll = (remaining) => {
+    fetch(`/sales/print-job/${jobId}/`)
+      .then((response) => response.json())
+      .then((data) => {
+        if (!data.success) {
+          return;
+        }
+
+        if (data.job.status === "done") {
+          statusEl.textContent = "Receipt Printed Successfully!";
+          statusEl.style.color = "#27ae60";
+        } else if (data.job.status === "failed" || data.job.attempts > 0) {
+          statusEl.textContent = "Sale Completed - Printing Failed";
+          statusEl.style.color = "#f39c12";
+        } else if (remaining > 0) {
+          setTimeout(() => poll(remaining - 1), 500);
+        }
+      })
+      .catch((error) => {
+        console.error("Error checking print job:", error);
+      });
+  };
+
+  poll(5);
+}
+
 function retryPayment() {
   document.getElementById("paymentActions").classList.remove("visible");
   document.querySelector(".payment-icon-large").style.animation = "";
@@ -861,11 +902,12 @@ function completeSaleAfterPayment(transactionReference) {
       const messageEl = document.getElementById("printerMessage");
 
       if (data.success) {
-        statusEl.textContent = "Receipt Printed Successfully!";
-        statusEl.style.color = "#27ae60";
+        statusEl.textContent = "Printing Receipt...";
+        statusEl.style.color = "#f39c12";
         messageEl.textContent = `Sale ${data.sale_number} completed successfully`;
 
         document.querySelector(".printer-icon-large").style.animation = "none";
+        watchPrintJob(data.print_job_id, data.print_success);
         setTimeout(() => {
           isModalActive = false;
           window.location.href = "/sales/new/";
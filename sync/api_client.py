@@ -1,12 +1,51 @@
+import gzip
+import json
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 
 
+POOL_SIZE = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """One pooled, keep-alive HTTP session shared by every ServerAPI."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Accept-Encoding"] = "gzip"
+            _session = session
+        return _session
+
+
 class ServerAPI:
     def __init__(self):
         self.base_url = settings.SERVER_API_URL
         self.api_token = settings.SERVER_API_TOKEN
         self.store_id = settings.STORE_ID
+        self._install_key = None
+        self.session = get_session()
+
+        # Whether the last request reached the server, so a sync cycle can
+        # use its first real call as the health check
+        self.reachable = None
+        self._etags = {}
+
+    @property
+    def install_key(self):
+        if self._install_key is None:
+            from .models import Terminal
+
+            self._install_key = Terminal.local().install_key
+        return self._install_key
 
     def get_headers(self):
         return {
@@ -14,99 +53,147 @@ class ServerAPI:
             "Content-Type": "application/json",
         }
 
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(
+                method, f"{self.base_url}{path}", headers=kwargs.pop("headers"), **kwargs
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.reachable = False
+            raise
+        self.reachable = True
+        return response
+
+    def _get(self, path, params, timeout=30):
+        """GET JSON, revalidating the last response for the same params by ETag."""
+        headers = self.get_headers()
+        cached = self._etags.get(path)
+        if cached and cached[0] == params:
+            headers["If-None-Match"] = cached[1]
+
+        response = self._request(
+            "get", path, params=params, headers=headers, timeout=timeout
+        )
+        if response.status_code == 304 and cached:
+            return cached[2]
+
+        response.raise_for_status()
+        data = response.json()
+        if response.headers.get("ETag"):
+            self._etags[path] = (params, response.headers["ETag"], data)
+        return data
+
+    def _post(self, path, payload, timeout=30):
+        """POST JSON with a gzip-compressed body."""
+        headers = self.get_headers()
+        headers["Content-Encoding"] = "gzip"
+        body = gzip.compress(json.dumps(payload).encode("utf-8"))
+
+        response = self._request(
+            "post", path, data=body, headers=headers, timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
     def test_connection(self):
         try:
-            response = requests.get(
-                f"{self.base_url}/api/sync/health/",
-                headers=self.get_headers(),
-                timeout=5,
+            response = self._request(
+                "get", "/api/sync/health/", headers=self.get_headers(), timeout=5
             )
             return response.status_code == 200
         except:
             return False
 
-    def initial_sync(self):
+    def _stream(self, path, params):
+        """Yield the NDJSON messages of a streamed GET as they arrive.
+
+        Network errors are raised to the caller, which keeps whatever it has
+        already committed and resumes from there next time.
+        """
+        with self._request(
+            "get",
+            path,
+            params={**params, "store_id": self.store_id},
+            headers=self.get_headers(),
+            stream=True,
+            timeout=(10, 120),
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def initial_sync_stream(self, stage=0, after=0):
+        return self._stream(
+            "/api/sync/initial_sync_stream/", {"stage": stage, "after": after}
+        )
+
+    def pull_changes(self, cursor, limit=500):
         try:
-            response = requests.post(
-                f"{self.base_url}/api/sync/initial_sync/",
-                json={"store_id": self.store_id},
-                headers=self.get_headers(),
-                timeout=60,
+            return self._get(
+                "/api/sync/pull_changes/",
+                {"cursor": cursor, "limit": limit, "store_id": self.store_id},
             )
-            response.raise_for_status()
-            return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Initial sync error: {e}")
+            print(f"Pull changes error: {e}")
             return None
 
-    def pull_updates(self, last_sync):
+    def register_terminal(self):
+        """Claim this terminal's STORE_ID on the server.
+
+        Returns True once registered, False if the server refuses the id and
+        None if it could not be asked.
+        """
         try:
-            response = requests.get(
-                f"{self.base_url}/api/sync/pull_updates/",
-                params={"since": last_sync, "store_id": self.store_id},
-                headers=self.get_headers(),
-                timeout=30,
+            self._post(
+                "/api/sync/register_terminal/",
+                {"store_id": self.store_id, "install_key": self.install_key},
             )
-            response.raise_for_status()
-            return response.json()
+            return True
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code in (400, 409):
+                print(f"Terminal registration refused: {e.response.text}")
+                return False
+            print(f"Register terminal error: {e}")
+            return None
         except requests.exceptions.RequestException as e:
-            print(f"Pull error: {e}")
+            print(f"Register terminal error: {e}")
             return None
 
     def push_sales(self, sales_data):
         try:
-            response = requests.post(
-                f"{self.base_url}/api/sync/push_sales/",
-                json={"store_id": self.store_id, "sales": sales_data},
-                headers=self.get_headers(),
-                timeout=30,
+            return self._post(
+                "/api/sync/push_sales/",
+                {
+                    "store_id": self.store_id,
+                    "install_key": self.install_key,
+                    "sales": sales_data,
+                },
             )
-            response.raise_for_status()
-            return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Push sales error: {e}")
             return None
 
     def push_returns(self, returns_data):
         try:
-            response = requests.post(
-                f"{self.base_url}/api/sync/push_returns/",
-                json={"store_id": self.store_id, "returns": returns_data},
-                headers=self.get_headers(),
-                timeout=30,
+            return self._post(
+                "/api/sync/push_returns/",
+                {
+                    "store_id": self.store_id,
+                    "install_key": self.install_key,
+                    "returns": returns_data,
+                },
             )
-            response.raise_for_status()
-            return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Push returns error: {e}")
             return None
 
-    def pull_sales(self, since):
-        """Pull sales from server (from other terminals)"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/sync/pull_sales/",
-                params={"since": since, "store_id": self.store_id},
-                headers=self.get_headers(),
-                timeout=30,
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Pull sales error: {e}")
-            return None
+    def pull_sales(self, after=None, since=None):
+        """Stream sales from other stores, after a cursor or since a time"""
+        return self._stream("/api/sync/pull_sales/", {"after": after, "since": since})
 
-    def pull_returns(self, since):
-        """Pull returns from server (from other terminals)"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/sync/pull_returns/",
-                params={"since": since, "store_id": self.store_id},
-                headers=self.get_headers(),
-                timeout=30,
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Pull returns error: {e}")
-            return None
+    def pull_returns(self, after=None, since=None):
+        """Stream returns from other stores, after a cursor or since a time"""
+        return self._stream(
+            "/api/sync/pull_returns/", {"after": after, "since": since}
+        )
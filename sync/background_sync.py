@@ -1,17 +1,31 @@
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
 from django.utils import timezone
 from django.conf import settings
 from .sync_manager import SyncManager
 
 
+BUSY_INTERVAL = 15
+RETRY_BASE_DELAY = 15
+RETRY_MAX_DELAY = 15 * 60
+
+
 class BackgroundSync:
-    def __init__(self, interval=30):
+    def __init__(self, interval=30, debounce=3):
         self.interval = interval
+        self.debounce = debounce
         self.running = False
         self.thread = None
         self.sync_manager = None
+        self.pull_manager = None
         self.initial_sync_done = False
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.push_requested = False
+        self.executor = None
+        self.failures = 0
 
     def start(self):
         """Start the background sync service"""
@@ -27,9 +41,22 @@ class BackgroundSync:
             print("Background sync already running")
             return
 
+        from sales.sequences import check_store_id
+
+        try:
+            check_store_id(settings.STORE_ID)
+        except ValueError as e:
+            print(f"Sync disabled: {e}")
+            return
+
         print(f"Starting background sync service (interval: {self.interval}s)...")
         self.running = True
+        self.stopping.clear()
         self.sync_manager = SyncManager()
+        # The pull chain runs in its own thread with its own client, so the
+        # chains never share reachability, ETags or registration state
+        self.pull_manager = SyncManager()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sync")
         self.thread = threading.Thread(target=self._sync_loop, daemon=True)
         self.thread.start()
         print("Background sync service started")
@@ -37,9 +64,13 @@ class BackgroundSync:
     def stop(self):
         """Stop the background sync service"""
         self.running = False
+        self.stopping.set()
+        self.wakeup.set()
         if self.thread and self.thread.is_alive():
             print("Stopping background sync...")
             self.thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=False)
         print("Background sync stopped")
 
     def sync_now(self):
@@ -58,6 +89,81 @@ class BackgroundSync:
                 return False
         return False
 
+    def run_cycle(self):
+        """Run the push chain and the pull chain side by side.
+
+        Stages inside a chain keep their order: returns reference sales, and
+        pulled sales reference pulled products. Returns (reachable, failed);
+        the server counts as unreachable if either chain could not reach it.
+        """
+        chains = [
+            (self.sync_manager, self.push_chain()),
+            (self.pull_manager, self.pull_chain()),
+        ]
+        futures = [
+            self.executor.submit(self._run_chain, manager, chain)
+            for manager, chain in chains
+        ]
+
+        reachable = True
+        failed = []
+        for future in futures:
+            chain_reachable, chain_failed = future.result()
+            reachable = reachable and chain_reachable
+            failed.extend(chain_failed)
+        return reachable, failed
+
+    def push_chain(self):
+        return [
+            ("push sales", self.sync_manager.push_sales_to_server),
+            ("push returns", self.sync_manager.push_returns_to_server),
+        ]
+
+    def pull_chain(self):
+        return [
+            ("pull updates", self.pull_manager.pull_from_server),
+            ("pull sales", self.pull_manager.pull_sales_from_server),
+            ("pull returns", self.pull_manager.pull_returns_from_server),
+        ]
+
+    def _run_chain(self, manager, chain):
+        """Run stages in order; returns (reachable, failed) for this chain."""
+        manager.api.reachable = None
+        failed = []
+        try:
+            for name, stage in chain:
+                if not stage():
+                    # The first request of the chain doubles as the health check
+                    if manager.api.reachable is False:
+                        break
+                    failed.append(name)
+                    print(
+                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to {name}"
+                    )
+        finally:
+            close_old_connections()
+        return manager.api.reachable is not False, failed
+
+    def has_pending(self):
+        from .models import Outbox
+
+        return Outbox.objects.exists()
+
+    def next_delay(self, reachable):
+        """Seconds until the next cycle.
+
+        Backs off exponentially while the server is unreachable and comes
+        back sooner while there is still unsynced work.
+        """
+        if not reachable:
+            self.failures += 1
+            return min(RETRY_BASE_DELAY * 2 ** (self.failures - 1), RETRY_MAX_DELAY)
+
+        self.failures = 0
+        if self.has_pending():
+            return min(self.interval, BUSY_INTERVAL)
+        return self.interval
+
     def _sync_loop(self):
         """Main sync loop running in background thread"""
         import django
@@ -69,99 +175,120 @@ class BackgroundSync:
 
         print(f"[{timezone.now().strftime('%H:%M:%S')}] Background sync loop started")
 
-        time.sleep(5)
+        try:
+            from .outbox import backfill
+
+            backfill()
+        except Exception as e:
+            print(f"Outbox backfill error: {e}")
+
+        try:
+            self.sync_manager.register_terminal()
+        except Exception as e:
+            print(f"Terminal registration error: {e}")
+
+        next_cycle = time.monotonic() + 5
 
         while self.running:
-            try:
-                if not self.initial_sync_done:
-                    from .models import SyncLog
+            self.wakeup.wait(max(next_cycle - time.monotonic(), 0))
+            self.wakeup.clear()
+            if not self.running:
+                break
+
+            if time.monotonic() < next_cycle:
+                # Woken early by a completed sale or return
+                if self.push_requested and self.initial_sync_done and not self.failures:
+                    # Let a burst of checkouts collect into one small batch
+                    self.stopping.wait(self.debounce)
+                    self.push_requested = False
+                    self.push_pending()
+                continue
 
-                    if not SyncLog.objects.filter(
-                        sync_type="initial", status="success"
-                    ).exists():
+            self.push_requested = False
+            next_cycle = time.monotonic() + self.scheduled_sync()
+
+        print(f"[{timezone.now().strftime('%H:%M:%S')}] Background sync loop ended")
+
+    def scheduled_sync(self):
+        """Run the full periodic cycle; returns seconds until the next one."""
+        try:
+            if not self.initial_sync_done:
+                from .models import SyncLog
+
+                if not SyncLog.objects.filter(
+                    sync_type="initial", status="success"
+                ).exists():
+                    print(
+                        f"[{timezone.now().strftime('%H:%M:%S')}] Running initial sync..."
+                    )
+                    if self.sync_manager.initial_setup():
+                        self.initial_sync_done = True
                         print(
-                            f"[{timezone.now().strftime('%H:%M:%S')}] Running initial sync..."
+                            f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync completed"
                         )
-                        if self.sync_manager.initial_setup():
-                            self.initial_sync_done = True
-                            print(
-                                f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync completed"
-                            )
-                        else:
-                            print(
-                                f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync failed, will retry"
-                            )
-                            time.sleep(self.interval)
-                            continue
                     else:
-                        self.initial_sync_done = True
                         print(
-                            f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync already completed"
+                            f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync failed, will retry"
                         )
-
-                if not self.sync_manager.api.test_connection():
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] Server unreachable, working offline"
-                    )
-                    time.sleep(self.interval)
-                    continue
-
-                print(
-                    f"[{timezone.now().strftime('%H:%M:%S')}] Running scheduled sync..."
-                )
-
-                push_success = True
-                if not self.sync_manager.push_sales_to_server():
-                    push_success = False
+                        return self.next_delay(False)
+                else:
+                    self.initial_sync_done = True
                     print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to push sales"
+                        f"[{timezone.now().strftime('%H:%M:%S')}] Initial sync already completed"
                     )
 
-                if not self.sync_manager.push_returns_to_server():
-                    push_success = False
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to push returns"
-                    )
+            print(f"[{timezone.now().strftime('%H:%M:%S')}] Running scheduled sync...")
 
-                pull_success = True
-                if not self.sync_manager.pull_from_server():
-                    pull_success = False
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to pull updates"
-                    )
+            reachable, failed = self.run_cycle()
 
-                if not self.sync_manager.pull_sales_from_server():
-                    pull_success = False
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to pull sales"
-                    )
+            if not reachable:
+                print(
+                    f"[{timezone.now().strftime('%H:%M:%S')}] Server unreachable, working offline"
+                )
+            elif not failed:
+                print(
+                    f"[{timezone.now().strftime('%H:%M:%S')}] ✓ Sync completed successfully"
+                )
+            else:
+                print(
+                    f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Sync completed with errors"
+                )
 
-                if not self.sync_manager.pull_returns_from_server():
-                    pull_success = False
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Failed to pull returns"
-                    )
+            return self.next_delay(reachable)
 
-                if push_success and pull_success:
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ✓ Sync completed successfully"
-                    )
-                else:
-                    print(
-                        f"[{timezone.now().strftime('%H:%M:%S')}] ⚠ Sync completed with errors"
-                    )
+        except Exception as e:
+            print(f"[{timezone.now().strftime('%H:%M:%S')}] Sync error: {e}")
+            import traceback
 
-            except Exception as e:
-                print(f"[{timezone.now().strftime('%H:%M:%S')}] Sync error: {e}")
-                import traceback
+            traceback.print_exc()
+            return self.interval
 
-                traceback.print_exc()
+    def push_pending(self):
+        """Push new sales and returns now, between scheduled cycles."""
+        try:
+            print(f"[{timezone.now().strftime('%H:%M:%S')}] Pushing new sales...")
+            reachable, _ = self._run_chain(self.sync_manager, self.push_chain())
 
-            time.sleep(self.interval)
+            # Leave retries to the scheduled cycle and its backoff
+            if not reachable:
+                self.failures += 1
+        except Exception as e:
+            print(f"[{timezone.now().strftime('%H:%M:%S')}] Push error: {e}")
 
-        print(f"[{timezone.now().strftime('%H:%M:%S')}] Background sync loop ended")
+    def notify(self):
+        """Wake the loop to push new work after the debounce delay."""
+        if not self.running:
+            return
+        self.push_requested = True
+        self.wakeup.set()
 
 
 sync_service = BackgroundSync(
-    interval=getattr(settings, "SYNC_INTERVAL", 30) if settings.IS_DESKTOP else 30
+    interval=getattr(settings, "SYNC_INTERVAL", 30) if settings.IS_DESKTOP else 30,
+    debounce=getattr(settings, "SYNC_PUSH_DEBOUNCE", 3),
 )
+
+
+def request_push():
+    """Ask the sync worker to push soon; call once a sale or return commits."""
+    sync_service.notify()
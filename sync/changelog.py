@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from .models import ChangeLog, Terminal
+
+
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+# Advisory lock held (shared) by every transaction that writes to the log.
+# Ids are handed out when a row is inserted, not when its transaction commits,
+# so a gap in the ids may be a write still in flight. Taking this lock
+# exclusively waits for those writes to commit or roll back.
+WRITERS_LOCK = 0x6368616E
+
+
+def is_enabled():
+    # Only the server serves changes; terminals apply them
+    return not settings.IS_DESKTOP
+
+
+def _writers_lock(shared):
+    # SQLite already lets only one transaction write at a time
+    if connection.vendor != "postgresql":
+        return
+    function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {function}(%s)", [WRITERS_LOCK])
+
+
+def wait_for_writers():
+    """Block until every transaction writing to the log has finished.
+
+    Call inside transaction.atomic; new writers wait until it ends, so every id
+    below the highest one read is then either visible or never will be.
+    """
+    _writers_lock(shared=False)
+
+
+def record_change(model, object_id, action="upsert"):
+    if not is_enabled() or object_id is None:
+        return
+    with transaction.atomic():
+        _writers_lock(shared=True)
+        ChangeLog.objects.create(model=model, object_id=object_id, action=action)
+
+
+def record_changes(model, object_ids, action="upsert"):
+    """Log the same change for many rows, e.g. after a queryset update()."""
+    if not is_enabled():
+        return
+    with transaction.atomic():
+        _writers_lock(shared=True)
+        ChangeLog.objects.bulk_create(
+            [
+                ChangeLog(model=model, object_id=object_id, action=action)
+                for object_id in object_ids
+            ]
+        )
+
+
+def current_cursor():
+    """Cursor to hand out with a full snapshot, e.g. the initial sync."""
+    with transaction.atomic():
+        wait_for_writers()
+        return ChangeLog.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def _page(cursor, limit):
+    return list(
+        ChangeLog.objects.filter(id__gt=cursor)
+        .order_by("id")
+        .values_list("id", "model", "object_id", "action")[: limit + 1]
+    )
+
+
+def _has_gap(cursor, rows):
+    return bool(rows) and rows[-1][0] - cursor != len(rows)
+
+
+def changes_since(cursor, limit=PAGE_SIZE):
+    """One page of changes after cursor, collapsed to the last action per row.
+
+    Returns ({model: {object_id: action}}, next_cursor, has_more).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    rows = _page(cursor, limit)
+    if _has_gap(cursor, rows):
+        # A missing id may still commit; read again once it has (or never will)
+        with transaction.atomic():
+            wait_for_writers()
+            rows = _page(cursor, limit)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = {}
+    for change_id, model, object_id, action in rows:
+        changes.setdefault(model, {})[object_id] = action
+
+    next_cursor = rows[-1][0] if rows else cursor
+    return changes, next_cursor, has_more
+
+
+def note_terminal_cursor(store_id, cursor):
+    """Remember that a terminal has applied every change up to cursor."""
+    Terminal.objects.filter(store_id=store_id, change_cursor__lt=cursor).update(
+        change_cursor=cursor
+    )
+
+
+def prune_changes():
+    """Delete the changes every registered terminal has applied; returns how many.
+
+    A terminal that has not pulled since registering holds the log back, so
+    nothing it may still need is lost. New terminals start from a snapshot
+    and current_cursor(), never from older rows.
+    """
+    oldest = (
+        Terminal.objects.exclude(store_id=str(settings.STORE_ID))
+        .aggregate(oldest=Min("change_cursor"))["oldest"]
+    )
+    if not oldest:
+        return 0
+    deleted, _ = ChangeLog.objects.filter(id__lte=oldest).delete()
+    return deleted
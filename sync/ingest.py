@@ -0,0 +1,216 @@
+import logging
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from products.models import Product
+from sales.models import Sale, SaleItem
+from reports.rollup import record_sales
+from hardware.printer_client import invalidate_receipts
+from .upsert import chunked
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+SALE_PUSH_FIELDS = [
+    "sale_type",
+    "cashier",
+    "total_amount",
+    "discount_amount",
+    "final_amount",
+    "payment_method",
+    "money_received",
+    "change_amount",
+    "notes",
+    "completed_at",
+    "store_id",
+    "cart_subtotal",
+    "cart_special_total",
+    "cart_items_count",
+]
+
+SALE_ITEM_PUSH_FIELDS = [
+    "quantity",
+    "unit_price",
+    "discount_amount",
+    "total_amount",
+]
+
+
+def ingest_sales(sales_data, batch_size, store_id=""):
+    """Store sales pushed by a terminal, one transaction per batch.
+
+    Returns a list of per-batch acknowledgements, each
+    {"accepted": [sale_number, ...], "errors": [{"sale": ..., "error": ...}]}.
+    """
+    batches = []
+    for batch in chunked(sales_data, batch_size):
+        accepted, errors = ingest_sale_batch(batch, store_id)
+        batches.append({"accepted": accepted, "errors": errors})
+    return batches
+
+
+def numbers_owned_elsewhere(model, field, numbers, store_id):
+    """{number: store_id} of the given numbers already stored for another store.
+
+    Rows without a store id predate store tracking; a re-push may still
+    update those, as before.
+    """
+    return dict(
+        model.objects.filter(**{f"{field}__in": numbers})
+        .exclude(store_id="")
+        .exclude(store_id=store_id)
+        .values_list(field, "store_id")
+    )
+
+
+def ingest_sale_batch(sales_data, store_id=""):
+    cashiers = User.objects.in_bulk({s["cashier_id"] for s in sales_data})
+    products = Product.objects.in_bulk(
+        {item["product_id"] for s in sales_data for item in s.get("items", [])}
+    )
+    taken = numbers_owned_elsewhere(
+        Sale, "sale_number", [s.get("sale_number") for s in sales_data], store_id
+    )
+
+    valid = []
+    errors = []
+    for sale_data in sales_data:
+        number = sale_data.get("sale_number")
+        if sale_data["cashier_id"] not in cashiers:
+            error_msg = f"Cashier not found: {sale_data['cashier_id']}"
+        elif number in taken:
+            # Never let one store's sale overwrite another's
+            error_msg = f"Sale number {number} already belongs to store {taken[number]}"
+        else:
+            valid.append(sale_data)
+            continue
+        logger.warning(error_msg)
+        errors.append({"sale": number, "error": error_msg})
+
+    try:
+        with transaction.atomic():
+            save_sales(valid, products, store_id)
+        return [s["sale_number"] for s in valid], errors
+    except Exception as e:
+        logger.warning(
+            f"Bulk push of {len(valid)} sales failed ({e}), retrying one by one"
+        )
+
+    # Isolate the sales the database rejects so the rest are still stored
+    accepted = []
+    for sale_data in valid:
+        try:
+            with transaction.atomic():
+                save_sales([sale_data], products, store_id)
+            accepted.append(sale_data["sale_number"])
+        except Exception as e:
+            logger.error(f"Error syncing sale {sale_data.get('sale_number')}: {e}")
+            errors.append({"sale": sale_data.get("sale_number"), "error": str(e)})
+    return accepted, errors
+
+
+def cart_totals(sale_data, products):
+    """The cart totals SaleItem.save would have kept for a pushed sale."""
+    lines = {
+        item_data["product_id"]: item_data
+        for item_data in sale_data.get("items", [])
+        if item_data["product_id"] in products
+    }
+    subtotal = Decimal("0")
+    special_total = Decimal("0")
+    for item_data in lines.values():
+        line_subtotal, line_special = SaleItem.cart_line(
+            sale_data["sale_type"],
+            item_data["quantity"],
+            Decimal(str(item_data["unit_price"])),
+            Decimal(str(item_data["total_amount"])),
+            Decimal(str(item_data.get("discount_amount", 0))),
+        )
+        subtotal += line_subtotal
+        special_total += line_special
+    return {
+        "cart_subtotal": subtotal,
+        "cart_special_total": special_total,
+        "cart_items_count": len(lines),
+    }
+
+
+def save_sales(sales_data, products, store_id=""):
+    """Upsert sales on sale_number and their items on (sale, product)."""
+    if not sales_data:
+        return
+
+    numbers = [s["sale_number"] for s in sales_data]
+    existing = set(
+        Sale.objects.filter(sale_number__in=numbers).values_list(
+            "sale_number", flat=True
+        )
+    )
+
+    Sale.objects.bulk_create(
+        [
+            Sale(
+                sale_number=sale_data["sale_number"],
+                sale_type=sale_data["sale_type"],
+                cashier_id=sale_data["cashier_id"],
+                total_amount=sale_data["total_amount"],
+                discount_amount=sale_data.get("discount_amount", 0),
+                final_amount=sale_data["final_amount"],
+                payment_method=sale_data["payment_method"],
+                money_received=sale_data.get("money_received"),
+                change_amount=sale_data.get("change_amount"),
+                notes=sale_data.get("notes", ""),
+                completed_at=sale_data["completed_at"],
+                store_id=store_id,
+                **cart_totals(sale_data, products),
+            )
+            for sale_data in sales_data
+        ],
+        update_conflicts=True,
+        unique_fields=["sale_number"],
+        update_fields=SALE_PUSH_FIELDS,
+    )
+    sale_ids = dict(
+        Sale.objects.filter(sale_number__in=numbers).values_list("sale_number", "id")
+    )
+
+    # SaleItem has no unique key to upsert on, so match re-pushed lines by hand
+    existing_items = {
+        (sale_id, product_id): pk
+        for pk, sale_id, product_id in SaleItem.objects.filter(
+            sale_id__in=[sale_ids[number] for number in existing]
+        ).values_list("id", "sale_id", "product_id")
+    }
+
+    items = {}
+    for sale_data in sales_data:
+        sale_id = sale_ids[sale_data["sale_number"]]
+        for item_data in sale_data.get("items", []):
+            if item_data["product_id"] not in products:
+                logger.warning(f"Product not found: {item_data['product_id']}")
+                continue
+
+            key = (sale_id, item_data["product_id"])
+            items[key] = SaleItem(
+                id=existing_items.get(key),
+                sale_id=sale_id,
+                product_id=item_data["product_id"],
+                quantity=item_data["quantity"],
+                unit_price=item_data["unit_price"],
+                discount_amount=item_data.get("discount_amount", 0),
+                total_amount=item_data["total_amount"],
+            )
+
+    SaleItem.objects.bulk_update(
+        [item for item in items.values() if item.id], SALE_ITEM_PUSH_FIELDS
+    )
+    SaleItem.objects.bulk_create([item for item in items.values() if not item.id])
+    # Re-pushed sales were upserted in bulk, so no post_save cleared their receipts
+    invalidate_receipts([sale_ids[number] for number in existing])
+
+    record_sales(
+        Sale.objects.filter(
+            id__in=[sale_ids[n] for n in numbers if n not in existing]
+        )
+    )
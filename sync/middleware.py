@@ -0,0 +1,93 @@
+import zlib
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import get_conditional_response, set_response_etag
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+SYNC_API_PREFIX = "/api/sync/"
+
+# Bytes inflated per step, so an oversized body is caught before it is built
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def gunzip(data, limit=None):
+    """Decompress a gzip body, raising BodyTooLarge once it passes limit bytes.
+
+    Raises ValueError for data that is not a complete gzip stream.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = []
+    size = 0
+    try:
+        while not decompressor.eof:
+            chunk = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            if not chunk and not data:
+                raise ValueError("Truncated gzip stream")
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise BodyTooLarge()
+            chunks.append(chunk)
+            data = decompressor.unconsumed_tail
+    except zlib.error as e:
+        raise ValueError(str(e))
+    return b"".join(chunks)
+
+
+def has_valid_token(request):
+    try:
+        return TokenAuthentication().authenticate(request) is not None
+    except AuthenticationFailed:
+        return False
+
+
+class SyncApiMiddleware(GZipMiddleware):
+    """Compression and conditional GETs for the terminal sync API.
+
+    Terminals send gzip-compressed push bodies and revalidate pulls with
+    If-None-Match. Only the sync API is compressed; the HTML pages carry
+    CSRF tokens and are left alone.
+    """
+
+    def process_request(self, request):
+        if not request.path.startswith(SYNC_API_PREFIX):
+            return None
+        if request.headers.get("Content-Encoding", "").lower() != "gzip":
+            return None
+        # Only inflate for a known terminal; the view refuses anyone else
+        # before it reads the (still compressed) body
+        if not has_valid_token(request):
+            return None
+
+        try:
+            body = gunzip(request.body, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        except BodyTooLarge:
+            return HttpResponse("Request body too large", status=413)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid gzip request body")
+        request._body = body
+        request.META.pop("HTTP_CONTENT_ENCODING", None)
+        request.META["CONTENT_LENGTH"] = str(len(body))
+        return None
+
+    def process_response(self, request, response):
+        if not request.path.startswith(SYNC_API_PREFIX):
+            return response
+
+        if (
+            request.method == "GET"
+            and response.status_code == 200
+            and not response.streaming
+        ):
+            set_response_etag(response)
+            response = get_conditional_response(
+                request, etag=response["ETag"], response=response
+            )
+
+        return super().process_response(request, response)
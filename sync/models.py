@@ -1,3 +1,5 @@
+import uuid
+from django.conf import settings
 from django.db import models
 
 
@@ -20,3 +22,219 @@ class SyncLog(models.Model):
 
     def __str__(self):
         return f"{self.sync_type} - {self.status} ({self.started_at})"
+
+
+class ChangeLog(models.Model):
+    """Append-only record of changes to the data terminals pull from the server.
+
+    The primary key is the sync cursor: terminals ask for every change after
+    the last id they applied, so the server clock never has to agree with
+    theirs.
+    """
+
+    ACTIONS = [
+        ("upsert", "Created or updated"),
+        ("delete", "Deleted"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS, default="upsert")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.model} {self.object_id}"
+
+
+class SyncCursor(models.Model):
+    """How far a terminal has read each server stream.
+
+    Change-log streams keep the last id applied in position; streams paged on
+    something else keep the server's opaque cursor in token.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    token = models.CharField(max_length=100, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list("position", flat=True).first()
+
+    @classmethod
+    def advance(cls, name, position):
+        cls.objects.update_or_create(name=name, defaults={"position": position})
+
+    @classmethod
+    def get_token(cls, name):
+        return cls.objects.filter(name=name).values_list("token", flat=True).first()
+
+    @classmethod
+    def advance_token(cls, name, token):
+        cls.objects.update_or_create(name=name, defaults={"token": token})
+
+
+class Outbox(models.Model):
+    """Local work waiting to be pushed to the server.
+
+    An entry is written in the same transaction as the sale or return it
+    carries, with the payload ready to send, and deleted once the server has
+    accepted it. Pushes, retries and the sync status only ever read this
+    table, which stays as small as the backlog.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=64)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="unique_outbox_entry")
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.attempts} attempts)"
+
+    @classmethod
+    def enqueue(cls, kind, key, object_id, payload):
+        cls.objects.update_or_create(
+            kind=kind,
+            key=key,
+            defaults={"object_id": object_id, "payload": payload},
+        )
+
+    @classmethod
+    def acknowledge(cls, kind, sent):
+        """Delete the entries the server accepted, given as {key: payload sent}.
+
+        An entry queued again with a new payload while the push was in flight
+        stays for the next push. Call inside a transaction; returns the keys
+        deleted.
+        """
+        entries = (
+            cls.objects.select_for_update()
+            .filter(kind=kind, key__in=list(sent))
+            .values_list("id", "key", "payload")
+        )
+        done = {pk: key for pk, key, payload in entries if payload == sent[key]}
+        cls.objects.filter(id__in=list(done)).delete()
+        return set(done.values())
+
+    @classmethod
+    def record_failures(cls, kind, errors):
+        """Count a failed push for each {key: error}, parking the hopeless ones.
+
+        Returns the number of entries moved to SyncDeadLetter.
+        """
+        parked = 0
+        for entry in cls.objects.filter(kind=kind, key__in=list(errors)):
+            entry.attempts += 1
+            entry.last_error = errors[entry.key]
+            if entry.attempts < cls.MAX_ATTEMPTS:
+                entry.save(update_fields=["attempts", "last_error"])
+                continue
+
+            SyncDeadLetter.park(entry)
+            entry.delete()
+            parked += 1
+        return parked
+
+
+class SyncDeadLetter(models.Model):
+    """Outbox entries the server kept rejecting, parked for someone to look at.
+
+    Parking them stops one bad record from being retried on every push.
+    """
+
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=64)
+    payload = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_attempt_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-last_attempt_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="unique_dead_letter")
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.attempts} attempts)"
+
+    @classmethod
+    def park(cls, entry):
+        print(
+            f"Parked {entry.kind} {entry.key} after {entry.attempts} failed pushes: "
+            f"{entry.last_error}"
+        )
+        cls.objects.update_or_create(
+            kind=entry.kind,
+            key=entry.key,
+            defaults={
+                "payload": entry.payload,
+                "error": entry.last_error,
+                "attempts": entry.attempts,
+            },
+        )
+
+    @classmethod
+    def parked_keys(cls, kind):
+        return cls.objects.filter(kind=kind).values("key")
+
+
+class Terminal(models.Model):
+    """A till's claim on a store id.
+
+    Sale and return numbers carry the store id, so two installs sharing one
+    would number their documents alike. On the server the first install to
+    register an id owns it and pushes under that id from anywhere else are
+    refused; on a terminal the table holds its own id and install key.
+    """
+
+    store_id = models.CharField(max_length=20, unique=True)
+    install_key = models.CharField(max_length=64)
+    registered_at = models.DateTimeField(auto_now_add=True)
+    # Server side: the change-log id this terminal has applied up to. The log
+    # is pruned below the lowest one.
+    change_cursor = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Terminal {self.store_id}"
+
+    @classmethod
+    def local(cls):
+        """This install's identity for its STORE_ID, created on first use."""
+        terminal, _ = cls.objects.get_or_create(
+            store_id=settings.STORE_ID, defaults={"install_key": uuid.uuid4().hex}
+        )
+        return terminal
+
+    @classmethod
+    def register(cls, store_id, install_key):
+        """Claim store_id for install_key; False if another install owns it."""
+        terminal, created = cls.objects.get_or_create(
+            store_id=store_id, defaults={"install_key": install_key}
+        )
+        return created or terminal.install_key == install_key
+
+    @classmethod
+    def verify(cls, store_id, install_key):
+        return cls.objects.filter(store_id=store_id, install_key=install_key).exists()
@@ -0,0 +1,80 @@
+from django.conf import settings
+from sales.models import Sale, Return
+from .models import Outbox, SyncDeadLetter
+from .payloads import sale_payload, return_payload
+from .upsert import chunked
+
+
+def is_enabled():
+    """Only terminals push their work; the server is where it is pushed to."""
+    return settings.IS_DESKTOP
+
+
+def enqueue_sale(sale):
+    """Queue a completed sale; call inside the transaction that completes it."""
+    if is_enabled():
+        Outbox.enqueue("sale", sale.sale_number, sale.pk, sale_payload(sale))
+
+
+def enqueue_return(return_obj):
+    """Queue a processed return; call inside the transaction that records it."""
+    if is_enabled():
+        Outbox.enqueue(
+            "return",
+            return_obj.return_number,
+            return_obj.pk,
+            return_payload(return_obj),
+        )
+
+
+def backfill():
+    """Queue sales and returns left unsynced from before the outbox existed.
+
+    Returns the number of entries added.
+    """
+    if not is_enabled():
+        return 0
+
+    added = 0
+    sources = [
+        (
+            "sale",
+            "sale_number",
+            Sale.objects.filter(completed_at__isnull=False, synced_at__isnull=True)
+            .select_related("cashier")
+            .order_by("id"),
+            sale_payload,
+        ),
+        (
+            "return",
+            "return_number",
+            Return.objects.filter(synced_at__isnull=True)
+            .select_related("cashier", "sale")
+            .order_by("id"),
+            return_payload,
+        ),
+    ]
+    for kind, key_field, unsynced, build in sources:
+        queued = set(
+            Outbox.objects.filter(kind=kind).values_list("key", flat=True)
+        ) | set(SyncDeadLetter.parked_keys(kind).values_list("key", flat=True))
+
+        missing = [obj for obj in unsynced if getattr(obj, key_field) not in queued]
+        for chunk in chunked(missing):
+            Outbox.objects.bulk_create(
+                [
+                    Outbox(
+                        kind=kind,
+                        key=getattr(obj, key_field),
+                        object_id=obj.pk,
+                        payload=build(obj),
+                    )
+                    for obj in chunk
+                ],
+                ignore_conflicts=True,
+            )
+        added += len(missing)
+
+    if added:
+        print(f"Queued {added} unsynced sales and returns for push")
+    return added
@@ -0,0 +1,62 @@
+def sale_payload(sale):
+    items_data = []
+    for item in sale.items.select_related("product"):
+        items_data.append(
+            {
+                "product_id": (
+                    item.product.server_id if item.product.server_id else item.product.id
+                ),
+                "quantity": item.quantity,
+                "unit_price": str(item.unit_price),
+                "discount_amount": str(item.discount_amount),
+                "total_amount": str(item.total_amount),
+            }
+        )
+
+    return {
+        "sale_number": sale.sale_number,
+        "sale_type": sale.sale_type,
+        "cashier_id": (
+            sale.cashier.server_id if sale.cashier.server_id else sale.cashier.id
+        ),
+        "total_amount": str(sale.total_amount),
+        "discount_amount": str(sale.discount_amount),
+        "final_amount": str(sale.final_amount),
+        "payment_method": sale.payment_method,
+        "money_received": str(sale.money_received) if sale.money_received else None,
+        "change_amount": str(sale.change_amount) if sale.change_amount else None,
+        "notes": sale.notes,
+        "created_at": sale.created_at.isoformat(),
+        "completed_at": sale.completed_at.isoformat(),
+        "items": items_data,
+    }
+
+
+def return_payload(return_obj):
+    items_data = []
+    for item in return_obj.items.select_related("sale_item__product"):
+        product = item.sale_item.product
+        items_data.append(
+            {
+                "sale_item_id": item.sale_item.id,
+                "product_id": product.server_id if product.server_id else product.id,
+                "quantity": item.quantity,
+                "return_reason": item.return_reason,
+                "unit_price": str(item.unit_price),
+                "total_price": str(item.total_price),
+            }
+        )
+
+    return {
+        "return_number": return_obj.return_number,
+        "sale_number": return_obj.sale.sale_number,
+        "cashier_id": (
+            return_obj.cashier.server_id
+            if return_obj.cashier.server_id
+            else return_obj.cashier.id
+        ),
+        "total_return_amount": str(return_obj.total_return_amount),
+        "notes": return_obj.notes,
+        "created_at": return_obj.created_at.isoformat(),
+        "items": items_data,
+    }
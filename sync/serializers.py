@@ -69,6 +69,7 @@ class BrandSyncSerializer(serializers.ModelSerializer):
             "description",
             "is_active",
             "created_at",
+            "updated_at",
         ]
 
 
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from products.models import Product, Category, Brand, Barcode
+from .changelog import record_change
+
+User = get_user_model()
+
+SYNCED_MODELS = {
+    User: "user",
+    Category: "category",
+    Brand: "brand",
+    Product: "product",
+}
+
+
+def log_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which terminals don't need
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    record_change(SYNCED_MODELS[sender], instance.pk)
+
+
+def log_deleted(sender, instance, **kwargs):
+    record_change(SYNCED_MODELS[sender], instance.pk, "delete")
+
+
+for model in SYNCED_MODELS:
+    post_save.connect(log_saved, sender=model, dispatch_uid=f"changelog_save_{model}")
+    post_delete.connect(
+        log_deleted, sender=model, dispatch_uid=f"changelog_delete_{model}"
+    )
+
+
+@receiver(post_save, sender=Barcode)
+@receiver(post_delete, sender=Barcode)
+def log_barcode_change(sender, instance, **kwargs):
+    # Barcodes travel inside their product's payload
+    record_change("product", instance.product_id)
@@ -1,39 +1,140 @@
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from collections import defaultdict
+from django.db.models import F, Sum
 from django.contrib.auth import get_user_model
 from products.models import Product, Category, Brand, Barcode
+from products.lookup import product_index
+from products.search import product_search
 from sales.models import Sale, SaleItem, Return, ReturnItem
+from reports.rollup import record_sales, record_return
 from .api_client import ServerAPI
-from .models import SyncLog
+from .models import SyncLog, SyncCursor, Outbox
+from .upsert import chunked, server_id_map, upsert
 
 User = get_user_model()
 
+CHANGES_CURSOR = "changes"
+
+# Progress of an interrupted initial sync
+INITIAL_CHANGES = "initial_changes"
+INITIAL_STAGE = "initial_stage"
+INITIAL_AFTER = "initial_after"
+
+PRODUCT_SYNC_FIELDS = [
+    "name",
+    "description",
+    "category",
+    "brand",
+    "slug",
+    "sku",
+    "cost_price",
+    "selling_price",
+    "wholesale_price",
+    "special_price",
+    "quantity",
+    "low_stock_threshold",
+    "weight",
+    "sold_count",
+    "is_active",
+    "updated_at",
+    "synced_at",
+]
+
+USER_SYNC_FIELDS = [
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "role",
+    "phone_number",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+    "updated_at",
+    "synced_at",
+]
+
 
 class SyncManager:
     def __init__(self):
         self.api = ServerAPI()
+        self.registered = False
+
+    def register_terminal(self):
+        """Make sure the server knows this install owns STORE_ID.
+
+        Pushes wait until it does, so two tills set up with the same store id
+        can never merge their sale numbers on the server.
+        """
+        if self.registered:
+            return True
+
+        result = self.api.register_terminal()
+        if result:
+            self.registered = True
+            print(f"Registered terminal {settings.STORE_ID} with the server")
+        elif result is False:
+            SyncLog.objects.create(
+                sync_type="push",
+                status="failed",
+                error_message=(
+                    f"Store id {settings.STORE_ID} is in use by another terminal; "
+                    "set a unique STORE_ID"
+                ),
+                completed_at=timezone.now(),
+            )
+        return self.registered
 
     def initial_setup(self):
+        """Stream the catalogue from the server, committing chunk by chunk.
+
+        Progress is kept in SyncCursor rows, so after a crash or a dropped
+        connection the next attempt resumes after the last committed chunk.
+        """
         print("Starting initial sync from server...")
         try:
-            data = self.api.initial_sync()
-
-            if not data:
-                print("Initial sync failed - no data received")
-                return False
+            stage = SyncCursor.get(INITIAL_STAGE) or 0
+            after = SyncCursor.get(INITIAL_AFTER) or 0
+            if stage or after:
+                print(f"Resuming initial sync at stage {stage} after id {after}")
+
+            syncers = {
+                "categories": self._sync_categories,
+                "brands": self._sync_brands,
+                "products": self._sync_products,
+                "users": self._sync_users,
+            }
+
+            total_records = 0
+            finished = False
+            for message in self.api.initial_sync_stream(stage, after):
+                if message["type"] == "start":
+                    # Keep the first cursor; changes since then are replayed later
+                    if SyncCursor.get(INITIAL_CHANGES) is None:
+                        SyncCursor.advance(INITIAL_CHANGES, message["cursor"])
+
+                elif message["type"] == "chunk":
+                    with transaction.atomic():
+                        syncers[message["entity"]](message["rows"])
+                        SyncCursor.advance(INITIAL_STAGE, message["stage"])
+                        SyncCursor.advance(INITIAL_AFTER, message["last"])
+                    total_records += len(message["rows"])
+
+                elif message["type"] == "end":
+                    finished = True
+
+            if not finished:
+                raise Exception("Initial sync stream ended before completion")
 
             with transaction.atomic():
-                self._sync_categories(data.get("categories", []))
-                self._sync_brands(data.get("brands", []))
-                self._sync_products(data.get("products", []))
-                self._sync_users(data.get("users", []))
-
-                total_records = (
-                    len(data.get("categories", []))
-                    + len(data.get("brands", []))
-                    + len(data.get("products", []))
-                    + len(data.get("users", []))
+                SyncCursor.advance(
+                    CHANGES_CURSOR, SyncCursor.get(INITIAL_CHANGES) or 0
                 )
+                SyncCursor.objects.filter(
+                    name__in=[INITIAL_CHANGES, INITIAL_STAGE, INITIAL_AFTER]
+                ).delete()
 
                 SyncLog.objects.create(
                     sync_type="initial",
@@ -59,15 +160,19 @@ class SyncManager:
 
     def full_sync(self):
         try:
-            if not self.api.test_connection():
-                print("Server unreachable, skipping sync")
-                return False
-
-            self.push_sales_to_server()
-            self.push_returns_to_server()
-            self.pull_from_server()
-            self.pull_sales_from_server()
-            self.pull_returns_from_server()
+            self.api.reachable = None
+            for stage in (
+                self.push_sales_to_server,
+                self.push_returns_to_server,
+                self.pull_from_server,
+                self.pull_sales_from_server,
+                self.pull_returns_from_server,
+            ):
+                stage()
+                # The first request doubles as the health check
+                if self.api.reachable is False:
+                    print("Server unreachable, skipping sync")
+                    return False
 
             return True
         except Exception as e:
@@ -78,49 +183,50 @@ class SyncManager:
             return False
 
     def pull_from_server(self):
+        """Apply the server's change log, page by page, from the saved cursor."""
         try:
-            last_sync = (
-                SyncLog.objects.filter(sync_type="pull", status="success")
-                .order_by("-completed_at")
-                .first()
-            )
+            cursor = SyncCursor.get(CHANGES_CURSOR) or 0
+            print(f"Pulling changes after: {cursor}")
 
-            last_sync_time = (
-                last_sync.completed_at
-                if last_sync
-                else timezone.now() - timezone.timedelta(days=365)
-            )
-
-            print(f"Pulling updates since: {last_sync_time.isoformat()}")
-            data = self.api.pull_updates(last_sync_time.isoformat())
+            total_records = 0
+            while True:
+                data = self.api.pull_changes(cursor)
 
-            if not data:
-                print("Pull failed or no data")
-                return False
+                if not data:
+                    print("Pull failed or no data")
+                    return False
 
-            if not data.get("has_updates"):
-                print("No updates from server")
-                return True
+                with transaction.atomic():
+                    self._sync_categories(data.get("categories", []))
+                    self._sync_brands(data.get("brands", []))
+                    self._sync_products(data.get("products", []), update_mode=True)
+                    self._sync_users(data.get("users", []))
+                    deleted = self._apply_deletions(data.get("deleted", {}))
 
-            with transaction.atomic():
-                self._sync_categories(data.get("categories", []))
-                self._sync_brands(data.get("brands", []))
-                self._sync_products(data.get("products", []), update_mode=True)
-                self._sync_users(data.get("users", []))
+                    cursor = data["cursor"]
+                    SyncCursor.advance(CHANGES_CURSOR, cursor)
 
-                total_records = (
+                total_records += (
                     len(data.get("categories", []))
                     + len(data.get("brands", []))
                     + len(data.get("products", []))
                     + len(data.get("users", []))
+                    + deleted
                 )
 
-                SyncLog.objects.create(
-                    sync_type="pull",
-                    status="success",
-                    records_count=total_records,
-                    completed_at=timezone.now(),
-                )
+                if not data.get("has_more"):
+                    break
+
+            if not total_records:
+                print("No updates from server")
+                return True
+
+            SyncLog.objects.create(
+                sync_type="pull",
+                status="success",
+                records_count=total_records,
+                completed_at=timezone.now(),
+            )
 
             print(f"Pulled updates: {total_records} records")
             return True
@@ -138,396 +244,327 @@ class SyncManager:
             return False
 
     def pull_sales_from_server(self):
-        try:
-            last_sync = (
-                SyncLog.objects.filter(sync_type="pull_sales", status="success")
-                .order_by("-completed_at")
-                .first()
-            )
+        return self._pull_stream(
+            "sale", self.api.pull_sales, "pull_sales", self._save_pulled_sales
+        )
 
-            last_sync_time = (
-                last_sync.completed_at
-                if last_sync
-                else timezone.now() - timezone.timedelta(days=30)
-            )
+    def pull_returns_from_server(self):
+        return self._pull_stream(
+            "return", self.api.pull_returns, "pull_returns", self._save_pulled_returns
+        )
 
-            print(f"Pulling sales since: {last_sync_time.isoformat()}")
-            data = self.api.pull_sales(last_sync_time.isoformat())
+    def _pull_stream(self, kind, fetch, sync_type, save):
+        """Apply another store's records page by page, resuming at the cursor.
 
-            if not data or not data.get("sales"):
-                print("No new sales from server")
-                return True
+        Each page is committed together with its cursor, so a dropped
+        connection only repeats the page that was in flight.
+        """
+        key = f"{kind}s"
+        try:
+            after = SyncCursor.get_token(sync_type)
+            since = None
+            if after:
+                print(f"Pulling {key} after: {after}")
+            else:
+                # First streamed pull: start where the last timestamp pull ended
+                last_sync = (
+                    SyncLog.objects.filter(sync_type=sync_type, status="success")
+                    .order_by("-completed_at")
+                    .first()
+                )
+                since = (
+                    last_sync.completed_at
+                    if last_sync
+                    else timezone.now() - timezone.timedelta(days=30)
+                ).isoformat()
+                print(f"Pulling {key} since: {since}")
 
             synced_count = 0
-            with transaction.atomic():
-                for sale_data in data.get("sales", []):
-                    if Sale.objects.filter(
-                        sale_number=sale_data["sale_number"]
-                    ).exists():
-                        continue
-
-                    try:
-                        cashier = User.objects.filter(
-                            server_id=sale_data["cashier_id"]
-                        ).first()
-                        if not cashier:
-                            print(f"Cashier not found: {sale_data['cashier_id']}")
-                            continue
-
-                        sale = Sale.objects.create(
-                            sale_number=sale_data["sale_number"],
-                            sale_type=sale_data["sale_type"],
-                            cashier=cashier,
-                            total_amount=sale_data["total_amount"],
-                            discount_amount=sale_data.get("discount_amount", 0),
-                            final_amount=sale_data["final_amount"],
-                            payment_method=sale_data["payment_method"],
-                            money_received=sale_data.get("money_received"),
-                            change_amount=sale_data.get("change_amount"),
-                            notes=sale_data.get("notes", ""),
-                            created_at=sale_data["created_at"],
-                            completed_at=sale_data["completed_at"],
-                            synced_at=timezone.now(),
-                        )
-
-                        for item_data in sale_data.get("items", []):
-                            product = Product.objects.filter(
-                                server_id=item_data["product_id"]
-                            ).first()
-                            if not product:
-                                print(f"Product not found: {item_data['product_id']}")
-                                continue
-
-                            SaleItem.objects.create(
-                                sale=sale,
-                                product=product,
-                                quantity=item_data["quantity"],
-                                unit_price=item_data["unit_price"],
-                                discount_amount=item_data.get("discount_amount", 0),
-                                total_amount=item_data["total_amount"],
-                            )
-
-                            product.quantity -= item_data["quantity"]
-                            product.sold_count += item_data["quantity"]
-                            product.save(update_fields=["quantity", "sold_count"])
-
-                            print(
-                                f"    Reduced stock: {product.name} by {item_data['quantity']} (now {product.quantity})"
-                            )
-
-                        synced_count += 1
-                        print(f"  Pulled sale: {sale.sale_number}")
-
-                    except Exception as e:
-                        print(f"Error pulling sale {sale_data.get('sale_number')}: {e}")
-                        import traceback
-
-                        traceback.print_exc()
-                        continue
+            finished = False
+            for message in fetch(after, since):
+                if message["type"] == "page":
+                    with transaction.atomic():
+                        synced_count += save(message[key])
+                        SyncCursor.advance_token(sync_type, message["cursor"])
+                elif message["type"] == "end":
+                    finished = True
+
+            if not finished:
+                raise Exception(f"Pull {key} stream ended before completion")
+
+            if not synced_count:
+                print(f"No new {key} from server")
+                return True
 
-                SyncLog.objects.create(
-                    sync_type="pull_sales",
-                    status="success",
-                    records_count=synced_count,
-                    completed_at=timezone.now(),
-                )
+            SyncLog.objects.create(
+                sync_type=sync_type,
+                status="success",
+                records_count=synced_count,
+                completed_at=timezone.now(),
+            )
 
-            print(f"Pulled {synced_count} sales from server")
+            print(f"Pulled {synced_count} {key} from server")
             return True
 
         except Exception as e:
-            print(f"Pull sales error: {e}")
+            print(f"Pull {key} error: {e}")
             import traceback
 
             traceback.print_exc()
             return False
 
-    def pull_returns_from_server(self):
-        try:
-            last_sync = (
-                SyncLog.objects.filter(sync_type="pull_returns", status="success")
-                .order_by("-completed_at")
-                .first()
+    def _save_pulled_sales(self, sales_data):
+        numbers = [sale_data["sale_number"] for sale_data in sales_data]
+        existing = set(
+            Sale.objects.filter(sale_number__in=numbers).values_list(
+                "sale_number", flat=True
             )
+        )
+        sales_data = [s for s in sales_data if s["sale_number"] not in existing]
+        if not sales_data:
+            return 0
+
+        cashiers = server_id_map(User, {s["cashier_id"] for s in sales_data})
+        products = server_id_map(
+            Product, {item["product_id"] for s in sales_data for item in s["items"]}
+        )
+
+        now = timezone.now()
+        pulled = []
+        for sale_data in sales_data:
+            if sale_data["cashier_id"] not in cashiers:
+                print(f"Cashier not found: {sale_data['cashier_id']}")
+                continue
+            pulled.append(sale_data)
+
+        Sale.objects.bulk_create(
+            [
+                Sale(
+                    sale_number=sale_data["sale_number"],
+                    sale_type=sale_data["sale_type"],
+                    cashier_id=cashiers[sale_data["cashier_id"]],
+                    total_amount=sale_data["total_amount"],
+                    discount_amount=sale_data.get("discount_amount", 0),
+                    final_amount=sale_data["final_amount"],
+                    payment_method=sale_data["payment_method"],
+                    money_received=sale_data.get("money_received"),
+                    change_amount=sale_data.get("change_amount"),
+                    notes=sale_data.get("notes", ""),
+                    created_at=sale_data["created_at"],
+                    completed_at=sale_data["completed_at"],
+                    synced_at=now,
+                )
+                for sale_data in pulled
+            ]
+        )
+        sale_ids = dict(
+            Sale.objects.filter(
+                sale_number__in=[sale_data["sale_number"] for sale_data in pulled]
+            ).values_list("sale_number", "id")
+        )
+
+        items = []
+        lines = []
+        for sale_data in pulled:
+            sale_number = sale_data["sale_number"]
+            for item_data in sale_data["items"]:
+                product_id = products.get(item_data["product_id"])
+                if not product_id:
+                    print(f"Product not found: {item_data['product_id']}")
+                    continue
+
+                items.append(
+                    SaleItem(
+                        sale_id=sale_ids[sale_number],
+                        product_id=product_id,
+                        quantity=item_data["quantity"],
+                        unit_price=item_data["unit_price"],
+                        discount_amount=item_data.get("discount_amount", 0),
+                        total_amount=item_data["total_amount"],
+                    )
+                )
+                quantity = item_data["quantity"]
+                lines.append(
+                    (
+                        product_id,
+                        -quantity,
+                        f"Pulled sale {sale_number} - {quantity} units sold",
+                    )
+                )
+            print(f"  Pulled sale: {sale_number}")
 
-            last_sync_time = (
-                last_sync.completed_at
-                if last_sync
-                else timezone.now() - timezone.timedelta(days=30)
-            )
-
-            print(f"Pulling returns since: {last_sync_time.isoformat()}")
-            data = self.api.pull_returns(last_sync_time.isoformat())
-
-            if not data or not data.get("returns"):
-                print("No new returns from server")
-                return True
-
-            synced_count = 0
-            with transaction.atomic():
-                for return_data in data.get("returns", []):
-                    if Return.objects.filter(
-                        return_number=return_data["return_number"]
-                    ).exists():
-                        continue
-
-                    try:
-                        cashier = User.objects.filter(
-                            server_id=return_data["cashier_id"]
-                        ).first()
-                        sale = Sale.objects.filter(
-                            sale_number=return_data["sale_number"]
-                        ).first()
-
-                        if not cashier or not sale:
-                            print(
-                                f"Cashier or sale not found for return {return_data['return_number']}"
-                            )
-                            continue
-
-                        return_obj = Return.objects.create(
-                            return_number=return_data["return_number"],
-                            sale=sale,
-                            cashier=cashier,
-                            total_return_amount=return_data["total_return_amount"],
-                            notes=return_data.get("notes", ""),
-                            created_at=return_data["created_at"],
-                            synced_at=timezone.now(),
-                        )
+        SaleItem.objects.bulk_create(items)
+        Product.move_stock(lines, "OUT")
 
-                        for item_data in return_data.get("items", []):
-                            sale_item = SaleItem.objects.filter(
-                                sale=sale, product__server_id=item_data["product_id"]
-                            ).first()
-
-                            if not sale_item:
-                                print(
-                                    f"Sale item not found for product: {item_data['product_id']}"
-                                )
-                                continue
-
-                            ReturnItem.objects.create(
-                                return_fk=return_obj,
-                                sale_item=sale_item,
-                                quantity=item_data["quantity"],
-                                return_reason=item_data.get("return_reason", ""),
-                                unit_price=item_data["unit_price"],
-                                total_price=item_data["total_price"],
-                            )
-
-                            product = sale_item.product
-                            product.quantity += item_data["quantity"]
-                            product.sold_count -= item_data["quantity"]
-                            product.save(update_fields=["quantity", "sold_count"])
-
-                            print(
-                                f"    Restored stock: {product.name} by {item_data['quantity']} (now {product.quantity})"
-                            )
-
-                        synced_count += 1
-                        print(f"  Pulled return: {return_obj.return_number}")
-
-                    except Exception as e:
-                        print(
-                            f"Error pulling return {return_data.get('return_number')}: {e}"
-                        )
-                        import traceback
+        record_sales(Sale.objects.filter(id__in=sale_ids.values()))
+        return len(sale_ids)
 
-                        traceback.print_exc()
-                        continue
+    def _save_pulled_returns(self, returns_data):
+        numbers = [return_data["return_number"] for return_data in returns_data]
+        existing = set(
+            Return.objects.filter(return_number__in=numbers).values_list(
+                "return_number", flat=True
+            )
+        )
+        returns_data = [r for r in returns_data if r["return_number"] not in existing]
+        if not returns_data:
+            return 0
+
+        cashiers = server_id_map(User, {r["cashier_id"] for r in returns_data})
+        sales = dict(
+            Sale.objects.filter(
+                sale_number__in={r["sale_number"] for r in returns_data}
+            ).values_list("sale_number", "id")
+        )
+        sale_items = {
+            (sale_id, product_server_id): (pk, product_id)
+            for pk, sale_id, product_id, product_server_id in SaleItem.objects.filter(
+                sale_id__in=sales.values()
+            ).values_list("id", "sale_id", "product_id", "product__server_id")
+        }
+
+        now = timezone.now()
+        pulled = []
+        items = []
+        restored = defaultdict(int)
+        for return_data in returns_data:
+            sale_id = sales.get(return_data["sale_number"])
+            if return_data["cashier_id"] not in cashiers or not sale_id:
+                print(
+                    f"Cashier or sale not found for return {return_data['return_number']}"
+                )
+                continue
+
+            return_obj = Return.objects.create(
+                return_number=return_data["return_number"],
+                sale_id=sale_id,
+                cashier_id=cashiers[return_data["cashier_id"]],
+                total_return_amount=return_data["total_return_amount"],
+                notes=return_data.get("notes", ""),
+                created_at=return_data["created_at"],
+                synced_at=now,
+            )
 
-                SyncLog.objects.create(
-                    sync_type="pull_returns",
-                    status="success",
-                    records_count=synced_count,
-                    completed_at=timezone.now(),
+            for item_data in return_data["items"]:
+                sale_item = sale_items.get((sale_id, item_data["product_id"]))
+                if not sale_item:
+                    print(f"Sale item not found for product: {item_data['product_id']}")
+                    continue
+
+                items.append(
+                    ReturnItem(
+                        return_fk=return_obj,
+                        sale_item_id=sale_item[0],
+                        quantity=item_data["quantity"],
+                        return_reason=item_data.get("return_reason", ""),
+                        unit_price=item_data["unit_price"],
+                        total_price=item_data["total_price"],
+                    )
                 )
+                restored[sale_item[1]] += item_data["quantity"]
 
-            print(f"Pulled {synced_count} returns from server")
-            return True
+            pulled.append(return_obj)
+            print(f"  Pulled return: {return_obj.return_number}")
 
-        except Exception as e:
-            print(f"Pull returns error: {e}")
-            import traceback
+        ReturnItem.objects.bulk_create(items)
+        for product_id, quantity in restored.items():
+            Product.objects.filter(id=product_id).update(
+                quantity=F("quantity") + quantity,
+                sold_count=F("sold_count") - quantity,
+            )
 
-            traceback.print_exc()
-            return False
+        for return_obj in pulled:
+            record_return(return_obj)
+        return len(pulled)
 
     def push_sales_to_server(self):
-        try:
-            unsynced_sales = (
-                Sale.objects.filter(completed_at__isnull=False, synced_at__isnull=True)
-                .select_related("cashier")
-                .prefetch_related("items__product")
-            )
+        if not self.register_terminal():
+            return False
+        return self._push_outbox("sale", self.api.push_sales, "push_sales", Sale)
 
-            if not unsynced_sales.exists():
-                print("No sales to push")
-                return True
+    def push_returns_to_server(self):
+        if not self.register_terminal():
+            return False
+        return self._push_outbox("return", self.api.push_returns, "push_returns", Return)
 
-            sales_data = []
-            for sale in unsynced_sales:
-                items_data = []
-                for item in sale.items.all():
-                    items_data.append(
-                        {
-                            "product_id": (
-                                item.product.server_id
-                                if item.product.server_id
-                                else item.product.id
-                            ),
-                            "quantity": item.quantity,
-                            "unit_price": str(item.unit_price),
-                            "discount_amount": str(item.discount_amount),
-                            "total_amount": str(item.total_amount),
-                        }
-                    )
+    def _push_outbox(self, kind, send, sync_type, model):
+        """Push queued entries of one kind in batches, oldest first.
 
-                sales_data.append(
-                    {
-                        "sale_number": sale.sale_number,
-                        "sale_type": sale.sale_type,
-                        "cashier_id": (
-                            sale.cashier.server_id
-                            if sale.cashier.server_id
-                            else sale.cashier.id
-                        ),
-                        "total_amount": str(sale.total_amount),
-                        "discount_amount": str(sale.discount_amount),
-                        "final_amount": str(sale.final_amount),
-                        "payment_method": sale.payment_method,
-                        "money_received": (
-                            str(sale.money_received) if sale.money_received else None
-                        ),
-                        "change_amount": (
-                            str(sale.change_amount) if sale.change_amount else None
-                        ),
-                        "notes": sale.notes,
-                        "created_at": sale.created_at.isoformat(),
-                        "completed_at": sale.completed_at.isoformat(),
-                        "items": items_data,
-                    }
+        Only what the server acknowledges leaves the outbox; rejected entries
+        are retried on later pushes and parked in SyncDeadLetter once they
+        have failed too often.
+        """
+        label = model._meta.verbose_name_plural
+        key_field = f"{kind}_number"
+        try:
+            pushed_count = 0
+            rejected_count = 0
+            last_id = 0
+            while True:
+                batch = list(
+                    Outbox.objects.filter(kind=kind, id__gt=last_id).values_list(
+                        "id", "key", "payload"
+                    )[: settings.SYNC_PUSH_BATCH_SIZE]
                 )
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                payloads = {key: payload for _, key, payload in batch}
+
+                print(f"Pushing {len(payloads)} {label} to server...")
+                result = send(list(payloads.values()))
+
+                if not result or not result.get("success"):
+                    raise Exception("Server returned failure")
+
+                errors = {
+                    error[kind]: error.get("error", "")
+                    for error in result.get("errors", [])
+                    if error.get(kind) in payloads
+                }
+                # Servers without per-record acknowledgements accept all or nothing
+                accepted = set(
+                    result.get("accepted", [key for key in payloads if key not in errors])
+                ) & set(payloads)
 
-            print(f"Pushing {len(sales_data)} sales to server...")
-            result = self.api.push_sales(sales_data)
-
-            if result and result.get("success"):
                 with transaction.atomic():
-                    unsynced_sales.update(synced_at=timezone.now())
-
-                    SyncLog.objects.create(
-                        sync_type="push_sales",
-                        status="success",
-                        records_count=len(sales_data),
-                        completed_at=timezone.now(),
+                    acknowledged = Outbox.acknowledge(
+                        kind, {key: payloads[key] for key in accepted}
                     )
+                    model.objects.filter(**{f"{key_field}__in": acknowledged}).update(
+                        synced_at=timezone.now()
+                    )
+                    Outbox.record_failures(kind, errors)
 
-                print(f"Successfully pushed {len(sales_data)} sales")
-                return True
-            else:
-                print("Failed to push sales to server")
-                SyncLog.objects.create(
-                    sync_type="push_sales",
-                    status="failed",
-                    error_message="Server returned failure",
-                    completed_at=timezone.now(),
-                )
-                return False
+                pushed_count += len(accepted)
+                rejected_count += len(errors)
 
-        except Exception as e:
-            print(f"Push sales error: {e}")
-            import traceback
+            if not pushed_count and not rejected_count:
+                print(f"No {label} to push")
+                return True
 
-            traceback.print_exc()
             SyncLog.objects.create(
-                sync_type="push_sales",
-                status="failed",
-                error_message=str(e),
+                sync_type=sync_type,
+                status="success",
+                records_count=pushed_count,
+                error_message=(
+                    f"{rejected_count} {label} rejected" if rejected_count else ""
+                ),
                 completed_at=timezone.now(),
             )
-            return False
 
-    def push_returns_to_server(self):
-        try:
-            unsynced_returns = (
-                Return.objects.filter(synced_at__isnull=True)
-                .select_related("cashier", "sale")
-                .prefetch_related("items__sale_item__product")
+            print(
+                f"Successfully pushed {pushed_count} {label}, {rejected_count} rejected"
             )
-
-            if not unsynced_returns.exists():
-                print("No returns to push")
-                return True
-
-            returns_data = []
-            for return_obj in unsynced_returns:
-                items_data = []
-                for item in return_obj.items.all():
-                    items_data.append(
-                        {
-                            "sale_item_id": item.sale_item.id,
-                            "product_id": (
-                                item.sale_item.product.server_id
-                                if item.sale_item.product.server_id
-                                else item.sale_item.product.id
-                            ),
-                            "quantity": item.quantity,
-                            "return_reason": item.return_reason,
-                            "unit_price": str(item.unit_price),
-                            "total_price": str(item.total_price),
-                        }
-                    )
-
-                returns_data.append(
-                    {
-                        "return_number": return_obj.return_number,
-                        "sale_number": return_obj.sale.sale_number,
-                        "cashier_id": (
-                            return_obj.cashier.server_id
-                            if return_obj.cashier.server_id
-                            else return_obj.cashier.id
-                        ),
-                        "total_return_amount": str(return_obj.total_return_amount),
-                        "notes": return_obj.notes,
-                        "created_at": return_obj.created_at.isoformat(),
-                        "items": items_data,
-                    }
-                )
-
-            print(f"Pushing {len(returns_data)} returns to server...")
-            result = self.api.push_returns(returns_data)
-
-            if result and result.get("success"):
-                with transaction.atomic():
-                    unsynced_returns.update(synced_at=timezone.now())
-
-                    SyncLog.objects.create(
-                        sync_type="push_returns",
-                        status="success",
-                        records_count=len(returns_data),
-                        completed_at=timezone.now(),
-                    )
-
-                print(f"Successfully pushed {len(returns_data)} returns")
-                return True
-            else:
-                print("Failed to push returns to server")
-                SyncLog.objects.create(
-                    sync_type="push_returns",
-                    status="failed",
-                    error_message="Server returned failure",
-                    completed_at=timezone.now(),
-                )
-                return False
+            return True
 
         except Exception as e:
-            print(f"Push returns error: {e}")
+            print(f"Push {label} error: {e}")
             import traceback
 
             traceback.print_exc()
             SyncLog.objects.create(
-                sync_type="push_returns",
+                sync_type=sync_type,
                 status="failed",
                 error_message=str(e),
                 completed_at=timezone.now(),
@@ -539,31 +576,27 @@ class SyncManager:
             if not categories_data:
                 return
 
-            synced_count = 0
-            error_count = 0
-
-            for category_data in categories_data:
-                try:
-                    defaults = {
-                        "name": category_data["name"],
-                        "description": category_data.get("description", ""),
-                        "is_active": category_data["is_active"],
-                        "synced_at": timezone.now(),
-                    }
-
-                    category, created = Category.objects.update_or_create(
-                        server_id=category_data["id"], defaults=defaults
-                    )
-
-                    synced_count += 1
-                    action = "Created" if created else "Updated"
-                    print(f"  {action}: Category {category.name}")
-
-                except Exception as e:
-                    error_count += 1
-                    print(
-                        f"  Error syncing category {category_data.get('name', 'unknown')}: {e}"
-                    )
+            now = timezone.now()
+            categories = [
+                Category(
+                    server_id=category_data["id"],
+                    name=category_data["name"],
+                    description=category_data.get("description", ""),
+                    is_active=category_data["is_active"],
+                    synced_at=now,
+                )
+                for category_data in categories_data
+            ]
+            synced_count, error_count = upsert(
+                Category,
+                categories,
+                ["name", "description", "is_active", "updated_at", "synced_at"],
+            )
+            product_search.refresh(
+                Product.objects.filter(
+                    category__server_id__in=[category.server_id for category in categories]
+                ).values_list("id", flat=True)
+            )
 
             if synced_count > 0:
                 print(f"Synced {synced_count} categories, {error_count} errors")
@@ -579,31 +612,27 @@ class SyncManager:
             if not brands_data:
                 return
 
-            synced_count = 0
-            error_count = 0
-
-            for brand_data in brands_data:
-                try:
-                    defaults = {
-                        "name": brand_data["name"],
-                        "description": brand_data.get("description", ""),
-                        "is_active": brand_data["is_active"],
-                        "synced_at": timezone.now(),
-                    }
-
-                    brand, created = Brand.objects.update_or_create(
-                        server_id=brand_data["id"], defaults=defaults
-                    )
-
-                    synced_count += 1
-                    action = "Created" if created else "Updated"
-                    print(f"  {action}: Brand {brand.name}")
-
-                except Exception as e:
-                    error_count += 1
-                    print(
-                        f"  Error syncing brand {brand_data.get('name', 'unknown')}: {e}"
-                    )
+            now = timezone.now()
+            brands = [
+                Brand(
+                    server_id=brand_data["id"],
+                    name=brand_data["name"],
+                    description=brand_data.get("description", ""),
+                    is_active=brand_data["is_active"],
+                    synced_at=now,
+                )
+                for brand_data in brands_data
+            ]
+            synced_count, error_count = upsert(
+                Brand,
+                brands,
+                ["name", "description", "is_active", "updated_at", "synced_at"],
+            )
+            product_search.refresh(
+                Product.objects.filter(
+                    brand__server_id__in=[brand.server_id for brand in brands]
+                ).values_list("id", flat=True)
+            )
 
             if synced_count > 0:
                 print(f"Synced {synced_count} brands, {error_count} errors")
@@ -614,122 +643,113 @@ class SyncManager:
             traceback.print_exc()
             raise
 
+    def _unsynced_stock(self, product_ids):
+        """Units sold and returned locally but not yet pushed, per product."""
+        sold = {}
+        returned = {}
+        for chunk in chunked(product_ids):
+            sold.update(
+                SaleItem.objects.filter(
+                    product_id__in=chunk,
+                    sale__synced_at__isnull=True,
+                    sale__completed_at__isnull=False,
+                )
+                .values_list("product_id")
+                .annotate(total=Sum("quantity"))
+            )
+            returned.update(
+                ReturnItem.objects.filter(
+                    sale_item__product_id__in=chunk,
+                    return_fk__synced_at__isnull=True,
+                )
+                .values_list("sale_item__product_id")
+                .annotate(total=Sum("quantity"))
+            )
+        return sold, returned
+
     def _sync_products(self, products_data, update_mode=False):
         try:
             if not products_data:
                 return
 
-            synced_count = 0
-            error_count = 0
+            now = timezone.now()
+            category_map = server_id_map(
+                Category, [p.get("category_id") for p in products_data]
+            )
+            brand_map = server_id_map(Brand, [p.get("brand_id") for p in products_data])
+            existing = server_id_map(
+                Product, [p["id"] for p in products_data], "quantity", "sold_count"
+            )
 
-            for product_data in products_data:
-                try:
-                    existing_product = Product.objects.filter(
-                        server_id=product_data["id"]
-                    ).first()
-
-                    category = None
-                    if product_data.get("category_id"):
-                        category = Category.objects.filter(
-                            server_id=product_data["category_id"]
-                        ).first()
-
-                    brand = None
-                    if product_data.get("brand_id"):
-                        brand = Brand.objects.filter(
-                            server_id=product_data["brand_id"]
-                        ).first()
-
-                    defaults = {
-                        "name": product_data["name"],
-                        "description": product_data.get("description", ""),
-                        "category": category,
-                        "brand": brand,
-                        "slug": product_data["slug"],
-                        "sku": product_data["sku"],
-                        "cost_price": product_data["cost_price"],
-                        "selling_price": product_data["selling_price"],
-                        "wholesale_price": product_data.get("wholesale_price"),
-                        "special_price": product_data["special_price"],
-                        "quantity": product_data["quantity"],
-                        "low_stock_threshold": product_data["low_stock_threshold"],
-                        "weight": product_data.get("weight"),
-                        "sold_count": product_data["sold_count"],
-                        "is_active": product_data["is_active"],
-                        "synced_at": timezone.now(),
-                    }
-
-                    if update_mode and existing_product:
-                        if existing_product.quantity != product_data["quantity"]:
-                            print(
-                                f"  Stock conflict for {product_data['name']}: Local={existing_product.quantity}, Server={product_data['quantity']}"
-                            )
-
-                            unsynced_sales_qty = (
-                                SaleItem.objects.filter(
-                                    product=existing_product,
-                                    sale__synced_at__isnull=True,
-                                    sale__completed_at__isnull=False,
-                                ).aggregate(total=models.Sum("quantity"))["total"]
-                                or 0
-                            )
-
-                            unsynced_returns_qty = (
-                                ReturnItem.objects.filter(
-                                    sale_item__product=existing_product,
-                                    return_fk__synced_at__isnull=True,
-                                ).aggregate(total=models.Sum("quantity"))["total"]
-                                or 0
-                            )
-
-                            expected_local = (
-                                product_data["quantity"]
-                                - unsynced_sales_qty
-                                + unsynced_returns_qty
-                            )
-
-                            if existing_product.quantity == expected_local:
-                                print(
-                                    f"    Stock matches (accounting for unsynced transactions)"
-                                )
-                                defaults["quantity"] = existing_product.quantity
-                                defaults["sold_count"] = existing_product.sold_count
-                            else:
-                                print(f"    WARNING: Unexplained stock difference!")
-                                print(
-                                    f"    Expected: {expected_local}, Actual: {existing_product.quantity}"
-                                )
-                                print(
-                                    f"    Using server stock: {product_data['quantity']}"
-                                )
-
-                    product, created = Product.objects.update_or_create(
-                        server_id=product_data["id"], defaults=defaults
+            keep_local = set()
+            if update_mode:
+                conflicts = {
+                    product_data["id"]: product_data
+                    for product_data in products_data
+                    if product_data["id"] in existing
+                    and existing[product_data["id"]][1] != product_data["quantity"]
+                }
+                sold, returned = self._unsynced_stock(
+                    [existing[server_id][0] for server_id in conflicts]
+                )
+
+                for server_id, product_data in conflicts.items():
+                    pk, local_quantity, _ = existing[server_id]
+                    print(
+                        f"  Stock conflict for {product_data['name']}: Local={local_quantity}, Server={product_data['quantity']}"
                     )
 
-                    for barcode_data in product_data.get("barcodes", []):
-                        Barcode.objects.update_or_create(
-                            server_id=barcode_data["id"],
-                            defaults={
-                                "barcode": barcode_data["barcode"],
-                                "product": product,
-                                "is_active": barcode_data["is_active"],
-                                "synced_at": timezone.now(),
-                            },
-                        )
+                    expected_local = (
+                        product_data["quantity"]
+                        - sold.get(pk, 0)
+                        + returned.get(pk, 0)
+                    )
 
-                    synced_count += 1
-                    action = "Created" if created else "Updated"
-                    print(f"  {action}: Product {product.name}")
+                    if local_quantity == expected_local:
+                        print(
+                            f"    Stock matches (accounting for unsynced transactions)"
+                        )
+                        keep_local.add(server_id)
+                    else:
+                        print(f"    WARNING: Unexplained stock difference!")
+                        print(
+                            f"    Expected: {expected_local}, Actual: {local_quantity}"
+                        )
+                        print(f"    Using server stock: {product_data['quantity']}")
 
-                except Exception as e:
-                    error_count += 1
-                    print(
-                        f"  Error syncing product {product_data.get('name', 'unknown')}: {e}"
+            products = []
+            for product_data in products_data:
+                server_id = product_data["id"]
+                if server_id in keep_local:
+                    _, quantity, sold_count = existing[server_id]
+                else:
+                    quantity = product_data["quantity"]
+                    sold_count = product_data["sold_count"]
+
+                products.append(
+                    Product(
+                        server_id=server_id,
+                        name=product_data["name"].title(),
+                        description=product_data.get("description", ""),
+                        category_id=category_map.get(product_data.get("category_id")),
+                        brand_id=brand_map.get(product_data.get("brand_id")),
+                        slug=product_data["slug"],
+                        sku=product_data["sku"],
+                        cost_price=product_data["cost_price"],
+                        selling_price=product_data["selling_price"],
+                        wholesale_price=product_data.get("wholesale_price"),
+                        special_price=product_data["special_price"],
+                        quantity=quantity,
+                        low_stock_threshold=product_data["low_stock_threshold"],
+                        weight=product_data.get("weight"),
+                        sold_count=sold_count,
+                        is_active=product_data["is_active"],
+                        synced_at=now,
                     )
-                    import traceback
+                )
 
-                    traceback.print_exc()
+            synced_count, error_count = upsert(Product, products, PRODUCT_SYNC_FIELDS)
+            self._sync_barcodes(products_data, now)
 
             if synced_count > 0:
                 print(f"Synced {synced_count} products, {error_count} errors")
@@ -740,49 +760,107 @@ class SyncManager:
             traceback.print_exc()
             raise
 
+    def _sync_barcodes(self, products_data, now):
+        product_map = server_id_map(Product, [p["id"] for p in products_data])
+
+        barcodes = []
+        for product_data in products_data:
+            product_id = product_map.get(product_data["id"])
+            if product_id is None:
+                continue
+            for barcode_data in product_data.get("barcodes", []):
+                barcodes.append(
+                    Barcode(
+                        server_id=barcode_data["id"],
+                        barcode=barcode_data["barcode"],
+                        product_id=product_id,
+                        is_active=barcode_data["is_active"],
+                        synced_at=now,
+                    )
+                )
+
+        upsert(Barcode, barcodes, ["barcode", "product", "is_active", "synced_at"])
+
+        # Barcodes deleted on the server are no longer in the payload
+        barcode_ids = {barcode.server_id for barcode in barcodes}
+        for chunk in chunked(product_map.values()):
+            stale = Barcode.objects.filter(
+                product_id__in=chunk, server_id__isnull=False, is_active=True
+            ).values_list("id", "server_id")
+            stale_ids = [pk for pk, server_id in stale if server_id not in barcode_ids]
+            if stale_ids:
+                Barcode.objects.filter(id__in=stale_ids).update(is_active=False)
+
+        # Bulk writes skip the model signals that keep the scan and search
+        # indexes current
+        for product_id in product_map.values():
+            product_index.discard_product(product_id)
+        product_search.refresh(product_map.values())
+
+    def _apply_deletions(self, deleted):
+        """Deactivate rows the server deleted; local sales still reference them."""
+        count = 0
+        for key, model in (
+            ("categories", Category),
+            ("brands", Brand),
+            ("products", Product),
+            ("users", User),
+        ):
+            server_ids = deleted.get(key)
+            if not server_ids:
+                continue
+
+            for obj in model.objects.filter(server_id__in=server_ids, is_active=True):
+                obj.is_active = False
+                obj.synced_at = timezone.now()
+                obj.save(update_fields=["is_active", "synced_at"])
+                print(f"  Deactivated: {obj}")
+                count += 1
+        return count
+
     def _sync_users(self, users_data):
         try:
             if not users_data:
                 return
 
-            synced_count = 0
-            error_count = 0
+            now = timezone.now()
+            existing = server_id_map(User, [u["id"] for u in users_data])
 
+            with_password = []
+            without_password = []
             for user_data in users_data:
-                try:
-                    defaults = {
-                        "username": user_data["username"],
-                        "email": user_data.get("email", ""),
-                        "first_name": user_data.get("first_name", ""),
-                        "last_name": user_data.get("last_name", ""),
-                        "role": user_data["role"],
-                        "phone_number": user_data.get("phone_number", ""),
-                        "is_active": user_data["is_active"],
-                        "is_staff": user_data.get("is_staff", False),
-                        "is_superuser": user_data.get("is_superuser", False),
-                        "synced_at": timezone.now(),
-                    }
-
-                    if "password" in user_data and user_data["password"]:
-                        defaults["password"] = user_data["password"]
-
-                    user, created = User.objects.update_or_create(
-                        server_id=user_data["id"], defaults=defaults
-                    )
-
-                    if created and not user.has_usable_password():
-                        user.set_password("changeme123")
-                        user.save()
+                user = User(
+                    server_id=user_data["id"],
+                    username=user_data["username"],
+                    email=user_data.get("email", ""),
+                    first_name=user_data.get("first_name", ""),
+                    last_name=user_data.get("last_name", ""),
+                    role=user_data["role"],
+                    phone_number=user_data.get("phone_number", ""),
+                    is_active=user_data["is_active"],
+                    is_staff=user_data.get("is_staff", False),
+                    is_superuser=user_data.get("is_superuser", False),
+                    synced_at=now,
+                )
 
-                    synced_count += 1
-                    action = "Created" if created else "Updated"
-                    print(f"  {action}: {user.username}")
+                if "password" in user_data and user_data["password"]:
+                    user.password = user_data["password"]
+                    with_password.append(user)
+                elif user_data["id"] not in existing:
+                    user.set_password("changeme123")
+                    with_password.append(user)
+                else:
+                    without_password.append(user)
 
-                except Exception as e:
-                    error_count += 1
-                    print(
-                        f"  Error syncing user {user_data.get('username', 'unknown')}: {e}"
-                    )
+            synced_count = 0
+            error_count = 0
+            for users, fields in (
+                (with_password, USER_SYNC_FIELDS + ["password"]),
+                (without_password, USER_SYNC_FIELDS),
+            ):
+                synced, errors = upsert(User, users, fields)
+                synced_count += synced
+                error_count += errors
 
             if synced_count > 0:
                 print(f"Synced {synced_count} users, {error_count} errors")
@@ -1,3 +1,1200 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import requests
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from products.models import Barcode, Brand, Category, Product, StockMovement
+from sales.models import Return, ReturnItem, Sale, SaleItem
+from sales.tests import ReturnFixture
+from users.models import User
+from .api_client import ServerAPI
+from .background_sync import BackgroundSync
+from .ingest import ingest_sales
+from .outbox import backfill
+from .changelog import changes_since, current_cursor, record_change, record_changes
+from .models import (
+    ChangeLog,
+    Outbox,
+    SyncCursor,
+    SyncDeadLetter,
+    SyncLog,
+    Terminal,
+)
+from .sync_manager import CHANGES_CURSOR, INITIAL_AFTER, INITIAL_STAGE, SyncManager
+from .upsert import CHUNK_SIZE
+from .views import (
+    keyset_pages,
+    parse_cursor,
+    pull_returns_lines,
+    pull_sales_lines,
+    sync_status,
+)
 
-# Create your tests here.
+
+class TerminalRegistrationTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=100,
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.cashier)
+
+    def register(self, store_id, install_key):
+        return self.api.post(
+            "/api/sync/register_terminal/",
+            {"store_id": store_id, "install_key": install_key},
+            format="json",
+        )
+
+    def push(self, store_id, install_key, final_amount="20.00"):
+        sale = {
+            "sale_number": "SALE-20260101-7-0001",
+            "sale_type": "RETAIL",
+            "cashier_id": self.cashier.id,
+            "total_amount": final_amount,
+            "discount_amount": "0",
+            "final_amount": final_amount,
+            "payment_method": "cash",
+            "completed_at": timezone.now().isoformat(),
+            "items": [
+                {
+                    "product_id": self.product.id,
+                    "quantity": 1,
+                    "unit_price": final_amount,
+                    "total_amount": final_amount,
+                }
+            ],
+        }
+        return self.api.post(
+            "/api/sync/push_sales/",
+            {"store_id": store_id, "install_key": install_key, "sales": [sale]},
+            format="json",
+        )
+
+    def test_first_install_owns_the_store_id(self):
+        self.assertEqual(self.register("7", "till-a").status_code, 200)
+        self.assertEqual(self.register("7", "till-a").status_code, 200)
+        self.assertEqual(self.register("7", "till-b").status_code, 409)
+        self.assertEqual(Terminal.objects.get(store_id="7").install_key, "till-a")
+
+    def test_invalid_and_server_store_ids_are_refused(self):
+        self.assertEqual(self.register("7-1", "till-a").status_code, 400)
+        self.assertEqual(self.register("7", "").status_code, 400)
+        self.assertEqual(self.register(settings.STORE_ID, "till-a").status_code, 409)
+
+    def test_push_needs_a_registered_install(self):
+        self.assertEqual(self.push("7", "till-a").status_code, 403)
+        self.register("7", "till-a")
+        self.assertEqual(self.push("7", "till-b").status_code, 403)
+        self.assertEqual(self.push("7", "till-a").json()["synced_count"], 1)
+
+    def test_other_store_cannot_overwrite_a_sale(self):
+        self.register("7", "till-a")
+        self.register("8", "till-b")
+        self.push("7", "till-a")
+
+        response = self.push("8", "till-b", final_amount="99.00").json()
+        self.assertEqual(response["accepted"], [])
+        self.assertIn("belongs to store 7", response["errors"][0]["error"])
+
+        sale = Sale.objects.get(sale_number="SALE-20260101-7-0001")
+        self.assertEqual((sale.store_id, sale.final_amount), ("7", Decimal("20.00")))
+
+        # The owning store may still re-push its own sale
+        response = self.push("7", "till-a", final_amount="25.00").json()
+        self.assertEqual(response["accepted"], ["SALE-20260101-7-0001"])
+
+
+class IngestSalesTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=100,
+        )
+
+    def sale(self, n, **fields):
+        return {
+            "sale_number": f"SALE-20260101-7-{n:04d}",
+            "sale_type": "RETAIL",
+            "cashier_id": self.cashier.id,
+            "total_amount": "20.00",
+            "final_amount": "20.00",
+            "payment_method": "cash",
+            "completed_at": timezone.now().isoformat(),
+            "items": [
+                {
+                    "product_id": self.product.id,
+                    "quantity": 1,
+                    "unit_price": "20.00",
+                    "total_amount": "20.00",
+                }
+            ],
+            **fields,
+        }
+
+    def test_sales_are_stored_in_batches(self):
+        sales = [self.sale(n) for n in range(1, 6)]
+
+        batches = ingest_sales(sales, batch_size=2, store_id="7")
+
+        self.assertEqual(
+            [batch["accepted"] for batch in batches],
+            [
+                [sales[0]["sale_number"], sales[1]["sale_number"]],
+                [sales[2]["sale_number"], sales[3]["sale_number"]],
+                [sales[4]["sale_number"]],
+            ],
+        )
+        self.assertEqual(Sale.objects.filter(store_id="7").count(), 5)
+        self.assertEqual(SaleItem.objects.count(), 5)
+
+    def test_batch_queries_do_not_grow_with_sales(self):
+        def ingest(first, count):
+            sales = [self.sale(n) for n in range(first, first + count)]
+            with CaptureQueriesContext(connection) as queries:
+                ingest_sales(sales, batch_size=count, store_id="7")
+            return len(queries)
+
+        # The first sale creates the rollup rows the others then update
+        ingest(1, 1)
+        self.assertEqual(ingest(10, 2), ingest(100, 20))
+
+    def test_a_rejected_sale_falls_back_to_one_by_one(self):
+        sales = [self.sale(1), self.sale(2, total_amount=None), self.sale(3)]
+
+        with self.assertLogs("sync.ingest", "WARNING") as logs:
+            batches = ingest_sales(sales, batch_size=10)
+
+        self.assertIn("retrying one by one", logs.output[0])
+        self.assertEqual(
+            batches[0]["accepted"], [sales[0]["sale_number"], sales[2]["sale_number"]]
+        )
+        self.assertEqual(
+            [error["sale"] for error in batches[0]["errors"]], [sales[1]["sale_number"]]
+        )
+        self.assertEqual(Sale.objects.count(), 2)
+
+    def test_push_acknowledges_accepted_and_rejected_sales(self):
+        Terminal.register("7", "till-a")
+        api = APIClient()
+        api.force_authenticate(self.cashier)
+        sales = [self.sale(1), self.sale(2, cashier_id=999)]
+
+        with self.assertLogs("sync.ingest", "WARNING"):
+            response = api.post(
+                "/api/sync/push_sales/",
+                {"store_id": "7", "install_key": "till-a", "sales": sales},
+                format="json",
+            ).json()
+
+        self.assertEqual(response["accepted"], [sales[0]["sale_number"]])
+        self.assertEqual(
+            response["errors"],
+            [{"sale": sales[1]["sale_number"], "error": "Cashier not found: 999"}],
+        )
+        self.assertEqual((response["synced_count"], response["error_count"]), (1, 1))
+
+
+class OutboxPushTests(TestCase):
+    def setUp(self):
+        self.manager = SyncManager()
+        self.batches = []
+        self.rejected = set()
+        for n in range(1, 6):
+            Outbox.enqueue("sale", f"S{n}", n, {"sale_number": f"S{n}"})
+
+    def send(self, payloads):
+        keys = [payload["sale_number"] for payload in payloads]
+        self.batches.append(keys)
+        return {
+            "success": True,
+            "accepted": [key for key in keys if key not in self.rejected],
+            "errors": [
+                {"sale": key, "error": "Cashier not found: 9"}
+                for key in keys
+                if key in self.rejected
+            ],
+        }
+
+    def push(self):
+        return self.manager._push_outbox("sale", self.send, "push_sales", Sale)
+
+    def queued(self):
+        return list(Outbox.objects.values_list("key", "attempts"))
+
+    @override_settings(SYNC_PUSH_BATCH_SIZE=2)
+    def test_outbox_is_pushed_in_batches(self):
+        self.assertTrue(self.push())
+
+        self.assertEqual(self.batches, [["S1", "S2"], ["S3", "S4"], ["S5"]])
+        self.assertEqual(self.queued(), [])
+
+    def test_only_accepted_entries_leave_the_outbox(self):
+        self.rejected = {"S2", "S4"}
+
+        self.assertTrue(self.push())
+
+        self.assertEqual(self.queued(), [("S2", 1), ("S4", 1)])
+        entry = Outbox.objects.get(key="S2")
+        self.assertEqual(entry.last_error, "Cashier not found: 9")
+        log = SyncLog.objects.get(sync_type="push_sales")
+        self.assertEqual(
+            (log.records_count, log.error_message), (3, "2 sales rejected")
+        )
+
+    def test_entry_changed_during_the_push_stays_queued(self):
+        send = self.send
+
+        def send_and_change(payloads):
+            # The sale is queued again while its old payload is on the wire
+            Outbox.enqueue("sale", "S2", 2, {"sale_number": "S2", "notes": "x"})
+            return send(payloads)
+
+        self.send = send_and_change
+        self.assertTrue(self.push())
+
+        self.assertEqual(self.queued(), [("S2", 0)])
+        entry = Outbox.objects.get(key="S2")
+        self.assertEqual(entry.payload, {"sale_number": "S2", "notes": "x"})
+
+    def test_entries_are_parked_after_the_retry_limit(self):
+        self.rejected = {"S2"}
+
+        for attempt in range(1, Outbox.MAX_ATTEMPTS):
+            self.push()
+            self.assertEqual(self.queued(), [("S2", attempt)])
+        self.assertFalse(SyncDeadLetter.objects.exists())
+
+        self.push()
+
+        self.assertEqual(self.queued(), [])
+        parked = SyncDeadLetter.objects.get()
+        self.assertEqual(
+            (parked.kind, parked.key, parked.attempts),
+            ("sale", "S2", Outbox.MAX_ATTEMPTS),
+        )
+        self.assertEqual(parked.payload, {"sale_number": "S2"})
+
+
+def fake_stage(manager, reached, result=True):
+    def stage():
+        manager.api.reachable = reached
+        return result
+
+    return stage
+
+
+class SyncCycleTests(TestCase):
+    def setUp(self):
+        self.service = BackgroundSync()
+        self.service.sync_manager = SyncManager()
+        self.service.pull_manager = SyncManager()
+        self.service.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.service.executor.shutdown)
+
+    def stages(self, manager, names, reached, result=True):
+        for name in names:
+            setattr(manager, name, fake_stage(manager, reached, result))
+
+    def test_chains_use_their_own_client(self):
+        self.assertIsNot(
+            self.service.sync_manager.api, self.service.pull_manager.api
+        )
+
+    def test_unreachable_pull_chain_marks_the_cycle_unreachable(self):
+        push = ["push_sales_to_server", "push_returns_to_server"]
+        pull = [
+            "pull_from_server",
+            "pull_sales_from_server",
+            "pull_returns_from_server",
+        ]
+        self.stages(self.service.sync_manager, push, True)
+        self.stages(self.service.pull_manager, pull, False, result=False)
+
+        self.assertEqual(self.service.run_cycle(), (False, []))
+
+    def test_failed_stage_is_reported_while_reachable(self):
+        push = ["push_sales_to_server", "push_returns_to_server"]
+        pull = ["pull_from_server", "pull_returns_from_server"]
+        self.stages(self.service.sync_manager, push, True)
+        self.stages(self.service.pull_manager, pull, True)
+        self.stages(
+            self.service.pull_manager, ["pull_sales_from_server"], True, False
+        )
+
+        self.assertEqual(self.service.run_cycle(), (True, ["pull sales"]))
+
+
+@override_settings(IS_DESKTOP=True)
+class OutboxEnqueueTests(ReturnFixture, TestCase):
+    def queued(self):
+        return list(Outbox.objects.values_list("kind", "key"))
+
+    def test_completed_sale_and_return_are_queued(self):
+        sale = self.completed_sale()
+        self.assertEqual(self.queued(), [("sale", sale.sale_number)])
+
+        self.confirm(self.till(sale))
+
+        return_obj = Return.objects.get()
+        self.assertEqual(self.queued()[1], ("return", return_obj.return_number))
+        entry = Outbox.objects.get(kind="return")
+        self.assertEqual(entry.object_id, return_obj.pk)
+        self.assertEqual(entry.payload["sale_number"], sale.sale_number)
+
+    def test_open_sale_is_not_queued(self):
+        sale = Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+        sale.save()
+
+        self.assertEqual(self.queued(), [])
+
+    def test_edit_before_push_updates_the_queued_payload(self):
+        sale = self.completed_sale()
+        sale.notes = "Paid by card"
+        sale.save()
+
+        entry = Outbox.objects.get()
+        self.assertEqual(entry.payload["notes"], "Paid by card")
+
+    @override_settings(IS_DESKTOP=False)
+    def test_server_does_not_queue(self):
+        sale = self.completed_sale()
+        self.confirm(self.till(sale))
+
+        self.assertTrue(Return.objects.exists())
+        self.assertEqual(self.queued(), [])
+
+    def test_backfill_queues_unsynced_work_once(self):
+        with override_settings(IS_DESKTOP=False):
+            pending = self.completed_sale()
+            synced = self.completed_sale()
+            parked = self.completed_sale()
+            self.confirm(self.till(pending))
+        Sale.objects.filter(pk=synced.pk).update(synced_at=timezone.now())
+        SyncDeadLetter.objects.create(kind="sale", key=parked.sale_number)
+        Sale.objects.create(cashier=self.cashier, sale_type="RETAIL")
+
+        self.assertEqual(backfill(), 2)
+        self.assertEqual(
+            self.queued(),
+            [
+                ("sale", pending.sale_number),
+                ("return", Return.objects.get().return_number),
+            ],
+        )
+        self.assertEqual(backfill(), 0)
+
+    @override_settings(IS_DESKTOP=False)
+    def test_backfill_is_a_no_op_on_the_server(self):
+        self.completed_sale()
+
+        self.assertEqual(backfill(), 0)
+        self.assertEqual(self.queued(), [])
+
+    def test_sync_status_counts_queued_and_parked_work(self):
+        first = self.completed_sale()
+        self.completed_sale()
+        self.confirm(self.till(first))
+        Outbox.objects.filter(key=first.sale_number).delete()
+        Sale.objects.filter(pk=first.pk).update(synced_at=timezone.now())
+        SyncDeadLetter.objects.create(kind="return", key="RET-X")
+        Outbox.objects.filter(kind="return").delete()
+
+        request = RequestFactory().get("/")
+        request.user = User.objects.create_user(
+            "boss", email="boss@example.com", password="x", is_staff=True
+        )
+        with mock.patch.object(ServerAPI, "test_connection", return_value=False):
+            status = json.loads(sync_status(request).content)
+
+        self.assertEqual(status["unsynced"], {"sales": 1, "returns": 1})
+        self.assertEqual(
+            (status["sales_stats"]["total"], status["sales_stats"]["synced"]), (2, 1)
+        )
+        self.assertEqual(
+            (status["returns_stats"]["total"], status["returns_stats"]["synced"]),
+            (1, 0),
+        )
+        self.assertEqual(status["dead_letters"], 1)
+
+
+class PushRequestTests(TestCase):
+    def test_completed_sale_requests_a_push_once_committed(self):
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        product = Product.objects.create(
+            name="Soda",
+            cost_price=Decimal("10.00"),
+            selling_price=Decimal("20.00"),
+            special_price=Decimal("12.00"),
+            quantity=10,
+        )
+        sale = Sale.objects.create(cashier=cashier, sale_type="RETAIL")
+        SaleItem.objects.create(
+            sale=sale, product=product, quantity=1, unit_price=Decimal("20.00")
+        )
+
+        with mock.patch("sync.background_sync.request_push") as request_push:
+            with self.captureOnCommitCallbacks() as callbacks:
+                sale.complete_sale()
+            request_push.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+        request_push.assert_called_once_with()
+
+    def test_notify_is_ignored_when_not_running(self):
+        service = BackgroundSync()
+        service.notify()
+
+        self.assertFalse(service.push_requested)
+        self.assertFalse(service.wakeup.is_set())
+
+    def test_burst_of_requests_is_pushed_once_after_the_debounce(self):
+        service = BackgroundSync(interval=30, debounce=0.3)
+        service.sync_manager = mock.Mock()
+        service.initial_sync_done = True
+        service.running = True
+        pushes = []
+        pushed = threading.Event()
+
+        def push_pending():
+            pushes.append(time.monotonic())
+            pushed.set()
+
+        service.push_pending = push_pending
+        with mock.patch("sync.outbox.backfill"):
+            service.thread = threading.Thread(target=service._sync_loop)
+            service.thread.start()
+            self.addCleanup(service.stop)
+
+            notified = time.monotonic()
+            for _ in range(5):
+                service.notify()
+            self.assertTrue(pushed.wait(5))
+            time.sleep(0.5)
+
+        self.assertEqual(len(pushes), 1)
+        self.assertGreaterEqual(pushes[0] - notified, 0.3)
+
+
+class SyncApiMiddlewareTests(TestCase):
+    def setUp(self):
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.token = Token.objects.create(user=cashier).key
+
+    def post(self, body, token=None):
+        return self.client.post(
+            "/api/sync/register_terminal/",
+            body,
+            content_type="application/json",
+            HTTP_CONTENT_ENCODING="gzip",
+            HTTP_AUTHORIZATION=f"Token {token or self.token}",
+        )
+
+    def registration(self, **extra):
+        payload = {"store_id": "7", "install_key": "till-a", **extra}
+        return gzip.compress(json.dumps(payload).encode())
+
+    def test_gzip_body_is_decompressed(self):
+        response = self.post(self.registration())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Terminal.objects.filter(store_id="7").exists())
+
+    def test_invalid_gzip_is_refused(self):
+        self.assertEqual(self.post(b"not gzip").status_code, 400)
+        self.assertEqual(self.post(self.registration()[:-8]).status_code, 400)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10_000)
+    def test_oversized_body_is_refused_while_decompressing(self):
+        body = self.registration(padding="x" * 1_000_000)
+        self.assertLess(len(body), 10_000)
+
+        self.assertEqual(self.post(body).status_code, 413)
+
+    def test_body_is_not_decompressed_without_a_valid_token(self):
+        with mock.patch("sync.middleware.gunzip") as gunzip:
+            response = self.post(self.registration(), token="bogus")
+
+        self.assertEqual(response.status_code, 401)
+        gunzip.assert_not_called()
+
+    def test_unchanged_pull_is_answered_with_304(self):
+        headers = {"HTTP_AUTHORIZATION": f"Token {self.token}"}
+        path = "/api/sync/pull_changes/?cursor=0"
+
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+
+@override_settings(IS_DESKTOP=False)
+class ChangeLogTests(TestCase):
+    def test_changes_are_served_as_soon_as_they_commit(self):
+        record_change("product", 1)
+        record_changes("product", [2, 3])
+        record_change("product", 2, action="delete")
+
+        changes, cursor, has_more = changes_since(0)
+
+        self.assertEqual(changes, {"product": {1: "upsert", 2: "delete", 3: "upsert"}})
+        self.assertEqual(cursor, current_cursor())
+        self.assertFalse(has_more)
+        self.assertEqual(changes_since(cursor), ({}, cursor, False))
+
+    def test_rolled_back_ids_do_not_stall_the_cursor(self):
+        record_changes("product", [1, 2, 3])
+        first, gap, last = ChangeLog.objects.order_by("id").values_list("id", flat=True)
+        ChangeLog.objects.filter(id=gap).delete()
+
+        changes, cursor, _ = changes_since(0)
+
+        self.assertEqual(changes, {"product": {1: "upsert", 3: "upsert"}})
+        self.assertEqual(cursor, last)
+
+    def test_pages(self):
+        record_changes("product", range(1, 6))
+
+        changes, cursor, has_more = changes_since(0, limit=3)
+        self.assertEqual(sorted(changes["product"]), [1, 2, 3])
+        self.assertTrue(has_more)
+
+        changes, cursor, has_more = changes_since(cursor, limit=3)
+        self.assertEqual(sorted(changes["product"]), [4, 5])
+        self.assertFalse(has_more)
+
+    def test_changes_applied_by_every_terminal_are_pruned(self):
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        api = APIClient()
+        api.force_authenticate(cashier)
+        Terminal.register("7", "till-a")
+        Terminal.register("8", "till-b")
+        record_changes("product", range(1, 6))
+        ids = list(ChangeLog.objects.values_list("id", flat=True))
+
+        def pull(store_id, cursor):
+            return api.get(
+                "/api/sync/pull_changes/", {"cursor": cursor, "store_id": store_id}
+            )
+
+        # Store 8 has not pulled yet, so nothing can go
+        pull("7", ids[-1])
+        self.assertEqual(ChangeLog.objects.count(), len(ids))
+
+        pull("8", ids[1])
+        self.assertEqual(
+            list(ChangeLog.objects.values_list("id", flat=True)), ids[2:]
+        )
+
+        # An old cursor replayed does not move a terminal back
+        pull("7", ids[0])
+        self.assertEqual(Terminal.objects.get(store_id="7").change_cursor, ids[-1])
+        self.assertEqual(pull("8", ids[1]).json()["cursor"], ids[-1])
+
+
+def server_products(count, quantity=100):
+    """A pull payload of count products, as the server serialises them."""
+    return [
+        {
+            "id": i,
+            "name": f"product {i}",
+            "description": "",
+            "category_id": 1,
+            "brand_id": 1,
+            "slug": f"product-{i}",
+            "sku": f"S{i:07d}",
+            "cost_price": "10.00",
+            "selling_price": "20.00",
+            "wholesale_price": "15.00",
+            "special_price": "12.00",
+            "quantity": quantity,
+            "low_stock_threshold": 5,
+            "weight": None,
+            "sold_count": 0,
+            "is_active": True,
+            "barcodes": [{"id": i, "barcode": f"7{i:011d}0", "is_active": True}],
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+class ProductPullFixture:
+    def setUp(self):
+        Category.objects.create(name="Drinks", server_id=1)
+        Brand.objects.create(name="Acme", server_id=1)
+        self.manager = SyncManager()
+
+    def pull(self, products_data, update_mode=False):
+        with CaptureQueriesContext(connection) as queries:
+            self.manager._sync_products(products_data, update_mode=update_mode)
+        return len(queries)
+
+
+class ProductPullTests(ProductPullFixture, TestCase):
+    SIZE = 1_000
+
+    def test_initial_pull(self):
+        query_count = self.pull(server_products(self.SIZE))
+
+        # Rows go in batches (SQLite caps the parameters per statement),
+        # so far fewer statements than products
+        self.assertLess(query_count, self.SIZE / 10)
+        self.assertEqual(Product.objects.count(), self.SIZE)
+        self.assertEqual(Barcode.objects.count(), self.SIZE)
+        product = Product.objects.get(server_id=42)
+        self.assertEqual(product.name, "Product 42")
+        self.assertEqual(product.category.server_id, 1)
+
+    def test_stock_conflicts_are_resolved_in_bulk(self):
+        self.pull(server_products(CHUNK_SIZE))
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        # An unpushed local sale explains the difference for the first product
+        product = Product.objects.get(server_id=1)
+        sale = Sale.objects.create(cashier=cashier, sale_type="RETAIL")
+        sale.items.create(product=product, quantity=3, unit_price=Decimal("20.00"))
+        sale.complete_sale()
+
+        # The server has not seen the sale yet, and restocked every other product
+        payload = server_products(CHUNK_SIZE, quantity=120)
+        payload[0]["quantity"] = 100
+        query_count = self.pull(payload, update_mode=True)
+
+        self.assertEqual(Product.objects.get(server_id=1).quantity, 97)
+        self.assertEqual(Product.objects.get(server_id=2).quantity, 120)
+        # Two grouped queries cover the unsynced stock of every conflict
+        self.assertLess(query_count, CHUNK_SIZE / 10)
+
+
+@mock.patch("sync.views.INITIAL_CHUNK_SIZE", 2)
+class InitialSyncStreamTests(TestCase):
+    def setUp(self):
+        cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(cashier)
+        for n in range(3):
+            Category.objects.create(name=f"Category {n}")
+        Category.objects.create(name="Retired", is_active=False)
+        for n in range(2):
+            Brand.objects.create(name=f"Brand {n}")
+        for n in range(5):
+            Product.objects.create(
+                name=f"Product {n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+            )
+
+    def stream(self, **params):
+        response = self.api.get("/api/sync/initial_sync_stream/", params)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        body = b"".join(response.streaming_content)
+        return [json.loads(line) for line in body.splitlines() if line]
+
+    def rows(self, chunks):
+        return [
+            (chunk["entity"], row["id"]) for chunk in chunks for row in chunk["rows"]
+        ]
+
+    def test_every_active_row_is_sent_once(self):
+        messages = self.stream()
+
+        self.assertEqual(messages[0]["type"], "start")
+        self.assertEqual(messages[-1], {"type": "end"})
+        chunks = messages[1:-1]
+        self.assertTrue(all(len(chunk["rows"]) <= 2 for chunk in chunks))
+
+        rows = self.rows(chunks)
+        self.assertEqual(len(rows), len(set(rows)))
+        self.assertEqual(
+            sorted(pk for entity, pk in rows if entity == "categories"),
+            sorted(
+                Category.objects.filter(is_active=True).values_list("id", flat=True)
+            ),
+        )
+        self.assertEqual(len([1 for entity, _ in rows if entity == "products"]), 5)
+
+    def test_resume_after_the_last_committed_chunk(self):
+        chunks = self.stream()[1:-1]
+
+        for cut in range(len(chunks)):
+            committed = chunks[: cut + 1]
+            last = committed[-1]
+            resumed = self.stream(stage=last["stage"], after=last["last"])
+            self.assertEqual(resumed[-1], {"type": "end"})
+
+            # Nothing sent twice, nothing skipped
+            self.assertEqual(
+                self.rows(committed) + self.rows(resumed[1:-1]), self.rows(chunks)
+            )
+
+    def test_bad_position_is_refused(self):
+        response = self.api.get("/api/sync/initial_sync_stream/", {"stage": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+class DroppingInitialStream:
+    """Serves feeds like initial_sync_stream, dropping once after fail_after chunks."""
+
+    def __init__(self, feeds, fail_after):
+        self.feeds = feeds
+        self.fail_after = fail_after
+        self.calls = []
+
+    def initial_sync_stream(self, stage=0, after=0):
+        self.calls.append((stage, after))
+        yield {"type": "start", "cursor": 7}
+        sent = 0
+        for index, (entity, rows) in enumerate(self.feeds):
+            if index < stage:
+                continue
+            rows = [row for row in rows if index > stage or row["id"] > after]
+            for start in range(0, len(rows), 2):
+                if sent == self.fail_after:
+                    self.fail_after = None
+                    raise ConnectionError("Connection dropped")
+                chunk = rows[start : start + 2]
+                yield {
+                    "type": "chunk",
+                    "entity": entity,
+                    "stage": index,
+                    "last": chunk[-1]["id"],
+                    "rows": chunk,
+                }
+                sent += 1
+        yield {"type": "end"}
+
+
+class InitialSetupResumeTests(TestCase):
+    def test_interrupted_sync_resumes_where_it_stopped(self):
+        def named(prefix, count):
+            return [
+                {"id": n, "name": f"{prefix} {n}", "description": "", "is_active": True}
+                for n in range(1, count + 1)
+            ]
+
+        feeds = [
+            ("categories", named("Category", 3)),
+            ("brands", named("Brand", 2)),
+            ("products", server_products(5)),
+            ("users", []),
+        ]
+        manager = SyncManager()
+        manager.api = DroppingInitialStream(feeds, fail_after=3)
+
+        # Two category chunks and one brand chunk commit before the drop
+        self.assertFalse(manager.initial_setup())
+        self.assertEqual(
+            (SyncCursor.get(INITIAL_STAGE), SyncCursor.get(INITIAL_AFTER)), (1, 2)
+        )
+        self.assertEqual((Category.objects.count(), Product.objects.count()), (3, 0))
+
+        self.assertTrue(manager.initial_setup())
+        self.assertEqual(manager.api.calls, [(0, 0), (1, 2)])
+        self.assertEqual(
+            (Category.objects.count(), Brand.objects.count(), Product.objects.count()),
+            (3, 2, 5),
+        )
+        self.assertEqual(SyncCursor.get(CHANGES_CURSOR), 7)
+        self.assertIsNone(SyncCursor.get(INITIAL_STAGE))
+
+
+@mock.patch("sync.views.PULL_PAGE_SIZE", 2)
+class PullLinesTests(TestCase):
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.products = [
+            Product.objects.create(
+                name=f"Product {n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+                quantity=100,
+            )
+            for n in range(2)
+        ]
+        self.moment = timezone.now() - timezone.timedelta(hours=1)
+
+    def sale(self, store_id, minutes=0, completed=True):
+        sale = Sale.objects.create(
+            cashier=self.cashier,
+            sale_type="RETAIL",
+            store_id=store_id,
+            completed_at=(
+                self.moment + timezone.timedelta(minutes=minutes) if completed else None
+            ),
+            synced_at=timezone.now(),
+        )
+        for product in self.products:
+            SaleItem.objects.create(
+                sale=sale,
+                product=product,
+                quantity=1,
+                unit_price=Decimal("20.00"),
+                total_amount=Decimal("20.00"),
+            )
+        return sale
+
+    def messages(self, lines):
+        return [json.loads(line) for line in lines]
+
+    def test_keyset_pages_return_every_row_once_across_ties(self):
+        # Three sales share a timestamp, so pages must break ties on id
+        sales = [self.sale("2", minutes) for minutes in (0, 1, 1, 1, 2)]
+        rows = Sale.objects.values("id", "completed_at")
+
+        pages = list(keyset_pages(rows, "completed_at"))
+
+        self.assertEqual([len(page) for page, _ in pages], [2, 2, 1])
+        ids = [row["id"] for page, _ in pages for row in page]
+        self.assertEqual(ids, [sale.id for sale in sales])
+
+        resumed = keyset_pages(rows, "completed_at", after=parse_cursor(pages[0][1]))
+        self.assertEqual([row["id"] for page, _ in resumed for row in page], ids[2:])
+
+        since = self.moment + timezone.timedelta(minutes=1)
+        recent = keyset_pages(rows, "completed_at", since=since)
+        self.assertEqual([row["id"] for page, _ in recent for row in page], ids[1:])
+
+    def test_pull_sales_lines_skip_own_and_open_sales(self):
+        theirs = [self.sale("2", 0), self.sale("3", 1), self.sale("2", 2)]
+        self.sale("1", 0)
+        self.sale("2", 0, completed=False)
+
+        messages = self.messages(pull_sales_lines("1"))
+
+        self.assertEqual(messages[-1], {"type": "end"})
+        pages = messages[:-1]
+        self.assertEqual([len(page["sales"]) for page in pages], [2, 1])
+        sales = [sale for page in pages for sale in page["sales"]]
+        self.assertEqual(
+            [sale["sale_number"] for sale in sales],
+            [sale.sale_number for sale in theirs],
+        )
+        self.assertNotIn("id", sales[0])
+        self.assertEqual(
+            [item["product_id"] for item in sales[0]["items"]],
+            [product.id for product in self.products],
+        )
+        self.assertEqual(parse_cursor(pages[0]["cursor"])[1], theirs[1].id)
+
+    def test_pull_returns_lines_skip_own_returns(self):
+        sale = self.sale("2")
+        item = sale.items.order_by("id").first()
+        theirs = Return.objects.create(
+            sale=sale, cashier=self.cashier, total_return_amount=20, store_id="2"
+        )
+        ReturnItem.objects.create(
+            return_fk=theirs,
+            sale_item=item,
+            quantity=1,
+            return_reason="FAULTY",
+            unit_price=Decimal("20.00"),
+            total_price=Decimal("20.00"),
+        )
+        Return.objects.create(sale=sale, cashier=self.cashier, store_id="1")
+
+        messages = self.messages(pull_returns_lines("1"))
+
+        self.assertEqual(messages[-1], {"type": "end"})
+        [page] = messages[:-1]
+        [pulled] = page["returns"]
+        self.assertEqual(
+            (pulled["return_number"], pulled["sale_number"]),
+            (theirs.return_number, sale.sale_number),
+        )
+        self.assertEqual(
+            [(line["sale_item_id"], line["product_id"]) for line in pulled["items"]],
+            [(item.id, item.product_id)],
+        )
+
+
+class SavePulledSalesTests(TestCase):
+    def setUp(self):
+        self.manager = SyncManager()
+        User.objects.create_user(
+            "till",
+            email="till@example.com",
+            password="x",
+            role="cashier",
+            server_id=50,
+        )
+        self.products = [
+            Product.objects.create(
+                name=f"Product {n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+                quantity=100,
+                server_id=100 + n,
+            )
+            for n in range(3)
+        ]
+
+    def pulled(self, count, start=1):
+        now = timezone.now().isoformat()
+        return [
+            {
+                "sale_number": f"SALE-20260101-2-{n:04d}",
+                "sale_type": "RETAIL",
+                "cashier_id": 50,
+                "total_amount": "60.00",
+                "discount_amount": "0.00",
+                "final_amount": "60.00",
+                "payment_method": "cash",
+                "money_received": "60.00",
+                "change_amount": "0.00",
+                "notes": "",
+                "created_at": now,
+                "completed_at": now,
+                "items": [
+                    {
+                        "product_id": product.server_id,
+                        "quantity": 2,
+                        "unit_price": "20.00",
+                        "discount_amount": "0.00",
+                        "total_amount": "40.00",
+                    }
+                    for product in self.products
+                ],
+            }
+            for n in range(start, start + count)
+        ]
+
+    def save(self, sales_data):
+        with transaction.atomic():
+            return self.manager._save_pulled_sales(sales_data)
+
+    def test_pulled_sales_move_stock_once(self):
+        sales_data = self.pulled(2)
+
+        self.assertEqual(self.save(sales_data), 2)
+        self.assertEqual(self.save(sales_data), 0)
+
+        self.assertEqual(SaleItem.objects.count(), 6)
+        for product in self.products:
+            product.refresh_from_db()
+            self.assertEqual((product.quantity, product.sold_count), (96, 4))
+            movements = product.stock_movements.order_by("id")
+            self.assertEqual(
+                [(m.movement_type, m.quantity, m.new_quantity) for m in movements],
+                [("OUT", 2, 98), ("OUT", 2, 96)],
+            )
+        self.assertEqual(StockMovement.objects.count(), 6)
+        sale = Sale.objects.get(sale_number=sales_data[0]["sale_number"])
+        self.assertIsNotNone(sale.synced_at)
+
+    def test_queries_do_not_grow_with_sales(self):
+        # First pull creates the report rows; later ones only update them
+        self.save(self.pulled(1))
+
+        with CaptureQueriesContext(connection) as one:
+            self.save(self.pulled(1, start=10))
+        with CaptureQueriesContext(connection) as many:
+            self.save(self.pulled(50, start=20))
+
+        # SQLite splits the 150-line inserts at its 999 parameter limit
+        self.assertLessEqual(len(many), len(one) + 2)
+
+
+@skipUnless(os.environ.get("BENCHMARK"), "set BENCHMARK=1 to run benchmarks")
+class ProductPullBenchmark(ProductPullFixture, TestCase):
+    """Initial pull of BENCHMARK_PRODUCTS (default 50,000) products."""
+
+    SIZE = int(os.environ.get("BENCHMARK_PRODUCTS", 50_000))
+    # Several thousand a second here; row-by-row syncing managed a few hundred
+    MIN_PRODUCTS_PER_SECOND = 1000
+
+    def test_initial_pull(self):
+        start = time.perf_counter()
+        query_count = self.pull(server_products(self.SIZE))
+        rate = self.SIZE / (time.perf_counter() - start)
+
+        self.assertGreater(
+            rate, self.MIN_PRODUCTS_PER_SECOND, f"{rate:.0f} products/s"
+        )
+        self.assertLess(query_count, self.SIZE / 10)
+        self.assertEqual(Product.objects.count(), self.SIZE)
+
+
+class MeasuredServerAPI(ServerAPI):
+    """ServerAPI counting body bytes sent and received over the wire."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+        self.received = 0
+
+    def _request(self, method, path, **kwargs):
+        response = super()._request(method, path, **kwargs)
+        self.sent += len(kwargs.get("data") or b"")
+        # Raw bytes read off the socket, before any gzip decoding
+        self.received += response.raw.tell()
+        return response
+
+
+@skipUnless(os.environ.get("BENCHMARK"), "set BENCHMARK=1 to run benchmarks")
+class SyncWireBenchmark(LiveServerTestCase):
+    """Bytes on the wire and wall time of a sync cycle against a live server.
+
+    The cycle is a health check, a push of BENCHMARK_PUSH_SALES (default
+    200) sales and two pulls of the change log. "Before" makes each call as
+    the terminal used to: a fresh connection, uncompressed bodies both ways,
+    a separate health probe. "After" goes through ServerAPI. Loopback has no
+    latency, so wall time here is mostly the server's own work and is only
+    held to not regress.
+    """
+
+    SALES = int(os.environ.get("BENCHMARK_PUSH_SALES", 200))
+
+    def setUp(self):
+        self.cashier = User.objects.create_user(
+            "till", email="till@example.com", password="x", role="cashier"
+        )
+        self.token = Token.objects.create(user=self.cashier).key
+        self.products = [
+            Product.objects.create(
+                name=f"Product {n}",
+                cost_price=Decimal("10.00"),
+                selling_price=Decimal("20.00"),
+                special_price=Decimal("12.00"),
+                quantity=10_000,
+            )
+            for n in range(3)
+        ]
+        for n in range(100):
+            record_change("product", self.products[n % 3].id)
+
+    def sales(self, store_id):
+        return [
+            {
+                "sale_number": f"SALE-20260101-{store_id}-{n:04d}",
+                "sale_type": "RETAIL",
+                "cashier_id": self.cashier.id,
+                "total_amount": "60.00",
+                "discount_amount": "0.00",
+                "final_amount": "60.00",
+                "payment_method": "cash",
+                "money_received": "100.00",
+                "change_amount": "40.00",
+                "notes": "",
+                "completed_at": timezone.now().isoformat(),
+                "items": [
+                    {
+                        "product_id": product.id,
+                        "quantity": 1,
+                        "unit_price": "20.00",
+                        "discount_amount": "0.00",
+                        "total_amount": "20.00",
+                    }
+                    for product in self.products
+                ],
+            }
+            for n in range(1, self.SALES + 1)
+        ]
+
+    def cycle_before(self):
+        url = self.live_server_url
+        headers = {
+            "Authorization": f"Token {self.token}",
+            "Accept-Encoding": "identity",
+        }
+        Terminal.register("7", "till-a")
+        sent = received = 0
+
+        def call(response):
+            nonlocal received
+            response.raise_for_status()
+            received += response.raw.tell()
+
+        started = time.perf_counter()
+        call(requests.get(f"{url}/api/sync/health/", headers=headers))
+        body = json.dumps(
+            {"store_id": "7", "install_key": "till-a", "sales": self.sales("7")}
+        ).encode()
+        sent += len(body)
+        call(
+            requests.post(
+                f"{url}/api/sync/push_sales/",
+                data=body,
+                headers={**headers, "Content-Type": "application/json"},
+            )
+        )
+        for _ in range(2):
+            call(
+                requests.get(
+                    f"{url}/api/sync/pull_changes/", {"cursor": 0}, headers=headers
+                )
+            )
+        return time.perf_counter() - started, sent + received
+
+    def cycle_after(self):
+        with override_settings(
+            SERVER_API_URL=self.live_server_url,
+            SERVER_API_TOKEN=self.token,
+            STORE_ID="8",
+        ):
+            api = MeasuredServerAPI()
+            api.install_key
+            started = time.perf_counter()
+            self.assertTrue(api.push_sales(self.sales("8"))["success"])
+            for _ in range(2):
+                self.assertIsNotNone(api.pull_changes(0))
+            elapsed = time.perf_counter() - started
+        return elapsed, api.sent + api.received
+
+    def test_cycle_bytes_and_time(self):
+        after_time, after_bytes = self.cycle_after()
+        before_time, before_bytes = self.cycle_before()
+
+        report = (
+            f"before {before_bytes} B in {before_time:.3f}s, "
+            f"after {after_bytes} B in {after_time:.3f}s"
+        )
+        self.assertEqual(Sale.objects.count(), 2 * self.SALES)
+        self.assertLess(after_bytes * 5, before_bytes, report)
+        self.assertLess(after_time, before_time * 2, report)
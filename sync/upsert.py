@@ -0,0 +1,68 @@
+from django.db import transaction, DatabaseError
+
+
+CHUNK_SIZE = 500
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def server_id_map(model, server_ids, *fields):
+    """Map server ids to local rows already pulled, without a query per row.
+
+    Returns {server_id: pk}, or {server_id: (pk, *fields)} when fields are given.
+    """
+    result = {}
+    for chunk in chunked({server_id for server_id in server_ids if server_id}):
+        rows = model.objects.filter(server_id__in=chunk).values_list(
+            "server_id", "pk", *fields
+        )
+        for server_id, *values in rows:
+            result[server_id] = values[0] if not fields else tuple(values)
+    return result
+
+
+def upsert(model, objs, update_fields):
+    """Insert or update objs keyed on server_id, one statement per chunk.
+
+    A chunk the database rejects (say a local row already uses a name the
+    server sent) is retried row by row, so one bad row only skips itself.
+    Returns (synced_count, error_count).
+    """
+    synced_count = 0
+    error_count = 0
+
+    for chunk in chunked(objs):
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    chunk,
+                    update_conflicts=True,
+                    unique_fields=["server_id"],
+                    update_fields=update_fields,
+                )
+            synced_count += len(chunk)
+            continue
+        except DatabaseError as e:
+            print(
+                f"  Bulk sync of {len(chunk)} {model._meta.verbose_name_plural} "
+                f"failed ({e}), retrying one by one"
+            )
+
+        attnames = [model._meta.get_field(name).attname for name in update_fields]
+        for obj in chunk:
+            try:
+                with transaction.atomic():
+                    model.objects.update_or_create(
+                        server_id=obj.server_id,
+                        defaults={name: getattr(obj, name) for name in attnames},
+                    )
+                synced_count += 1
+            except Exception as e:
+                error_count += 1
+                print(f"  Error syncing {model._meta.verbose_name} {obj}: {e}")
+
+    return synced_count, error_count
@@ -12,11 +12,26 @@ urlpatterns = [
         SyncAPIViewSet.as_view({"post": "initial_sync"}),
         name="sync-initial",
     ),
+    path(
+        "api/sync/initial_sync_stream/",
+        SyncAPIViewSet.as_view({"get": "initial_sync_stream"}),
+        name="sync-initial-stream",
+    ),
     path(
         "api/sync/pull_updates/",
         SyncAPIViewSet.as_view({"get": "pull_updates"}),
         name="sync-pull",
     ),
+    path(
+        "api/sync/pull_changes/",
+        SyncAPIViewSet.as_view({"get": "pull_changes"}),
+        name="sync-pull-changes",
+    ),
+    path(
+        "api/sync/register_terminal/",
+        SyncAPIViewSet.as_view({"post": "register_terminal"}),
+        name="sync-register-terminal",
+    ),
     path(
         "api/sync/push_sales/",
         SyncAPIViewSet.as_view({"post": "push_sales"}),
@@ -5,8 +5,21 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Count, Sum, F, Q
+from django.utils.dateparse import parse_datetime
 from products.models import Product, Category, Brand
 from sales.models import Sale, SaleItem, Return, ReturnItem
+from reports.models import SalesRollup
+from reports.rollup import record_return
+from sales.sequences import check_store_id
+from .ingest import ingest_sales, numbers_owned_elsewhere
+from .changelog import (
+    PAGE_SIZE,
+    changes_since,
+    current_cursor,
+    note_terminal_cursor,
+    prune_changes,
+)
 from .serializers import (
     UserSyncSerializer,
     ProductSyncSerializer,
@@ -15,11 +28,14 @@ from .serializers import (
     SaleSyncSerializer,
     ReturnSyncSerializer,
 )
+import json
 import traceback
+from collections import defaultdict
 from django.views.decorators.http import require_http_methods
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse
-from sync.models import SyncLog
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from sync.models import SyncLog, SyncDeadLetter, Outbox, Terminal
 from sync.background_sync import sync_service
 from sales.models import Sale, Return
 from django.conf import settings
@@ -27,6 +43,190 @@ from django.conf import settings
 User = get_user_model()
 User = get_user_model()
 
+# (change-log model, response key, queryset, serializer) served by pull_changes
+CHANGE_FEEDS = [
+    ("category", "categories", Category.objects.all(), CategorySyncSerializer),
+    ("brand", "brands", Brand.objects.all(), BrandSyncSerializer),
+    (
+        "product",
+        "products",
+        Product.objects.prefetch_related("barcodes"),
+        ProductSyncSerializer,
+    ),
+    ("user", "users", User.objects.all(), UserSyncSerializer),
+]
+
+# (response key, queryset, serializer) streamed by initial_sync_stream, in order
+INITIAL_FEEDS = [
+    ("categories", Category.objects.filter(is_active=True), CategorySyncSerializer),
+    ("brands", Brand.objects.filter(is_active=True), BrandSyncSerializer),
+    (
+        "products",
+        Product.objects.filter(is_active=True).prefetch_related("barcodes"),
+        ProductSyncSerializer,
+    ),
+    ("users", User.objects.filter(is_active=True), UserSyncSerializer),
+]
+
+INITIAL_CHUNK_SIZE = 500
+
+PULL_PAGE_SIZE = 200
+
+# Columns pull_sales and pull_returns send, read with values()
+SALE_PULL_FIELDS = [
+    "id",
+    "sale_number",
+    "sale_type",
+    "cashier_id",
+    "total_amount",
+    "discount_amount",
+    "final_amount",
+    "payment_method",
+    "money_received",
+    "change_amount",
+    "notes",
+    "created_at",
+    "completed_at",
+]
+SALE_ITEM_PULL_FIELDS = [
+    "product_id",
+    "quantity",
+    "unit_price",
+    "discount_amount",
+    "total_amount",
+]
+RETURN_PULL_FIELDS = [
+    "id",
+    "return_number",
+    "sale_number",
+    "cashier_id",
+    "total_return_amount",
+    "notes",
+    "created_at",
+]
+RETURN_ITEM_PULL_FIELDS = [
+    "product_id",
+    "sale_item_id",
+    "quantity",
+    "return_reason",
+    "unit_price",
+    "total_price",
+]
+
+
+def ndjson(message):
+    return json.dumps(message, cls=DjangoJSONEncoder) + "\n"
+
+
+def initial_sync_lines(stage=0, after=0):
+    """The initial sync as NDJSON: a start line, keyset-paged chunks, an end line.
+
+    Each chunk carries its stage and last id, so a terminal that dies part way
+    can ask to resume after the last chunk it committed.
+    """
+    yield ndjson({"type": "start", "cursor": current_cursor()})
+
+    for index, (key, queryset, serializer) in enumerate(INITIAL_FEEDS):
+        if index < stage:
+            continue
+        last = after if index == stage else 0
+
+        while True:
+            rows = list(queryset.filter(pk__gt=last).order_by("pk")[:INITIAL_CHUNK_SIZE])
+            if not rows:
+                break
+            last = rows[-1].pk
+            yield ndjson(
+                {
+                    "type": "chunk",
+                    "entity": key,
+                    "stage": index,
+                    "last": last,
+                    "rows": serializer(rows, many=True).data,
+                }
+            )
+
+    yield ndjson({"type": "end"})
+
+
+def parse_cursor(cursor):
+    """Split a pull cursor "<timestamp>|<id>" into (datetime, id)."""
+    moment, _, pk = cursor.rpartition("|")
+    moment = parse_datetime(moment)
+    if moment is None:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return moment, int(pk)
+
+
+def keyset_pages(queryset, time_field, after=None, since=None):
+    """Yield pages of values() rows ordered by (time_field, id).
+
+    Each page is fetched with a seek on the last row of the one before, so
+    deep pages cost the same as the first.
+    """
+    if since and not after:
+        queryset = queryset.filter(**{f"{time_field}__gte": since})
+    queryset = queryset.order_by(time_field, "id")
+
+    while True:
+        page = queryset
+        if after:
+            moment, pk = after
+            page = page.filter(
+                Q(**{f"{time_field}__gt": moment}) | Q(**{time_field: moment, "id__gt": pk})
+            )
+        rows = list(page[:PULL_PAGE_SIZE])
+        if not rows:
+            return
+        after = (rows[-1][time_field], rows[-1]["id"])
+        yield rows, f"{after[0].isoformat()}|{after[1]}"
+
+
+def pull_sales_lines(store_id, after=None, since=None):
+    """Completed sales from other stores as NDJSON pages, then an end line."""
+    sales = Sale.objects.filter(completed_at__isnull=False)
+    if store_id:
+        sales = sales.exclude(store_id=store_id)
+    sales = sales.values(*SALE_PULL_FIELDS)
+
+    for rows, cursor in keyset_pages(sales, "completed_at", after, since):
+        items = defaultdict(list)
+        for item in SaleItem.objects.filter(
+            sale_id__in=[row["id"] for row in rows]
+        ).values("sale_id", *SALE_ITEM_PULL_FIELDS):
+            items[item.pop("sale_id")].append(item)
+
+        for row in rows:
+            row["items"] = items[row.pop("id")]
+        yield ndjson({"type": "page", "sales": rows, "cursor": cursor})
+
+    yield ndjson({"type": "end"})
+
+
+def pull_returns_lines(store_id, after=None, since=None):
+    """Returns from other stores as NDJSON pages, then an end line."""
+    returns = Return.objects.all()
+    if store_id:
+        returns = returns.exclude(store_id=store_id)
+    returns = returns.annotate(sale_number=F("sale__sale_number")).values(
+        *RETURN_PULL_FIELDS
+    )
+
+    for rows, cursor in keyset_pages(returns, "created_at", after, since):
+        items = defaultdict(list)
+        for item in (
+            ReturnItem.objects.filter(return_fk_id__in=[row["id"] for row in rows])
+            .annotate(product_id=F("sale_item__product_id"))
+            .values("return_fk_id", *RETURN_ITEM_PULL_FIELDS)
+        ):
+            items[item.pop("return_fk_id")].append(item)
+
+        for row in rows:
+            row["items"] = items[row.pop("id")]
+        yield ndjson({"type": "page", "returns": rows, "cursor": cursor})
+
+    yield ndjson({"type": "end"})
+
 
 class SyncAPIViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -36,126 +236,73 @@ class SyncAPIViewSet(viewsets.ViewSet):
         """Health check endpoint"""
         return Response({"status": "ok", "timestamp": timezone.now().isoformat()})
 
-    @action(detail=False, methods=["get"])
-    def pull_sales(self, request):
-        """Send sales to POS terminals"""
-        try:
-            since = request.query_params.get("since")
-            store_id = request.query_params.get("store_id")
-
-            if not since:
-                return Response({"error": "since parameter required"}, status=400)
+    @action(detail=False, methods=["post"])
+    def register_terminal(self, request):
+        """Let a terminal claim its store id before it pushes anything"""
+        store_id = str(request.data.get("store_id") or "")
+        install_key = str(request.data.get("install_key") or "")
 
-            sales = (
-                Sale.objects.filter(completed_at__gte=since, completed_at__isnull=False)
-                .select_related("cashier")
-                .prefetch_related("items__product")
+        try:
+            check_store_id(store_id)
+        except ValueError as e:
+            return Response({"success": False, "error": str(e)}, status=400)
+        if not install_key:
+            return Response(
+                {"success": False, "error": "install_key required"}, status=400
             )
 
-            sales_data = []
-            for sale in sales:
-                items_data = []
-                for item in sale.items.all():
-                    items_data.append(
-                        {
-                            "product_id": item.product.id,
-                            "quantity": item.quantity,
-                            "unit_price": str(item.unit_price),
-                            "discount_amount": str(item.discount_amount),
-                            "total_amount": str(item.total_amount),
-                        }
-                    )
-
-                sales_data.append(
-                    {
-                        "sale_number": sale.sale_number,
-                        "sale_type": sale.sale_type,
-                        "cashier_id": sale.cashier.id,
-                        "total_amount": str(sale.total_amount),
-                        "discount_amount": str(sale.discount_amount),
-                        "final_amount": str(sale.final_amount),
-                        "payment_method": sale.payment_method,
-                        "money_received": (
-                            str(sale.money_received) if sale.money_received else None
-                        ),
-                        "change_amount": (
-                            str(sale.change_amount) if sale.change_amount else None
-                        ),
-                        "notes": sale.notes,
-                        "created_at": sale.created_at.isoformat(),
-                        "completed_at": sale.completed_at.isoformat(),
-                        "items": items_data,
-                    }
-                )
-
+        if store_id == str(settings.STORE_ID) or not Terminal.register(
+            store_id, install_key
+        ):
             return Response(
                 {
-                    "sales": sales_data,
-                    "count": len(sales_data),
-                    "sync_timestamp": timezone.now().isoformat(),
-                }
+                    "success": False,
+                    "error": f"Store id {store_id} is already in use; "
+                    "give this terminal a unique STORE_ID",
+                },
+                status=409,
             )
+        return Response({"success": True, "store_id": store_id})
+
+    def _unregistered(self, request):
+        """A 403 response unless the pushing terminal owns its store id"""
+        store_id = str(request.data.get("store_id") or "")
+        if Terminal.verify(store_id, str(request.data.get("install_key") or "")):
+            return None
+        return Response(
+            {
+                "success": False,
+                "error": f"Terminal {store_id!r} is not registered to this install",
+            },
+            status=403,
+        )
 
-        except Exception as e:
-            error_detail = traceback.format_exc()
-            print(f"Pull sales error: {error_detail}")
-            return Response({"error": str(e), "traceback": error_detail}, status=500)
+    @action(detail=False, methods=["get"])
+    def pull_sales(self, request):
+        """Stream other stores' sales to POS, resumable by cursor"""
+        return self._pull_stream(request, pull_sales_lines)
 
     @action(detail=False, methods=["get"])
     def pull_returns(self, request):
-        """Send returns to POS terminals"""
-        try:
-            since = request.query_params.get("since")
-            store_id = request.query_params.get("store_id")
-
-            if not since:
-                return Response({"error": "since parameter required"}, status=400)
+        """Stream other stores' returns to POS, resumable by cursor"""
+        return self._pull_stream(request, pull_returns_lines)
 
-            returns = (
-                Return.objects.filter(created_at__gte=since)
-                .select_related("cashier", "sale")
-                .prefetch_related("items__sale_item__product")
-            )
-
-            returns_data = []
-            for return_obj in returns:
-                items_data = []
-                for item in return_obj.items.all():
-                    items_data.append(
-                        {
-                            "product_id": item.sale_item.product.id,
-                            "sale_item_id": item.sale_item.id,
-                            "quantity": item.quantity,
-                            "return_reason": item.return_reason,
-                            "unit_price": str(item.unit_price),
-                            "total_price": str(item.total_price),
-                        }
-                    )
-
-                returns_data.append(
-                    {
-                        "return_number": return_obj.return_number,
-                        "sale_number": return_obj.sale.sale_number,
-                        "cashier_id": return_obj.cashier.id,
-                        "total_return_amount": str(return_obj.total_return_amount),
-                        "notes": return_obj.notes,
-                        "created_at": return_obj.created_at.isoformat(),
-                        "items": items_data,
-                    }
-                )
+    def _pull_stream(self, request, lines):
+        store_id = request.query_params.get("store_id", "")
+        after = request.query_params.get("after")
+        since = request.query_params.get("since")
 
-            return Response(
-                {
-                    "returns": returns_data,
-                    "count": len(returns_data),
-                    "sync_timestamp": timezone.now().isoformat(),
-                }
-            )
-
-        except Exception as e:
-            error_detail = traceback.format_exc()
-            print(f"Pull returns error: {error_detail}")
-            return Response({"error": str(e), "traceback": error_detail}, status=500)
+        try:
+            after = parse_cursor(after) if after else None
+            since = parse_datetime(since) if since else None
+        except ValueError:
+            return Response({"error": "Invalid after or since parameter"}, status=400)
+        if not after and not since:
+            return Response({"error": "after or since parameter required"}, status=400)
+
+        return StreamingHttpResponse(
+            lines(store_id, after, since), content_type="application/x-ndjson"
+        )
 
     @action(detail=False, methods=["post"])
     def initial_sync(self, request):
@@ -163,6 +310,9 @@ class SyncAPIViewSet(viewsets.ViewSet):
         try:
             store_id = request.data.get("store_id")
 
+            # Taken before reading, so changes made while serialising are re-sent
+            cursor = current_cursor()
+
             users = User.objects.filter(is_active=True)
             categories = Category.objects.filter(is_active=True)
             brands = Brand.objects.filter(is_active=True)
@@ -175,6 +325,7 @@ class SyncAPIViewSet(viewsets.ViewSet):
                     "brands": BrandSyncSerializer(brands, many=True).data,
                     "products": ProductSyncSerializer(products, many=True).data,
                     "sync_timestamp": timezone.now().isoformat(),
+                    "cursor": cursor,
                 }
             )
         except Exception as e:
@@ -182,6 +333,19 @@ class SyncAPIViewSet(viewsets.ViewSet):
             print(f"Initial sync error: {error_detail}")
             return Response({"error": str(e), "traceback": error_detail}, status=500)
 
+    @action(detail=False, methods=["get"])
+    def initial_sync_stream(self, request):
+        """Stream all active data to POS in chunks, resumable by stage and id"""
+        try:
+            stage = int(request.query_params.get("stage", 0))
+            after = int(request.query_params.get("after", 0))
+        except ValueError:
+            return Response({"error": "stage and after must be integers"}, status=400)
+
+        return StreamingHttpResponse(
+            initial_sync_lines(stage, after), content_type="application/x-ndjson"
+        )
+
     @action(detail=False, methods=["get"])
     def pull_updates(self, request):
         """Pull updates since last sync"""
@@ -219,95 +383,79 @@ class SyncAPIViewSet(viewsets.ViewSet):
             print(f"Pull updates error: {error_detail}")
             return Response({"error": str(e), "traceback": error_detail}, status=500)
 
+    @action(detail=False, methods=["get"])
+    def pull_changes(self, request):
+        """Send one page of changes after the terminal's change-log cursor"""
+        try:
+            try:
+                cursor = int(request.query_params.get("cursor", 0))
+                limit = int(request.query_params.get("limit", PAGE_SIZE))
+            except ValueError:
+                return Response(
+                    {"error": "cursor and limit must be integers"}, status=400
+                )
+
+            store_id = request.query_params.get("store_id")
+            if store_id:
+                # Asking for changes after cursor means everything up to it applied
+                note_terminal_cursor(store_id, cursor)
+
+            changes, next_cursor, has_more = changes_since(cursor, limit)
+            if not has_more:
+                prune_changes()
+
+            data = {"cursor": next_cursor, "has_more": has_more, "deleted": {}}
+            for model, key, queryset, serializer in CHANGE_FEEDS:
+                rows = changes.get(model, {})
+                upserts = [pk for pk, action in rows.items() if action == "upsert"]
+                objects = list(queryset.filter(pk__in=upserts)) if upserts else []
+                found = {obj.pk for obj in objects}
+
+                data[key] = serializer(objects, many=True).data
+                # Rows deleted since they were logged become tombstones too
+                data["deleted"][key] = [pk for pk in rows if pk not in found]
+
+            return Response(data)
+        except Exception as e:
+            error_detail = traceback.format_exc()
+            print(f"Pull changes error: {error_detail}")
+            return Response({"error": str(e), "traceback": error_detail}, status=500)
+
     @action(detail=False, methods=["post"])
     def push_sales(self, request):
-        """Receive sales from POS"""
+        """Receive sales from POS, stored in batches of SYNC_PUSH_BATCH_SIZE"""
         try:
+            refused = self._unregistered(request)
+            if refused:
+                return refused
+
             store_id = request.data.get("store_id")
             sales_data = request.data.get("sales", [])
 
             if not sales_data:
                 return Response({"success": True, "message": "No sales to sync"})
 
-            synced_count = 0
-            error_count = 0
-            errors = []
-
-            with transaction.atomic():
-                for sale_data in sales_data:
-                    try:
-                        cashier = User.objects.filter(
-                            id=sale_data["cashier_id"]
-                        ).first()
-
-                        if not cashier:
-                            error_msg = f"Cashier not found: {sale_data['cashier_id']}"
-                            print(error_msg)
-                            errors.append(
-                                {
-                                    "sale": sale_data.get("sale_number"),
-                                    "error": error_msg,
-                                }
-                            )
-                            error_count += 1
-                            continue
-
-                        sale, created = Sale.objects.update_or_create(
-                            sale_number=sale_data["sale_number"],
-                            defaults={
-                                "sale_type": sale_data["sale_type"],
-                                "cashier": cashier,
-                                "total_amount": sale_data["total_amount"],
-                                "discount_amount": sale_data.get("discount_amount", 0),
-                                "final_amount": sale_data["final_amount"],
-                                "payment_method": sale_data["payment_method"],
-                                "money_received": sale_data.get("money_received"),
-                                "change_amount": sale_data.get("change_amount"),
-                                "notes": sale_data.get("notes", ""),
-                                "created_at": sale_data["created_at"],
-                                "completed_at": sale_data["completed_at"],
-                            },
-                        )
-
-                        for item_data in sale_data.get("items", []):
-                            product = Product.objects.filter(
-                                id=item_data["product_id"]
-                            ).first()
-
-                            if not product:
-                                print(f"Product not found: {item_data['product_id']}")
-                                continue
-
-                            SaleItem.objects.update_or_create(
-                                sale=sale,
-                                product=product,
-                                defaults={
-                                    "quantity": item_data["quantity"],
-                                    "unit_price": item_data["unit_price"],
-                                    "discount_amount": item_data.get(
-                                        "discount_amount", 0
-                                    ),
-                                    "total_amount": item_data["total_amount"],
-                                },
-                            )
+            batches = ingest_sales(
+                sales_data, settings.SYNC_PUSH_BATCH_SIZE, store_id or ""
+            )
 
-                        synced_count += 1
-                        print(f"Synced sale: {sale_data['sale_number']}")
-
-                    except Exception as e:
-                        error_count += 1
-                        error_msg = f"Error syncing sale {sale_data.get('sale_number')}: {str(e)}"
-                        print(error_msg)
-                        errors.append(
-                            {"sale": sale_data.get("sale_number"), "error": str(e)}
-                        )
-                        traceback.print_exc()
+            accepted = [number for batch in batches for number in batch["accepted"]]
+            errors = [error for batch in batches for error in batch["errors"]]
+            synced_count = len(accepted)
+            error_count = len(errors)
+            print(f"Synced {synced_count} sales, {error_count} errors")
 
             response_data = {
                 "success": True,
                 "synced_count": synced_count,
                 "error_count": error_count,
                 "message": f"Synced {synced_count} sales, {error_count} errors",
+                "accepted": accepted,
+                "batches": [
+                    {"accepted": len(batch["accepted"]), "errors": len(batch["errors"])}
+                    for batch in batches
+                ],
+                "max_batch": settings.SYNC_PUSH_BATCH_SIZE,
             }
 
             if errors:
@@ -327,15 +475,28 @@ class SyncAPIViewSet(viewsets.ViewSet):
     def push_returns(self, request):
         """Receive returns from POS"""
         try:
+            refused = self._unregistered(request)
+            if refused:
+                return refused
+
             store_id = request.data.get("store_id")
             returns_data = request.data.get("returns", [])
 
             if not returns_data:
                 return Response({"success": True, "message": "No returns to sync"})
 
+            taken = numbers_owned_elsewhere(
+                Return,
+                "return_number",
+                [r.get("return_number") for r in returns_data],
+                store_id or "",
+            )
+
             synced_count = 0
             error_count = 0
             errors = []
+            accepted = []
+            created_ids = []
 
             with transaction.atomic():
                 for return_data in returns_data:
@@ -358,6 +519,17 @@ class SyncAPIViewSet(viewsets.ViewSet):
                             error_count += 1
                             continue
 
+                        number = return_data.get("return_number")
+                        if number in taken:
+                            error_msg = (
+                                f"Return number {number} already belongs to "
+                                f"store {taken[number]}"
+                            )
+                            print(error_msg)
+                            errors.append({"return": number, "error": error_msg})
+                            error_count += 1
+                            continue
+
                         sale = Sale.objects.filter(
                             sale_number=return_data["sale_number"]
                         ).first()
@@ -384,6 +556,7 @@ class SyncAPIViewSet(viewsets.ViewSet):
                                 ],
                                 "notes": return_data.get("notes", ""),
                                 "created_at": return_data["created_at"],
+                                "store_id": store_id or "",
                             },
                         )
 
@@ -409,7 +582,11 @@ class SyncAPIViewSet(viewsets.ViewSet):
                                 },
                             )
 
+                        if created:
+                            created_ids.append(return_obj.id)
+
                         synced_count += 1
+                        accepted.append(return_data["return_number"])
                         print(f"Synced return: {return_data['return_number']}")
 
                     except Exception as e:
@@ -424,10 +601,16 @@ class SyncAPIViewSet(viewsets.ViewSet):
                         )
                         traceback.print_exc()
 
+                for return_obj in Return.objects.filter(
+                    id__in=created_ids
+                ).select_related("sale"):
+                    record_return(return_obj)
+
             response_data = {
                 "success": True,
                 "synced_count": synced_count,
                 "error_count": error_count,
+                "accepted": accepted,
                 "message": f"Synced {synced_count} returns, {error_count} errors",
             }
 
@@ -464,11 +647,16 @@ def sync_status(request):
             }
         )
 
-    unsynced_sales = Sale.objects.filter(
-        completed_at__isnull=False, synced_at__isnull=True
-    ).count()
+    pending = dict(
+        Outbox.objects.values_list("kind").annotate(count=Count("id")).order_by()
+    )
+    parked = dict(
+        SyncDeadLetter.objects.values_list("kind").annotate(count=Count("id")).order_by()
+    )
+    unsynced_sales = pending.get("sale", 0) + parked.get("sale", 0)
+    unsynced_returns = pending.get("return", 0) + parked.get("return", 0)
 
-    unsynced_returns = Return.objects.filter(synced_at__isnull=True).count()
+    dead_letters = sum(parked.values())
 
     last_syncs = {}
     for sync_type in [
@@ -498,11 +686,15 @@ def sync_status(request):
     synced_brands = Brand.objects.filter(server_id__isnull=False).count()
     synced_users = User.objects.filter(server_id__isnull=False).count()
 
-    total_sales = Sale.objects.filter(completed_at__isnull=False).count()
-    synced_sales = Sale.objects.filter(synced_at__isnull=False).count()
+    # Completed sales and returns are already counted in the report rollups
+    totals = SalesRollup.objects.aggregate(
+        sales=Sum("sale_count"), returns=Sum("return_count")
+    )
+    total_sales = totals["sales"] or 0
+    synced_sales = max(total_sales - unsynced_sales, 0)
 
-    total_returns = Return.objects.count()
-    synced_returns = Return.objects.filter(synced_at__isnull=False).count()
+    total_returns = totals["returns"] or 0
+    synced_returns = max(total_returns - unsynced_returns, 0)
 
     # Server connection test
     try:
@@ -527,6 +719,7 @@ def sync_status(request):
                 settings.SERVER_API_URL if hasattr(settings, "SERVER_API_URL") else None
             ),
             "unsynced": {"sales": unsynced_sales, "returns": unsynced_returns},
+            "dead_letters": dead_letters,
             "synced_from_server": {
                 "products": synced_products,
                 "categories": synced_categories,